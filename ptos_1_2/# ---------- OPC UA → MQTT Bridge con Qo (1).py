@@ -7,6 +7,8 @@
 
 import os
 import time
+import json
+import threading
 import argparse
 from opcua import Client, ua
 import paho.mqtt.client as mqtt
@@ -14,13 +16,52 @@ import uuid
 import ssl
 import logging # ¡NUEVO! Importamos el logger
 
+from suscripcion_opc import PublicadorCambios, suscribir, supera_banda
+from lectura_opc import armar_peticion, leer_lote, lectura_buena
+from cache_nodos_opc import CacheNodos
+from reintentos import BackoffExponencial
+from outbox_mqtt import OutboxMQTT
+from mapa_tags import MapaTags, RUTA_POR_DEFECTO as RUTA_MAPA_TAGS, DISPOSITIVO_POR_DEFECTO
+from traza_latencia import TRAZA_NO, TRAZA_PROPIEDADES, preparar, traza_opc, ns_desde_fecha, propiedades_mqtt
+from agregacion_ventanas import AgregadorVentanas, duraciones, topico_agregado
+from publicacion_mqtt import FORMATO_NO, AliasTopicos, EstadosRetenidos, codificar_escaneo
+
 # ----------------------------
 # Parámetros base
 # ----------------------------
 OPC_URL = os.getenv("OPC_URL", "opc.tcp://localhost:4840/mi_servidor/")
 TOPIC_BASE = os.getenv("TOPIC_BASE", "pci") 
 PUBLISH_PERIOD = float(os.getenv("PUBLISH_PERIOD", "2.0"))
-RECONNECT_PERIOD = 5.0
+# Reconexión con backoff exponencial + jitter (de RECONNECT_BASE hasta RECONNECT_MAX)
+RECONNECT_BASE = float(os.getenv("RECONNECT_BASE", "0.5"))
+RECONNECT_MAX = float(os.getenv("RECONNECT_MAX", "30.0"))
+
+# Mapa de tags compartido con el maestro y el servidor OPC UA
+# (nodo OPC, tópico MQTT, QoS y retain de cada tag de datos)
+MAPA_TAGS = MapaTags.cargar(os.getenv("MAPA_TAGS", RUTA_MAPA_TAGS))
+
+# Namespace (por URI, no por índice) y nombres de los nodos del gateway
+OPC_NAMESPACE = os.getenv("OPC_NAMESPACE", "Servidor_MODBUS_Gateway")
+OPC_DISPOSITIVO = DISPOSITIVO_POR_DEFECTO # Contadores y estados (los tags, en su dispositivo)
+NOMBRES_NODOS = {
+    # Datos
+    **{definicion.clave: (definicion.dispositivo, definicion.nodo_opc) for definicion in MAPA_TAGS},
+    # Contadores
+    "ok":      "Modbus_Aceptadas",
+    "crc":     "Modbus_Error_CRC",
+    "nr":      "Modbus_No_Alcanzado",
+    "exc":     "Modbus_Excepcion_Esclavo",
+    # ¡NUEVOS TAGS DE ESTADO!
+    "esclavo": "Modbus_Estado_Esclavo",
+    "maestro": "Modbus_Estado_Maestro",
+}
+
+# --- Modo de lectura OPC ---
+# "polling": lee todos los nodos cada PUBLISH_PERIOD y los publica.
+# "suscripcion": el servidor notifica cambios; solo se publica lo que cambia.
+BRIDGE_MODO = os.getenv("BRIDGE_MODO", "polling")
+SUB_PUBLISHING_MS = float(os.getenv("SUB_PUBLISHING_MS", "500"))
+SUB_SAMPLING_MS = float(os.getenv("SUB_SAMPLING_MS", "250"))
 
 # --- ¡NUEVOS TÓPICOS DE ESTADO! ---
 TOPIC_MODBUS_ESCLAVO = "modbus_esclavo" 
@@ -37,15 +78,57 @@ CA_CERT_FILE = "emqxsl-ca.crt"
 # ----------------------------------------
 
 # ----------------------------
-# QoS por variable (Sin cambios)
+# QoS (la de cada tag de datos viene del mapa de tags)
 # ----------------------------
-PUB_QOS_REG0 = int(os.getenv("PUB_QOS_REG0", "0"))
-PUB_QOS_REG1 = int(os.getenv("PUB_QOS_REG1", "0"))
-PUB_QOS_REG2 = int(os.getenv("PUB_QOS_REG2", "0"))
-PUB_QOS_REG3 = int(os.getenv("PUB_QOS_REG3", "0"))
 PUB_QOS_STATUS = 1 
 # ----------------------------
 
+# --- Outbox en disco (store-and-forward durante cortes del broker) ---
+OUTBOX_DB = os.getenv("OUTBOX_DB", "outbox_mqtt.db")
+OUTBOX_MAX_MENSAJES = int(os.getenv("OUTBOX_MAX_MENSAJES", "500000"))
+OUTBOX_RETENCION_H = float(os.getenv("OUTBOX_RETENCION_H", "72"))
+OUTBOX_POLITICA = os.getenv("OUTBOX_POLITICA", "viejos") # "viejos" | "nuevos": qué se descarta al llenarse
+OUTBOX_TASA_REENVIO = float(os.getenv("OUTBOX_TASA_REENVIO", "200")) # msg/s al vaciar tras reconectar
+
+# --- Traza de latencia de los tags de datos (ver traza_latencia.py) ---
+# "no" | "propiedades" (User Properties, conecta con MQTT v5) | "sobre" (payload JSON {"v", "traza"})
+TRAZA_MQTT = os.getenv("TRAZA_MQTT", TRAZA_NO)
+
+# --- Banda muerta por tag (modo suscripción) ---
+# (absoluta, porcentual): se publica solo si el cambio supera ambas.
+# Por tag desde mapa_tags.json ("banda_muerta"); si no la trae, la por
+# defecto (DEADBAND_ABS / DEADBAND_PCT). DEADBAND_<CLAVE>_ABS / _PCT
+# (p. ej. DEADBAND_POT_ABS) pisan la de un tag puntual.
+BANDA_POR_DEFECTO = (float(os.getenv("DEADBAND_ABS", "0")), float(os.getenv("DEADBAND_PCT", "0")))
+
+def banda_muerta(definicion):
+    absoluta, porcentual = definicion.banda_muerta or BANDA_POR_DEFECTO
+    prefijo = f"DEADBAND_{definicion.clave.upper()}"
+    return (float(os.getenv(f"{prefijo}_ABS", absoluta)), float(os.getenv(f"{prefijo}_PCT", porcentual)))
+
+BANDA_MUERTA = {definicion.clave: banda_muerta(definicion) for definicion in MAPA_TAGS}
+
+# --- Agregación por ventanas de los tags de datos (ver agregacion_ventanas.py) ---
+# AGG_VENTANAS: duraciones en s separadas por coma (ej. "10,60"); vacío = desactivada.
+# Cada ventana cerrada se publica en {TOPIC_BASE}/agg/{duración}s/{tópico del tag}.
+AGG_VENTANAS = duraciones(os.getenv("AGG_VENTANAS", ""))
+AGG_QOS = int(os.getenv("AGG_QOS", "1"))
+AGG_GRACIA = float(os.getenv("AGG_GRACIA", "0")) # s que una ventana espera muestras atrasadas
+# Valores crudos de los tags de datos: "todos" (cada lectura / notificación),
+# "cambios" (solo si superan la banda muerta: alarmas) o "no" (solo agregados)
+PUBLICAR_CRUDOS = os.getenv("PUBLICAR_CRUDOS", "todos")
+
+# --- Publicación compacta (ver publicacion_mqtt.py) ---
+# PAYLOAD_ESCANEO: "no" (un tópico por tag) | "json" | "msgpack": un solo mensaje
+# por ciclo con los tags de datos y los contadores en {TOPIC_BASE}/escaneo.
+# Los estados retenidos siguen en sus tópicos, y se publican solo al cambiar.
+PAYLOAD_ESCANEO = os.getenv("PAYLOAD_ESCANEO", FORMATO_NO)
+QOS_ESCANEO = int(os.getenv("QOS_ESCANEO", "0"))
+TOPICO_ESCANEO = f"{TOPIC_BASE}/escaneo"
+# TOPIC_ALIAS=1: Topic Alias de MQTT v5 en los tópicos QoS 0 (conecta con v5)
+TOPIC_ALIAS = os.getenv("TOPIC_ALIAS", "0") == "1"
+MQTT_V5 = TRAZA_MQTT == TRAZA_PROPIEDADES or TOPIC_ALIAS
+
 # ... (Parser de CLI omitido por brevedad, no cambia) ...
 
 # ----------------------------
@@ -56,6 +139,10 @@ def on_connect(client, userdata, flags, reason_code, properties=None):
     # (El código 0 significa éxito)
     if reason_code == 0:
         print(f"✅ ¡ÉXITO! Conectado a MQTT {BROKER}:{PORT} (rc=0)")
+        # Los alias valen por conexión, y el LWT pudo pisar los retenidos
+        if alias_topicos is not None:
+            alias_topicos.reiniciar(properties)
+        estados_retenidos.olvidar()
     else:
         print(f"🛑 FALLO AL CONECTAR. El broker rechazó la conexión con código: {reason_code}")
         print("Códigos comunes: 2=ID de cliente inválido, 4=Usuario/Pass inválido, 5=No autorizado")
@@ -76,7 +163,8 @@ def on_disconnect(client, userdata, flags, reason_code, properties):
 # --- Client ID Único (Sin cambios) ---
 client_id_base = "Cliente_OPC_MQTT_Modbus_QoS"
 client_id_unico = f"{client_id_base}-{uuid.uuid4().hex[:6]}"
-mqtt_client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, client_id=client_id_unico)
+mqtt_client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, client_id=client_id_unico,
+                          protocol=mqtt.MQTTv5 if MQTT_V5 else mqtt.MQTTv311)
 # ----------------------------------------
 
 mqtt_client.on_connect = on_connect
@@ -115,12 +203,139 @@ mqtt_client.enable_logger(logger)
 # -------------------------------------------
 
 
+alias_topicos = AliasTopicos() if TOPIC_ALIAS else None
+# Retenidos de estado: solo en las transiciones (y una vez por conexión)
+estados_retenidos = EstadosRetenidos(lambda *args, **kwargs: outbox.publicar(*args, **kwargs))
+
 # --- Conexión ---
 print(f"Intentando conectar a {BROKER} en puerto {PORT}...")
 mqtt_client.connect_async(BROKER, PORT, keepalive=10)
 # --------------------
 mqtt_client.loop_start()
 
+# Todo lo que sean datos pasa por el outbox: si el broker no está, se
+# guarda en disco y se reenvía en orden al reconectar.
+outbox = OutboxMQTT(mqtt_client, OUTBOX_DB, OUTBOX_MAX_MENSAJES,
+                    OUTBOX_RETENCION_H * 3600, OUTBOX_POLITICA, OUTBOX_TASA_REENVIO, alias_topicos)
+outbox.iniciar()
+
+# --- Tópico, QoS y retain de cada tag (clave de nodes_opc) ---
+PUBLICACIONES = {
+    **{clave: (topico, qos, retener)
+       for clave, topico, qos, retener in MAPA_TAGS.publicaciones(TOPIC_BASE).values()},
+    "ok":      (f"{TOPIC_BASE}/estadistica/modbus_aceptadas", PUB_QOS_STATUS, False),
+    "crc":     (f"{TOPIC_BASE}/estadistica/modbus_crc_error", PUB_QOS_STATUS, False),
+    "nr":      (f"{TOPIC_BASE}/estadistica/modbus_no_alcanzado", PUB_QOS_STATUS, False),
+    "exc":     (f"{TOPIC_BASE}/estadistica/modbus_excepcion_esclavo", PUB_QOS_STATUS, False),
+    "esclavo": (f"{TOPIC_BASE}/state/{TOPIC_MODBUS_ESCLAVO}", PUB_QOS_STATUS, True),
+    "maestro": (f"{TOPIC_BASE}/state/{TOPIC_MODBUS_MAESTRO}", PUB_QOS_STATUS, True),
+}
+CLAVES_DATOS = {definicion.clave for definicion in MAPA_TAGS} # Los que llevan traza y se agregan
+TOPICOS_DATOS = {definicion.clave: definicion.topico for definicion in MAPA_TAGS}
+
+def publicador_agregados(duracion):
+    def publicar(clave, resumen):
+        outbox.publicar(topico_agregado(TOPIC_BASE, duracion, TOPICOS_DATOS[clave]),
+                        json.dumps(resumen), qos=AGG_QOS)
+    return publicar
+
+agregadores = [AgregadorVentanas(duracion, publicador_agregados(duracion), gracia=AGG_GRACIA)
+               for duracion in AGG_VENTANAS]
+ultimo_origen = {} # SourceTimestamp de la última muestra agregada por tag
+
+def agregar_muestra(clave, valor, origen=None):
+    """Suma la muestra a las ventanas (con su hora de adquisición si la hay).
+    En polling, una adquisición que se vuelve a leer no cuenta dos veces."""
+    if clave not in CLAVES_DATOS or not agregadores:
+        return
+    if origen is not None:
+        if ultimo_origen.get(clave) == origen:
+            return
+        ultimo_origen[clave] = origen
+    t = ns_desde_fecha(origen) / 1e9 if origen is not None else None
+    for agregador in agregadores:
+        agregador.agregar(clave, valor, t)
+
+def observar_notificacion(clave, valor, data):
+    """Toda notificación de la suscripción va a las ventanas (antes de la banda muerta)."""
+    datavalue = data.monitored_item.Value if data is not None else None
+    agregar_muestra(clave, valor, datavalue.SourceTimestamp if datavalue is not None else None)
+
+ultimos_crudos = {} # Último crudo publicado por tag (PUBLICAR_CRUDOS = "cambios", modo polling)
+
+def publicar_crudo(clave):
+    """¿Se publica el valor crudo de este tag? (los contadores y estados siempre)"""
+    return clave not in CLAVES_DATOS or PUBLICAR_CRUDOS != "no"
+
+def publicar_valor(clave, valor, origen=None, servidor=None, t_bridge=None):
+    """Publica un tag; los de datos llevan la traza de latencia si está
+    activa (origen / servidor: Source / ServerTimestamp del valor OPC)."""
+    topico, qos, retener = PUBLICACIONES[clave]
+    if retener:
+        estados_retenidos.actualizar(topico, valor, qos)
+        return
+    properties = None
+    if TRAZA_MQTT != TRAZA_NO and clave in CLAVES_DATOS:
+        traza = traza_opc(origen, servidor, t_bridge or time.time_ns())
+        traza["t_pub"] = time.time_ns()
+        valor, properties = preparar(valor, traza, TRAZA_MQTT)
+    outbox.publicar(topico, valor, qos=qos, retain=retener, properties=properties)
+
+def publicar_lote(lote, t_bridge):
+    """
+    Un solo mensaje (PAYLOAD_ESCANEO) con {clave: valor}. lote:
+    {clave: (valor, SourceTimestamp, ServerTimestamp)}. Lleva t_adq (ns)
+    de la adquisición más reciente y, si está activa, la traza de latencia.
+    """
+    contenido = {"valores": {clave: valor for clave, (valor, _, _) in lote.items()}}
+    origenes = [(origen, servidor) for clave, (_, origen, servidor) in lote.items()
+                if clave in CLAVES_DATOS and origen is not None]
+    properties = None
+    if origenes:
+        origen, servidor = max(origenes, key=lambda o: o[0])
+        contenido["t_adq"] = ns_desde_fecha(origen)
+        if TRAZA_MQTT != TRAZA_NO:
+            traza = traza_opc(origen, servidor, t_bridge)
+            traza["t_pub"] = time.time_ns()
+            if TRAZA_MQTT == TRAZA_PROPIEDADES:
+                properties = propiedades_mqtt(traza)
+            else:
+                contenido["traza"] = traza
+    outbox.publicar(TOPICO_ESCANEO, codificar_escaneo(contenido, PAYLOAD_ESCANEO),
+                    qos=QOS_ESCANEO, properties=properties)
+
+# Cambios de la suscripción que esperan al próximo mensaje de escaneo
+lote_suscripcion = {}
+lote_lock = threading.Lock()
+
+def publicar_tag(clave, valor, data=None):
+    """Publica un tag en su tópico (callback del modo suscripción)."""
+    if not publicar_crudo(clave):
+        return
+    t_bridge = time.time_ns()
+    datavalue = data.monitored_item.Value if data is not None else None
+    origen = datavalue.SourceTimestamp if datavalue is not None else None
+    servidor = datavalue.ServerTimestamp if datavalue is not None else None
+    if PAYLOAD_ESCANEO != FORMATO_NO and not PUBLICACIONES[clave][2]:
+        with lote_lock:
+            lote_suscripcion[clave] = (valor, origen, servidor)
+        return
+    publicar_valor(clave, valor, origen, servidor, t_bridge)
+    print(f"→ (cambio) {clave}={valor}")
+
+def vaciar_lote_suscripcion():
+    with lote_lock:
+        lote = dict(lote_suscripcion)
+        lote_suscripcion.clear()
+    if lote:
+        publicar_lote(lote, time.time_ns())
+        print(f"→ (cambios) {len(lote)} tags en {TOPICO_ESCANEO}")
+
+def publicar_heartbeat():
+    """Estado RUNNING retenido: solo se envía de nuevo si cambió o tras reconectar."""
+    estados_retenidos.actualizar(f"{TOPIC_BASE}/state/{TOPIC_OPC_SERVER}", "RUNNING", PUB_QOS_STATUS, persistir=False)
+    estados_retenidos.actualizar(f"{TOPIC_BASE}/state/{TOPIC_OPC_CLIENTE}", "RUNNING", PUB_QOS_STATUS, persistir=False)
+
 # ----------------------------------------------------
 # Función conectar y buscar nodos (¡MODIFICADA!)
 # ----------------------------------------------------
@@ -139,32 +354,13 @@ def conectar_y_buscar_nodos(client):
         # Asumimos que si nos conectamos al Servidor OPC, él también está vivo
         mqtt_client.publish(TOPIC_OPC_SERVER, "RUNNING", qos=PUB_QOS_STATUS, retain=True)
 
-        objects = client.get_objects_node()
-        disp = None
-        for node in objects.get_children():
-            if node.get_browse_name().Name == "Dispositivo1":
-                disp = node
-                break
-        if disp is None:
-            print("❌ No se encontró 'Dispositivo1' en el servidor OPC UA")
+        # NodeIds desde la caché (validados en una lectura) o, si no sirven,
+        # resueltos en una sola llamada TranslateBrowsePaths
+        nodes_opc = cache_nodos.resolver(client)
+        if nodes_opc is None:
             client.disconnect()
             return None
 
-        # Buscamos los nodos por los NOMBRES correctos
-        nodes_opc = {
-            # Datos
-            "pot":    disp.get_child(["2:Potenciometro"]),
-            "ultra":  disp.get_child(["2:Distancia_Ultrasonido"]),
-            "btn1":   disp.get_child(["2:Boton_1"]),
-            "btn2":   disp.get_child(["2:Boton_2"]),
-            # Contadores
-            "ok":     disp.get_child(["2:Modbus_Aceptadas"]),
-            "crc":    disp.get_child(["2:Modbus_Error_CRC"]),
-            "nr":     disp.get_child(["2:Modbus_No_Alcanzado"]),
-            # ¡NUEVOS TAGS DE ESTADO!
-            "esclavo": disp.get_child(["2:Modbus_Estado_Esclavo"]),
-            "maestro": disp.get_child(["2:Modbus_Estado_Maestro"])
-        }
         print("✅ Nodos OPC UA encontrados.")
         return nodes_opc
 
@@ -183,7 +379,13 @@ def conectar_y_buscar_nodos(client):
 # ----------------------------
 client = Client(OPC_URL)
 nodes_opc = None
-print("Iniciando bridge... (Conectando a OPC UA y MQTT)")
+suscripcion = None
+parametros_lectura = None # ReadParameters del lote (se arma una vez por conexión)
+publicador_cambios = PublicadorCambios(publicar_tag, BANDA_MUERTA,
+                                       observar_notificacion if agregadores else None)
+cache_nodos = CacheNodos(OPC_NAMESPACE, OPC_DISPOSITIVO, NOMBRES_NODOS)
+backoff = BackoffExponencial(RECONNECT_BASE, RECONNECT_MAX)
+print(f"Iniciando bridge en modo '{BRIDGE_MODO}'... (Conectando a OPC UA y MQTT)")
 
 try:
     while True:
@@ -202,42 +404,67 @@ try:
                 
                 if nodes_opc is None:
                     # El error ya fue publicado dentro de conectar_y_buscar_nodos()
-                    print(f"Reintento de conexión OPC en {RECONNECT_PERIOD}s...")
-                    time.sleep(RECONNECT_PERIOD)
+                    espera = backoff.siguiente()
+                    print(f"Reintento de conexión OPC en {espera:.1f}s...")
+                    time.sleep(espera)
                     continue
+                backoff.reiniciar()
             
             # 2. ESTADO: CONECTADO (Leer y publicar)
-            
-            # --- ¡LECTURA DE DATOS! ---
-            pot_val = nodes_opc["pot"].get_value()
-            ultra_val = nodes_opc["ultra"].get_value()
-            btn1_val = nodes_opc["btn1"].get_value()
-            btn2_val = nodes_opc["btn2"].get_value()
-            ok_val   = nodes_opc["ok"].get_value()
-            crc_val  = nodes_opc["crc"].get_value()
-            nr_val   = nodes_opc["nr"].get_value()
-            esclavo_status_val = nodes_opc["esclavo"].get_value()
-            maestro_status_val = nodes_opc["maestro"].get_value()
 
+            if BRIDGE_MODO == "suscripcion":
+                if suscripcion is None:
+                    suscripcion = suscribir(client, nodes_opc, publicador_cambios,
+                                            SUB_PUBLISHING_MS, SUB_SAMPLING_MS)
+                    print(f"✅ Suscripción OPC creada (publicación {SUB_PUBLISHING_MS} ms, muestreo {SUB_SAMPLING_MS} ms)")
+                # Los datos llegan por los callbacks; aquí solo verificamos
+                # que la sesión siga viva (una lectura liviana) y mandamos el heartbeat
+                client.get_node(ua.ObjectIds.Server_ServerStatus_State).get_value()
+                vaciar_lote_suscripcion()
+                publicar_heartbeat()
+                for agregador in agregadores:
+                    agregador.vencer()
+                time.sleep(PUBLISH_PERIOD)
+                continue
+            
+            # --- ¡LECTURA DE DATOS! (un solo servicio Read para todos los nodos) ---
+            if parametros_lectura is None:
+                parametros_lectura = armar_peticion(nodes_opc.values())
+            lecturas = leer_lote(client, nodes_opc, parametros_lectura)
+            t_bridge = time.time_ns()
+            invalidas = [clave for clave, lectura in lecturas.items() if not lectura_buena(lectura)]
+            if invalidas:
+                # Igual que get_value(): un StatusCode malo es un error de lectura
+                raise RuntimeError(f"Lectura OPC con estado no válido: {invalidas}")
 
             # --- ¡PUBLICACIÓN MQTT! ---
-            # (Tópicos de datos y contadores omitidos por brevedad, no cambian)
-            mqtt_client.publish(f"{TOPIC_BASE}/sensor/pot", pot_val, qos=PUB_QOS_REG0)
-            mqtt_client.publish(f"{TOPIC_BASE}/sensor/distancia", ultra_val, qos=PUB_QOS_REG1)
-            mqtt_client.publish(f"{TOPIC_BASE}/datos/boton_1", btn1_val, qos=PUB_QOS_REG2)
-            mqtt_client.publish(f"{TOPIC_BASE}/datos/boton_2", btn2_val, qos=PUB_QOS_REG3)
-            mqtt_client.publish(f"{TOPIC_BASE}/estadistica/modbus_aceptadas", ok_val, qos=PUB_QOS_STATUS)
-            mqtt_client.publish(f"{TOPIC_BASE}/estadistica/modbus_crc_error", crc_val, qos=PUB_QOS_STATUS)
-            mqtt_client.publish(f"{TOPIC_BASE}/estadistica/modbus_no_alcanzado", nr_val, qos=PUB_QOS_STATUS)
-            
-            # ¡NUEVOS TÓPICOS DE ESTADO (Raíz)!
-            mqtt_client.publish(f"{TOPIC_BASE}/state/{TOPIC_MODBUS_ESCLAVO}", esclavo_status_val, qos=PUB_QOS_STATUS, retain=True)
-            mqtt_client.publish(f"{TOPIC_BASE}/state/{TOPIC_MODBUS_MAESTRO}", maestro_status_val, qos=PUB_QOS_STATUS, retain=True)
-            mqtt_client.publish(f"{TOPIC_BASE}/state/{TOPIC_OPC_SERVER}", "RUNNING", qos=PUB_QOS_STATUS, retain=True) # Heartbeat
-            mqtt_client.publish(f"{TOPIC_BASE}/state/{TOPIC_OPC_CLIENTE}", "RUNNING", qos=PUB_QOS_STATUS, retain=True) # Heartbeat
+            # Tags de datos (del mapa), contadores y estados (retenidos)
+            lote = {}
+            for clave in PUBLICACIONES:
+                lectura = lecturas[clave]
+                agregar_muestra(clave, lectura.valor, lectura.timestamp_origen)
+                if not publicar_crudo(clave):
+                    continue
+                if PUBLICAR_CRUDOS == "cambios" and clave in CLAVES_DATOS:
+                    if not supera_banda(ultimos_crudos.get(clave), lectura.valor, *BANDA_MUERTA.get(clave, BANDA_POR_DEFECTO)):
+                        continue
+                    ultimos_crudos[clave] = lectura.valor
+                if PAYLOAD_ESCANEO != FORMATO_NO and not PUBLICACIONES[clave][2]:
+                    lote[clave] = (lectura.valor, lectura.timestamp_origen, lectura.timestamp_servidor)
+                    continue
+                publicar_valor(clave, lectura.valor, lectura.timestamp_origen, lectura.timestamp_servidor, t_bridge)
+            if lote:
+                publicar_lote(lote, t_bridge)
+            for agregador in agregadores:
+                agregador.vencer()
+            esclavo_status_val = lecturas["esclavo"].valor
+            maestro_status_val = lecturas["maestro"].valor
+            publicar_heartbeat()
 
             # Actualizamos el print
-            print(f"→ Pot={pot_val} Ultra={ultra_val} | Esclavo: {esclavo_status_val} | Maestro: {maestro_status_val}")
+            primera = MAPA_TAGS.definiciones[0].clave
+            print(f"→ {len(PUBLICACIONES)} tópicos | Esclavo: {esclavo_status_val} | Maestro: {maestro_status_val}"
+                  f" | Origen: {lecturas[primera].timestamp_origen}")
             
             time.sleep(PUBLISH_PERIOD)
 
@@ -252,11 +479,13 @@ try:
             mqtt_client.publish(TOPIC_OPC_SERVER, "CRASHED", qos=PUB_QOS_STATUS, retain=True)
 
             nodes_opc = None
+            suscripcion = None # Muere con la sesión; se recrea al reconectar
+            parametros_lectura = None
             try:
                 client.disconnect()
             except Exception:
                 pass
-            time.sleep(RECONNECT_PERIOD)
+            time.sleep(backoff.siguiente())
 
 except KeyboardInterrupt:
     print("\n🛑 Deteniendo cliente OPC UA y MQTT (Ctrl+C)...")
@@ -274,6 +503,8 @@ finally:
         print("Mensajes 'limpios' publicados.")
         
         # Detenemos todo
+        print(f"Cerrando outbox ({outbox.pendientes()} mensajes pendientes quedan en disco)...")
+        outbox.cerrar()
         print("Deteniendo bucle MQTT...")
         mqtt_client.loop_stop()
         print("Desconectando MQTT...")
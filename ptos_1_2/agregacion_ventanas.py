@@ -0,0 +1,117 @@
+# ---------- Agregación por ventanas antes de publicar en MQTT ----------
+#
+# Con un sondeo local rápido (p. ej. 10 Hz) no tiene sentido mandar cada
+# muestra al broker de la nube. Esta etapa resume cada tag en ventanas
+# fijas consecutivas (tumbling, alineadas a múltiplos de la duración
+# desde epoch, así las de distintos gateways coinciden) y publica por
+# ventana: min, max, media, último valor y cantidad de muestras.
+#
+# Cada muestra actualiza un acumulador en O(1) (sin guardar la ventana).
+# La ventana se cierra cuando llega una muestra posterior a su fin más
+# el período de gracia o, si el tag dejó de llegar, cuando vencer() ve
+# que ya terminó. Las muestras atrasadas caen en su propia ventana
+# mientras siga abierta; si ya se publicó, se descartan (y se cuentan):
+# una ventana nunca se publica dos veces.
+#
+# ---------------------------------------------------------------------
+
+import json
+import math
+import threading
+import time
+
+class Acumulador:
+    """Min / max / suma / cantidad / último de una ventana."""
+
+    __slots__ = ("inicio", "minimo", "maximo", "suma", "cantidad", "ultimo")
+
+    def __init__(self, inicio, valor):
+        self.inicio = inicio
+        self.minimo = self.maximo = self.suma = self.ultimo = valor
+        self.cantidad = 1
+
+    def agregar(self, valor):
+        if valor < self.minimo:
+            self.minimo = valor
+        elif valor > self.maximo:
+            self.maximo = valor
+        self.suma += valor
+        self.cantidad += 1
+        self.ultimo = valor
+
+    def resumen(self, duracion):
+        return {"min": self.minimo, "max": self.maximo, "media": self.suma / self.cantidad,
+                "ultimo": self.ultimo, "cantidad": self.cantidad,
+                "inicio": self.inicio, "fin": self.inicio + duracion}
+
+class AgregadorVentanas:
+    """
+    Ventanas de `duracion` s por tag. publicar(clave, resumen) se llama al
+    cerrar cada ventana (resumen: dict con min, max, media, ultimo,
+    cantidad, inicio y fin en s epoch). `gracia`: s que una ventana sigue
+    aceptando muestras atrasadas después de terminar. Thread-safe: las
+    muestras pueden llegar del hilo de la suscripción OPC y vencer() del
+    bucle principal.
+    """
+
+    def __init__(self, duracion, publicar, reloj=time.time, gracia=0.0):
+        self.duracion = duracion
+        self.publicar = publicar
+        self.reloj = reloj
+        self.gracia = gracia
+        self._ventanas = {} # clave -> {inicio: Acumulador} de las ventanas abiertas
+        self._cerradas = {} # clave -> inicio de la última ventana publicada
+        self.atrasadas = 0  # muestras descartadas por llegar con su ventana ya cerrada
+        self._lock = threading.Lock()
+
+    def agregar(self, clave, valor, t=None):
+        """Suma una muestra numérica (t en s epoch; por defecto, ahora)."""
+        if isinstance(valor, bool) or not isinstance(valor, (int, float)):
+            return
+        if t is None:
+            t = self.reloj()
+        inicio = math.floor(t / self.duracion) * self.duracion
+        with self._lock:
+            if inicio <= self._cerradas.get(clave, -math.inf):
+                self.atrasadas += 1
+                return
+            abiertas = self._ventanas.setdefault(clave, {})
+            acumulador = abiertas.get(inicio)
+            if acumulador is None:
+                abiertas[inicio] = Acumulador(inicio, valor)
+            else:
+                acumulador.agregar(valor)
+            cerradas = self._cerrar(clave, abiertas, t)
+        for acumulador in cerradas:
+            self.publicar(clave, acumulador.resumen(self.duracion))
+
+    def vencer(self, ahora=None):
+        """Cierra las ventanas que ya terminaron (tags que dejaron de llegar)."""
+        if ahora is None:
+            ahora = self.reloj()
+        with self._lock:
+            vencidas = [(clave, acumulador) for clave, abiertas in list(self._ventanas.items())
+                        for acumulador in self._cerrar(clave, abiertas, ahora)]
+        for clave, acumulador in vencidas:
+            self.publicar(clave, acumulador.resumen(self.duracion))
+
+    def _cerrar(self, clave, abiertas, ahora):
+        """Saca (en orden) las ventanas de `clave` cuyo fin + gracia ya pasó. Con el lock tomado."""
+        limite = ahora - self.duracion - self.gracia
+        cerradas = [abiertas.pop(inicio) for inicio in sorted(abiertas) if inicio <= limite]
+        if cerradas:
+            self._cerradas[clave] = cerradas[-1].inicio
+            if not abiertas:
+                del self._ventanas[clave]
+        return cerradas
+
+def duraciones(texto):
+    """Duraciones de una variable de entorno: "10,60" -> [10.0, 60.0]."""
+    return [float(parte) for parte in texto.replace(";", ",").split(",") if parte.strip()]
+
+def topico_agregado(topic_base, duracion, topico):
+    """pci + 10 + sensor/pot -> pci/agg/10s/sensor/pot"""
+    return f"{topic_base}/agg/{duracion:g}s/{topico}"
+
+def payload_resumen(resumen):
+    return json.dumps(resumen)
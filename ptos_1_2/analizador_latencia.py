@@ -0,0 +1,73 @@
+# ---------- Analizador de latencia extremo a extremo ----------
+#
+# Se suscribe a los tópicos del gateway y, para cada mensaje que trae
+# traza (TRAZA_MQTT = "propiedades" o "sobre" en el bridge / gateway),
+# calcula la latencia de cada salto: maestro→opc, opc→bridge,
+# bridge→mqtt, mqtt→destino y el total desde la lectura serie. Cada
+# --periodo segundos imprime los percentiles de la ventana.
+#
+# Conecta con MQTT v5 (para recibir las User Properties); los sobres
+# JSON se leen igual. Para comparar sellos de equipos distintos, todos
+# tienen que estar sincronizados por NTP.
+#
+# Uso: python analizador_latencia.py [--topico "pci/#"] [--periodo 10]
+# ---------------------------------------------------------------------
+
+import argparse
+import getpass
+import os
+import ssl
+import time
+import uuid
+
+import paho.mqtt.client as mqtt
+
+from traza_latencia import AnalizadorLatencia, leer_traza
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Latencia por salto de los mensajes con traza")
+    parser.add_argument("--broker", default=os.getenv("MQTT_BROKER", "j72b9212.ala.us-east-1.emqxsl.com"))
+    parser.add_argument("--puerto", type=int, default=int(os.getenv("MQTT_PORT", "8883")))
+    parser.add_argument("--usuario", default=os.getenv("MQTT_USERNAME", "user"))
+    parser.add_argument("--clave", default=os.getenv("MQTT_PASSWORD"),
+                        help="Contraseña MQTT (por defecto MQTT_PASSWORD; si falta, se pide)")
+    parser.add_argument("--ca", default="emqxsl-ca.crt", help="Certificado de la CA ('' = sin TLS)")
+    parser.add_argument("--topico", default=f"{os.getenv('TOPIC_BASE', 'pci')}/#")
+    parser.add_argument("--periodo", type=float, default=10.0, help="s entre informes")
+    parser.add_argument("--ventana", type=int, default=10000, help="Muestras por salto")
+    args = parser.parse_args()
+    if args.clave is None:
+        args.clave = getpass.getpass(f"Contraseña MQTT de {args.usuario}: ")
+
+    analizador = AnalizadorLatencia(args.ventana)
+
+    def on_connect(client, userdata, flags, reason_code, properties=None):
+        print(f"✅ Conectado a MQTT {args.broker}:{args.puerto} (rc={reason_code}), suscrito a {args.topico}")
+        client.subscribe(args.topico)
+
+    def on_message(client, userdata, msg):
+        t_rx = time.time_ns()
+        traza = leer_traza(msg)
+        if traza is not None and not msg.retain: # Un retenido viejo no mide nada
+            traza["t_rx"] = t_rx
+            analizador.registrar(traza)
+
+    cliente = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, client_id=f"latencia-pci-{uuid.uuid4().hex[:6]}",
+                          protocol=mqtt.MQTTv5)
+    cliente.on_connect = on_connect
+    cliente.on_message = on_message
+    cliente.username_pw_set(args.usuario, args.clave)
+    if args.ca:
+        cliente.tls_set(ca_certs=args.ca, cert_reqs=ssl.CERT_REQUIRED, tls_version=ssl.PROTOCOL_TLSv1_2)
+    cliente.connect_async(args.broker, args.puerto, keepalive=60)
+    cliente.loop_start()
+    try:
+        while True:
+            time.sleep(args.periodo)
+            print(f"\n--- {time.strftime('%H:%M:%S')} | {analizador.mensajes} mensajes con traza ---")
+            print(analizador.informe())
+    except KeyboardInterrupt:
+        print("Cerrando analizador...")
+    finally:
+        cliente.loop_stop()
+        cliente.disconnect()
@@ -0,0 +1,79 @@
+# ---------- Benchmark CRC-16/MODBUS ----------
+#
+# Compara la implementación original bit a bit (8 desplazamientos por
+# byte + struct.pack + copia con trama[:-2]) contra el motor por tabla
+# de crc_modbus.py, sobre tamaños de trama realistas:
+#   - petición FC03 (8 bytes)
+#   - respuesta a 4 registros (13 bytes)
+#   - respuesta a 125 registros (255 bytes, máximo de una lectura)
+#
+# Uso: python bench_crc.py [--repeticiones N]
+# ---------------------------------------------------------------------
+
+import argparse
+import os
+import struct
+import timeit
+
+import crc_modbus
+
+# --- Implementación original (referencia) ---
+def calcular_crc_original(trama_bytes):
+    crc_registro = 0xFFFF
+    polinomio = 0xA001
+    for byte in trama_bytes:
+        crc_registro ^= byte
+        for _ in range(8):
+            if crc_registro & 0x0001:
+                crc_registro = (crc_registro >> 1) ^ polinomio
+            else:
+                crc_registro = crc_registro >> 1
+    return struct.pack('<H', crc_registro)
+
+def verificar_crc_original(trama_completa):
+    if len(trama_completa) < 4:
+        return False
+    trama_datos = trama_completa[:-2]
+    crc_recibido = trama_completa[-2:]
+    crc_calculado = calcular_crc_original(trama_datos)
+    return crc_recibido == crc_calculado
+
+# --- Tramas de prueba ---
+def _respuesta_fc03(cantidad_registros):
+    datos = bytes([1, 0x03, cantidad_registros * 2]) + os.urandom(cantidad_registros * 2)
+    return datos + calcular_crc_original(datos)
+
+TRAMAS = {
+    "peticion_fc03 (8 B)": bytes([1, 0x03, 0, 0, 0, 4]) + calcular_crc_original(bytes([1, 0x03, 0, 0, 0, 4])),
+    "respuesta_4_reg (13 B)": _respuesta_fc03(4),
+    "respuesta_125_reg (255 B)": _respuesta_fc03(125),
+}
+
+def medir(funcion, trama, repeticiones):
+    """Devuelve microsegundos por llamada (mejor de 5 rondas)."""
+    tiempos = timeit.repeat(lambda: funcion(trama), number=repeticiones, repeat=5)
+    return min(tiempos) / repeticiones * 1e6
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark CRC-16/MODBUS")
+    parser.add_argument("--repeticiones", type=int, default=2000)
+    args = parser.parse_args()
+
+    motor = "crcmod (C)" if crc_modbus._crc_c is not None else "tabla (Python)"
+    print(f"--- Benchmark CRC-16/MODBUS | motor nuevo: {motor} ---")
+
+    # Sanidad: ambas implementaciones deben coincidir
+    for nombre, trama in TRAMAS.items():
+        assert crc_modbus.calcular_crc(trama[:-2]) == calcular_crc_original(trama[:-2]), nombre
+        assert crc_modbus.verificar_crc(trama) and verificar_crc_original(trama), nombre
+
+    print(f"{'Trama':<28}{'Operación':<12}{'Original (us)':>15}{'Nuevo (us)':>13}{'Speedup':>10}")
+    for nombre, trama in TRAMAS.items():
+        casos = [
+            ("calcular", calcular_crc_original, crc_modbus.calcular_crc, trama[:-2]),
+            ("verificar", verificar_crc_original, crc_modbus.verificar_crc, trama),
+        ]
+        for operacion, original, nuevo, entrada in casos:
+            t_orig = medir(original, entrada, args.repeticiones)
+            t_nuevo = medir(nuevo, entrada, args.repeticiones)
+            print(f"{nombre:<28}{operacion:<12}{t_orig:>15.2f}{t_nuevo:>13.2f}{t_orig / t_nuevo:>9.1f}x")
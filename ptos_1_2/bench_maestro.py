@@ -0,0 +1,174 @@
+# ---------- Benchmark del maestro Modbus contra el esclavo simulado ----------
+#
+# Mide el maestro real (ciclo_maestro_modbus / ciclo_escritura_modbus de
+# "maestro_modbus_json (1).py") contra simulador_esclavo.py sobre un pty,
+# sin hardware, para que cada cambio de rendimiento se pueda medir de
+# forma reproducible en cualquier Linux. Para cada velocidad:
+#   - lectura FC03 de los 4 registros de sensores
+#   - escritura FC06 del registro del LED
+#   - lectura con fallas (respuestas descartadas / CRC corrupto)
+# Reporta transacciones por segundo y percentiles de latencia, y el
+# tiempo de recuperación: desde que el esclavo vuelve (tras un corte)
+# hasta la primera lectura aceptada, por separado si el corte fue breve
+# (enlace) o si el esclavo llegó a entrar en cuarentena.
+# Con --buses N, además mide el throughput total de 1..N buses en
+# paralelo (un BusSerie y un simulador por puerto, sondeo saturado).
+#
+# Uso: python bench_maestro.py [--baudios 9600 115200] [--transacciones N] [--buses 4]
+# ---------------------------------------------------------------------
+
+import argparse
+import asyncio
+import contextlib
+import importlib.util
+import io
+import os
+import statistics
+import time
+
+import serial
+
+from simulador_esclavo import EsclavoSimulado
+from tramas_modbus import trama_escribir_registro
+from planificador_modbus import Tag
+from maestro_asyncio import MaestroAsyncio
+from salud_esclavos import SaludEsclavos
+
+def cargar_maestro():
+    """Importa el maestro como módulo (el nombre del archivo tiene espacios)."""
+    ruta = os.path.join(os.path.dirname(os.path.abspath(__file__)), "maestro_modbus_json (1).py")
+    spec = importlib.util.spec_from_file_location("maestro_modbus", ruta)
+    modulo = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(modulo)
+    return modulo
+
+maestro = cargar_maestro()
+
+def abrir_puerto(simulador, baudios, timeout, bus=None):
+    """Abre el pty y deja el bus (por defecto el primero del maestro) a esa velocidad y timeout."""
+    bus = bus or maestro.buses[0]
+    bus.baudios = baudios
+    bus.salud = SaludEsclavos(timeout, maestro.TIMEOUT_MINIMO, timeout, maestro.FALLOS_CUARENTENA)
+    ser = serial.Serial(simulador.puerto, baudrate=baudios, timeout=timeout)
+    maestro.configurar_puerto(ser, baudios)
+    bus.ser = ser
+    return ser
+
+def correr(operacion, n):
+    """Ejecuta operacion() n veces. Devuelve (latencias en s, estados, duración)."""
+    latencias, estados = [], []
+    inicio = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()): # El maestro imprime cada transacción
+        for _ in range(n):
+            t0 = time.perf_counter()
+            estado, _ = operacion()
+            latencias.append(time.perf_counter() - t0)
+            estados.append(estado)
+    return latencias, estados, time.perf_counter() - inicio
+
+def resumen(nombre, latencias, estados, duracion):
+    ok = [l for l, e in zip(latencias, estados) if e == "OK"]
+    cuantiles = statistics.quantiles(ok, n=100) if len(ok) >= 2 else [0.0] * 99
+    errores = len(estados) - len(ok)
+    print(f"{nombre:<22}{len(estados) / duracion:>8.1f}{1000 * cuantiles[49]:>9.2f}"
+          f"{1000 * cuantiles[94]:>9.2f}{1000 * cuantiles[98]:>9.2f}{errores:>9}")
+
+def tiempo_recuperacion(simulador, ser, corte=0.5):
+    """Corta el esclavo `corte` s y mide cuánto tarda el maestro en volver a
+    leer. Devuelve (segundos, True si el esclavo pasó por cuarentena): en
+    cuarentena no se sondea sin pausa, se duerme hasta el sondeo de prueba."""
+    salud = maestro.buses[0].salud
+    simulador.silenciar(corte)
+    fin_corte = time.monotonic() + corte
+    cuarentena = False
+    with contextlib.redirect_stdout(io.StringIO()):
+        while True:
+            estado, _ = maestro.ciclo_maestro_modbus(ser, 1, 0x03, 0, 4)
+            if estado == "ERROR_CUARENTENA":
+                cuarentena = True
+                time.sleep(max(0.0, salud.proximo_sondeo(1) - salud.reloj()))
+            elif estado == "OK" and time.monotonic() >= fin_corte:
+                return time.monotonic() - fin_corte, cuarentena
+
+def informar_recuperacion(nombre, tiempos):
+    if tiempos:
+        print(f"Recuperación {nombre}: media {1000 * statistics.mean(tiempos):.1f} ms, "
+              f"máx {1000 * max(tiempos):.1f} ms ({len(tiempos)} cortes)")
+    else:
+        print(f"Recuperación {nombre}: sin cortes")
+
+def escalado_buses(n, baudios, timeout, duracion=3.0):
+    """Lecturas aceptadas por segundo con n buses sondeando sin pausa."""
+    simuladores = [EsclavoSimulado([i + 1], baudios, semilla=i).iniciar() for i in range(n)]
+    tags = [Tag(f"s{i + 1}", i + 1, 0, 4, 0.001) for i in range(n)]
+    puertos = [maestro.PuertoSerie(sim.puerto, baudios, (i + 1,)) for i, sim in enumerate(simuladores)]
+    buses = maestro.crear_buses(puertos, tags)
+    for simulador, bus in zip(simuladores, buses):
+        abrir_puerto(simulador, baudios, timeout, bus)
+
+    async def sondear():
+        maestros = [MaestroAsyncio(bus.planificador, bus.leer_bloque) for bus in buses]
+        tareas = [asyncio.create_task(m.ejecutar()) for m in maestros]
+        await asyncio.sleep(duracion)
+        for tarea in tareas:
+            tarea.cancel()
+        await asyncio.gather(*tareas, return_exceptions=True)
+        for m in maestros:
+            m.cerrar(esperar=True)
+
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            asyncio.run(sondear())
+        return sum(bus.stats["aceptadas"] for bus in buses) / duracion
+    finally:
+        for simulador, bus in zip(simuladores, buses):
+            bus.cerrar_puerto()
+            simulador.cerrar()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark del maestro Modbus RTU")
+    parser.add_argument("--baudios", type=int, nargs="+", default=[9600, 19200, 38400, 115200])
+    parser.add_argument("--transacciones", type=int, default=200)
+    parser.add_argument("--timeout", type=float, default=0.1, help="TIMEOUT_ESPERA del maestro (s)")
+    parser.add_argument("--retardo", type=float, default=0.0, help="Tiempo de proceso del esclavo (s)")
+    parser.add_argument("--prob-falla", type=float, default=0.05,
+                        help="Probabilidad de respuesta descartada y de CRC corrupto (escenario con fallas)")
+    parser.add_argument("--buses", type=int, default=0, help="Medir el escalado con 1..N buses en paralelo")
+    args = parser.parse_args()
+    n = args.transacciones
+
+    print(f"--- Benchmark maestro Modbus RTU | {n} transacciones por escenario | "
+          f"timeout {args.timeout} s | retardo esclavo {args.retardo} s ---")
+    for baudios in args.baudios:
+        print(f"\n{baudios} baudios")
+        print(f"{'Escenario':<22}{'trans/s':>8}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'errores':>9}")
+
+        simulador = EsclavoSimulado([1], baudios, args.retardo, semilla=1).iniciar()
+        ser = abrir_puerto(simulador, baudios, args.timeout)
+        try:
+            resumen("lectura FC03 x4", *correr(lambda: maestro.ciclo_maestro_modbus(ser, 1, 0x03, 0, 4), n))
+            valores = iter(range(n))
+            resumen("escritura FC06", *correr(lambda: maestro.ciclo_escritura_modbus(
+                ser, trama_escribir_registro(1, 4, next(valores) % 256), 1, 0x06), n))
+
+            simulador.prob_descarte = simulador.prob_crc = args.prob_falla
+            resumen(f"lectura c/fallas {args.prob_falla:.0%}",
+                    *correr(lambda: maestro.ciclo_maestro_modbus(ser, 1, 0x03, 0, 4), n))
+            simulador.prob_descarte = simulador.prob_crc = 0.0
+
+            # Cortes breves (el enlace vuelve antes de la cuarentena) y largos
+            recuperaciones = [tiempo_recuperacion(simulador, ser, corte)
+                              for corte in [args.timeout] * 5 + [0.5] * 5]
+            informar_recuperacion("del enlace", [t for t, cuarentena in recuperaciones if not cuarentena])
+            informar_recuperacion("de cuarentena", [t for t, cuarentena in recuperaciones if cuarentena])
+        finally:
+            ser.close()
+            simulador.cerrar()
+
+        if args.buses:
+            print(f"Escalado con buses en paralelo ({baudios} baudios, lectura FC03 x4 sin pausa)")
+            base = None
+            for n_buses in range(1, args.buses + 1):
+                tasa = escalado_buses(n_buses, baudios, args.timeout)
+                base = base or tasa
+                print(f"  {n_buses} bus(es): {tasa:8.1f} lecturas/s  (x{tasa / base:.2f})")
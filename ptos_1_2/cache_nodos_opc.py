@@ -0,0 +1,137 @@
+# ---------- Caché persistente de NodeIds del bridge ----------
+#
+# Evita recorrer el espacio de direcciones en cada reconexión. Los
+# NodeIds resueltos se guardan en memoria y en disco, indexados por
+# (URI del servidor, URI del namespace). Al reconectar:
+#   1. Una lectura: ServerArray + NamespaceArray (el índice del namespace
+#      se resuelve por URI, no se asume "2:").
+#   2. Con NodeIds en caché: una lectura de BrowseName de todos los nodos
+#      para validarlos, y listo.
+#   3. Si la validación falla (o no hay caché): UNA llamada
+#      TranslateBrowsePathsToNodeIds para todos los tags.
+#
+# ---------------------------------------------------------------------
+
+import json
+import os
+
+from opcua import ua
+
+ARCHIVO_CACHE = "cache_nodos_opc.json"
+
+class CacheNodos:
+    """
+    dispositivo: BrowseName del objeto bajo Objects (p. ej. "Dispositivo1").
+    nombres: {clave: BrowseName de la variable dentro del dispositivo,
+    o (dispositivo, BrowseName) si está en otro objeto}.
+    """
+
+    def __init__(self, uri_namespace, dispositivo, nombres, archivo=ARCHIVO_CACHE):
+        self.uri_namespace = uri_namespace
+        self.dispositivo = dispositivo
+        self.nombres = nombres
+        self.archivo = archivo
+        self._entradas = self._cargar()
+
+    # --- Persistencia ---
+    def _cargar(self):
+        try:
+            with open(self.archivo, "r") as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def _guardar(self):
+        tmp = self.archivo + ".tmp"
+        try:
+            with open(tmp, "w") as f:
+                json.dump(self._entradas, f, indent=4)
+            os.replace(tmp, self.archivo)
+        except OSError as e:
+            print(f"⚠️ No se pudo guardar la caché de nodos: {e}")
+
+    # --- Resolución ---
+    def resolver(self, client):
+        """Devuelve {clave: Node}, o None si el servidor no publica el
+        namespace o el dispositivo esperado."""
+        uri_servidor, namespaces = _leer_identidad(client)
+        if self.uri_namespace not in namespaces:
+            print(f"❌ El servidor no publica el namespace '{self.uri_namespace}'")
+            return None
+        idx = namespaces.index(self.uri_namespace)
+        clave_cache = f"{uri_servidor}|{self.uri_namespace}"
+
+        identificadores = self._entradas.get(clave_cache)
+        if identificadores and set(identificadores) == set(self.nombres):
+            nodos = {clave: client.get_node(ua.NodeId.from_string(f"ns={idx};{ident}"))
+                     for clave, ident in identificadores.items()}
+            if self._validar(client, nodos, idx):
+                print("✅ Nodos OPC UA tomados de la caché.")
+                return nodos
+            print("Caché de nodos desactualizada, resolviendo rutas...")
+
+        nodos = self._traducir(client, idx)
+        if nodos is None:
+            return None
+        self._entradas[clave_cache] = {clave: _identificador(nodo.nodeid) for clave, nodo in nodos.items()}
+        self._guardar()
+        return nodos
+
+    def _validar(self, client, nodos, idx):
+        """Una sola lectura de BrowseName para todos los nodos de la caché."""
+        claves = list(nodos)
+        resultados = client.uaclient.get_attributes([nodos[c].nodeid for c in claves],
+                                                    ua.AttributeIds.BrowseName)
+        for clave, dv in zip(claves, resultados):
+            if not dv.StatusCode.is_good():
+                return False
+            nombre = dv.Value.Value
+            if nombre.Name != self._ruta(clave)[-1] or nombre.NamespaceIndex != idx:
+                return False
+        return True
+
+    def _traducir(self, client, idx):
+        """TranslateBrowsePathsToNodeIds en lote: Objects/Dispositivo/Variable."""
+        claves = list(self.nombres)
+        rutas = [_ruta(idx, self._ruta(clave)) for clave in claves]
+        resultados = client.uaclient.translate_browsepaths_to_nodeids(rutas)
+        nodos = {}
+        for clave, resultado in zip(claves, resultados):
+            if not resultado.StatusCode.is_good() or not resultado.Targets:
+                print(f"❌ No se encontró '{'/'.join(self._ruta(clave))}' en el servidor OPC UA")
+                return None
+            destino = resultado.Targets[0].TargetId  # ExpandedNodeId -> NodeId local
+            nodos[clave] = client.get_node(ua.NodeId(destino.Identifier, destino.NamespaceIndex, destino.NodeIdType))
+        return nodos
+
+    def _ruta(self, clave):
+        """[dispositivo, variable] de una clave."""
+        nombre = self.nombres[clave]
+        return [self.dispositivo, nombre] if isinstance(nombre, str) else list(nombre)
+
+# --- Auxiliares ---
+def _leer_identidad(client):
+    """(URI del servidor, NamespaceArray) en una sola lectura."""
+    ids = [ua.NodeId(ua.ObjectIds.Server_ServerArray), ua.NodeId(ua.ObjectIds.Server_NamespaceArray)]
+    servidor, namespaces = client.uaclient.get_attributes(ids, ua.AttributeIds.Value)
+    uris_servidor = servidor.Value.Value or [""]
+    return uris_servidor[0], list(namespaces.Value.Value)
+
+def _identificador(nodeid):
+    """'ns=2;i=5' -> 'i=5' (el índice se resuelve por URI al usarlo)."""
+    texto = nodeid.to_string()
+    if texto.startswith("ns="):
+        texto = texto.split(";", 1)[1]
+    return texto
+
+def _ruta(idx, nombres):
+    ruta = ua.BrowsePath()
+    ruta.StartingNode = ua.NodeId(ua.ObjectIds.ObjectsFolder)
+    for nombre in nombres:
+        elemento = ua.RelativePathElement()
+        elemento.ReferenceTypeId = ua.NodeId(ua.ObjectIds.HierarchicalReferences)
+        elemento.IsInverse = False
+        elemento.IncludeSubtypes = True
+        elemento.TargetName = ua.QualifiedName(nombre, idx)
+        ruta.RelativePath.Elements.append(elemento)
+    return ruta
@@ -0,0 +1,147 @@
+# ---------- Etapa de comandos (escrituras) ----------
+#
+# Se ubica entre on_message (MQTT) y el puerto serie:
+#   - "Último valor gana": varias escrituras pendientes a la misma bobina
+#     o registro se reducen al valor más nuevo (un slider que publica
+#     decenas de veces por segundo genera una sola escritura por turno
+#     de bus).
+#   - Las escrituras a registros/bobinas contiguos del mismo esclavo se
+#     fusionan en un único FC16/FC15 (write multiple).
+#
+# El lote se toma recién cuando el bus está libre, así lo que llega
+# mientras hay una transacción en curso se sigue colapsando. Cada
+# escritura recibe la confirmación (Future) del vaciado que la va a
+# llevar al bus, para quien necesite esperar la respuesta del esclavo
+# (la fachada Modbus TCP).
+#
+# ---------------------------------------------------------------------
+
+import threading
+from collections import namedtuple
+from concurrent.futures import Future
+
+from tramas_modbus import (
+    FUNCION_ESCRIBIR_COIL, FUNCION_ESCRIBIR_REGISTRO,
+    FUNCION_ESCRIBIR_COILS, FUNCION_ESCRIBIR_REGISTROS,
+    MAX_COILS_POR_ESCRITURA, MAX_REGISTROS_POR_ESCRITURA,
+    trama_escribir_coil, trama_escribir_registro,
+    trama_escribir_coils, trama_escribir_registros,
+)
+
+COIL = "coil"
+REGISTRO = "registro"
+
+# Una escritura lista para el bus: función, esclavo, dirección inicial y valores
+Escritura = namedtuple("Escritura", ["funcion", "esclavo", "inicio", "valores"])
+
+def estado_escritura(resultados, esclavo, tipo, direccion):
+    """Estado de la Escritura de `resultados` ([(Escritura, estado)]) que
+    cubre esa bobina o registro; None si el lote no la incluye."""
+    funciones = ((FUNCION_ESCRIBIR_COIL, FUNCION_ESCRIBIR_COILS) if tipo == COIL
+                 else (FUNCION_ESCRIBIR_REGISTRO, FUNCION_ESCRIBIR_REGISTROS))
+    for escritura, estado in resultados:
+        if (escritura.esclavo == esclavo and escritura.funcion in funciones
+                and escritura.inicio <= direccion < escritura.inicio + len(escritura.valores)):
+            return estado
+    return None
+
+def trama_escritura(escritura):
+    """Arma la trama RTU de una Escritura."""
+    esclavo, inicio, valores = escritura.esclavo, escritura.inicio, escritura.valores
+    if escritura.funcion == FUNCION_ESCRIBIR_COIL:
+        return trama_escribir_coil(esclavo, inicio, valores[0])
+    if escritura.funcion == FUNCION_ESCRIBIR_REGISTRO:
+        return trama_escribir_registro(esclavo, inicio, valores[0])
+    if escritura.funcion == FUNCION_ESCRIBIR_COILS:
+        return trama_escribir_coils(esclavo, inicio, valores)
+    return trama_escribir_registros(esclavo, inicio, valores)
+
+class EtapaComandos:
+    """
+    Escrituras pendientes indexadas por (esclavo, tipo, dirección).
+    Thread-safe: se llena desde el hilo de paho y se vacía desde el del bus.
+    Con escritura_multiple=False nunca se generan FC15/FC16 (esclavos que
+    solo implementan FC05/FC06, como esclavo_integrador.ino).
+    """
+
+    def __init__(self, escritura_multiple=True):
+        self.escritura_multiple = escritura_multiple
+        self._pendientes = {}
+        self._lock = threading.Lock()
+        self._confirmacion = None # Future del vaciado programado (None: no hay ninguno)
+        self.colapsadas = 0  # escrituras descartadas por "último valor gana"
+
+    def _registrar(self, esclavo, tipo, direccion, valor):
+        """
+        Devuelve (programar, confirmación): programar es True si el llamador
+        debe programar un vaciado en el bus; la confirmación se resuelve con
+        [(Escritura, estado)] del lote que lleva esta escritura.
+        """
+        with self._lock:
+            clave = (esclavo, tipo, direccion)
+            if clave in self._pendientes:
+                self.colapsadas += 1
+            self._pendientes[clave] = valor
+            programar = self._confirmacion is None
+            if programar:
+                self._confirmacion = Future()
+            return programar, self._confirmacion
+
+    def escribir_coil(self, esclavo, direccion, encendido):
+        return self._registrar(esclavo, COIL, direccion, bool(encendido))
+
+    def escribir_registro(self, esclavo, direccion, valor):
+        if not 0 <= valor <= 0xFFFF:
+            raise ValueError(f"Valor de registro fuera de rango: {valor}")
+        return self._registrar(esclavo, REGISTRO, direccion, valor)
+
+    def pendientes(self):
+        with self._lock:
+            return len(self._pendientes)
+
+    def liberar_vaciado(self, confirmacion=None):
+        """El vaciado programado no llegó a correr (falló, se canceló o el
+        maestro se reconectó): la próxima escritura vuelve a programar uno.
+        Con `confirmacion`, solo si sigue siendo la del vaciado pendiente.
+        Las escrituras pendientes se conservan."""
+        with self._lock:
+            if self._confirmacion is None or confirmacion not in (None, self._confirmacion):
+                return
+            confirmacion, self._confirmacion = self._confirmacion, None
+        if not confirmacion.done():
+            confirmacion.set_exception(ConnectionError("El vaciado de comandos no se ejecutó"))
+
+    def tomar_lote(self):
+        """Vacía las escrituras pendientes y devuelve (lote, confirmación):
+        el lote agrupado en la menor cantidad de Escritura posible y el
+        Future a resolver con sus resultados."""
+        with self._lock:
+            pendientes = self._pendientes
+            self._pendientes = {}
+            confirmacion = self._confirmacion or Future()
+            self._confirmacion = None
+
+        lote = []
+        tramo = None  # [esclavo, tipo, inicio, [valores]]
+        for (esclavo, tipo, direccion), valor in sorted(pendientes.items()):
+            maximo = MAX_COILS_POR_ESCRITURA if tipo == COIL else MAX_REGISTROS_POR_ESCRITURA
+            if (self.escritura_multiple and tramo is not None
+                    and tramo[0] == esclavo and tramo[1] == tipo
+                    and tramo[2] + len(tramo[3]) == direccion
+                    and len(tramo[3]) < maximo):
+                tramo[3].append(valor)
+                continue
+            if tramo is not None:
+                lote.append(self._a_escritura(*tramo))
+            tramo = [esclavo, tipo, direccion, [valor]]
+        if tramo is not None:
+            lote.append(self._a_escritura(*tramo))
+        return lote, confirmacion
+
+    @staticmethod
+    def _a_escritura(esclavo, tipo, inicio, valores):
+        if tipo == COIL:
+            funcion = FUNCION_ESCRIBIR_COIL if len(valores) == 1 else FUNCION_ESCRIBIR_COILS
+        else:
+            funcion = FUNCION_ESCRIBIR_REGISTRO if len(valores) == 1 else FUNCION_ESCRIBIR_REGISTROS
+        return Escritura(funcion, esclavo, inicio, tuple(valores))
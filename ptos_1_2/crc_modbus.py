@@ -0,0 +1,67 @@
+# ---------- CRC-16/MODBUS por tabla ----------
+#
+# Motor de CRC para las tramas RTU del maestro. Usa una tabla de 256
+# entradas precalculada al importar el módulo (un XOR y un desplazamiento
+# por byte, en vez de 8 iteraciones por byte). Si está instalado `crcmod`
+# se usa su implementación en C como camino rápido.
+#
+# ---------------------------------------------------------------------
+
+import struct
+
+POLINOMIO = 0xA001   # 0x8005 reflejado
+CRC_INICIAL = 0xFFFF
+
+_empaquetar_crc = struct.Struct('<H').pack
+
+# --- Tabla precalculada ---
+def _generar_tabla():
+    tabla = []
+    for byte in range(256):
+        crc = byte
+        for _ in range(8):
+            if crc & 0x0001:
+                crc = (crc >> 1) ^ POLINOMIO
+            else:
+                crc >>= 1
+        tabla.append(crc)
+    return tuple(tabla)
+
+TABLA_CRC = _generar_tabla()
+
+def _crc16_tabla(datos, crc=CRC_INICIAL):
+    tabla = TABLA_CRC
+    for byte in datos:
+        crc = (crc >> 8) ^ tabla[(crc ^ byte) & 0xFF]
+    return crc
+
+# --- Camino rápido opcional (crcmod con extensión en C) ---
+try:
+    import crcmod.predefined
+    _crc_c = crcmod.predefined.mkPredefinedCrcFun('modbus')
+except ImportError:
+    _crc_c = None
+
+def crc16(datos):
+    """Devuelve el CRC-16/MODBUS de `datos` como entero."""
+    if _crc_c is not None:
+        return _crc_c(datos)
+    return _crc16_tabla(datos)
+
+def calcular_crc(trama_bytes):
+    """Devuelve el CRC listo para anexar a la trama (2 bytes, little-endian)."""
+    return _empaquetar_crc(crc16(trama_bytes))
+
+def agregar_crc(trama_sin_crc):
+    """Devuelve la trama completa (datos + CRC)."""
+    return trama_sin_crc + calcular_crc(trama_sin_crc)
+
+def verificar_crc(trama_completa):
+    """
+    Verifica una trama completa sin copiar los datos.
+    Propiedad del CRC reflejado: calculado sobre datos + CRC (en orden
+    little-endian) el resultado es 0 si la trama es válida.
+    """
+    if len(trama_completa) < 4:
+        return False
+    return crc16(trama_completa) == 0
@@ -0,0 +1,229 @@
+# ---------- Espacio de direcciones OPC UA generado del mapa de tags ----------
+#
+# En vez de crear los nodos a mano, se generan de una descripción:
+# un objeto por dispositivo (campo "dispositivo" / "dispositivos" con
+# plantilla en mapa_tags.json) y una variable por tag, con su tipo
+# (UInt16 / Int16 / UInt32 / Int32 si el valor es el crudo, Int64 si está
+# escalado a enteros, Double si tiene decimales) y, si el tag las declara,
+# las propiedades EngineeringUnits y EURange (AnalogItemType).
+#
+# Todo el espacio se crea con una llamada AddNodes por nivel (objetos,
+# variables, propiedades), no un add_variable por nodo (con 4000 tags,
+# menos de la mitad del tiempo de arranque). Las variables nacen de solo
+# lectura (AccessLevel en los atributos del AddNodes), con NodeIds de
+# texto estables entre reinicios: ns=<idx>;s=<dispositivo>.<variable>.
+#
+# EscritorValores aplica cada escaneo como UNA escritura (Write con N
+# WriteValue) de DataValues con SourceTimestamp = adquisición en el
+# maestro, salteando los valores que no cambiaron: el costo depende de
+# los cambios y no del tamaño del espacio, y los suscriptores no reciben
+# notificaciones vacías.
+#
+# ---------------------------------------------------------------------
+
+from datetime import datetime
+
+from opcua import ua
+
+from traza_latencia import fecha_desde_ns
+
+# Tipo del mapa -> tipo OPC UA cuando el valor es el crudo (sin escala)
+TIPOS_CRUDOS = {
+    "uint16": ua.VariantType.UInt16,
+    "int16":  ua.VariantType.Int16,
+    "uint32": ua.VariantType.UInt32,
+    "int32":  ua.VariantType.Int32,
+}
+TIPOS_DATO = {
+    ua.VariantType.UInt16: ua.ObjectIds.UInt16,
+    ua.VariantType.Int16:  ua.ObjectIds.Int16,
+    ua.VariantType.UInt32: ua.ObjectIds.UInt32,
+    ua.VariantType.Int32:  ua.ObjectIds.Int32,
+    ua.VariantType.Int64:  ua.ObjectIds.Int64,
+    ua.VariantType.Double: ua.ObjectIds.Double,
+    ua.VariantType.String: ua.ObjectIds.String,
+}
+URI_UNIDADES = "http://www.opcfoundation.org/UA/units/un/cefact"
+_SIN_VALOR = object()
+
+def tipo_variante(mapa, definicion):
+    """VariantType del nodo de un tag del mapa."""
+    if isinstance(mapa.valor_inicial(definicion.nombre), float):
+        return ua.VariantType.Double
+    if definicion.escala == 1 and definicion.offset == 0:
+        return TIPOS_CRUDOS[definicion.tipo]
+    return ua.VariantType.Int64
+
+class Variable:
+    """Descripción de una variable a generar."""
+
+    __slots__ = ("clave", "dispositivo", "nombre", "valor", "tipo", "unidad", "rango")
+
+    def __init__(self, clave, dispositivo, nombre, valor, tipo, unidad=None, rango=None):
+        self.clave = clave
+        self.dispositivo = dispositivo
+        self.nombre = nombre
+        self.valor = valor
+        self.tipo = tipo
+        self.unidad = unidad
+        self.rango = rango
+
+def variables_mapa(mapa):
+    """Una Variable por tag del mapa (clave OPC -> nodo del dispositivo)."""
+    return [Variable(d.clave, d.dispositivo, d.nodo_opc, mapa.valor_inicial(d.nombre),
+                     tipo_variante(mapa, d), d.unidad, d.rango)
+            for d in mapa]
+
+def crear_espacio(servidor, idx, variables):
+    """
+    Crea los dispositivos y sus variables (NodeIds de texto estables:
+    ns=idx;s=Dispositivo.Variable). Devuelve ({clave: Node},
+    {dispositivo: Node}).
+    """
+    sesion = servidor.iserver.isession
+    carpeta_objetos = ua.NodeId(ua.ObjectIds.ObjectsFolder)
+
+    # --- Objetos (uno por dispositivo) ---
+    nombres_dispositivos = list(dict.fromkeys(variable.dispositivo for variable in variables))
+    items = []
+    for nombre in nombres_dispositivos:
+        item = _item(ua.NodeId(nombre, idx), ua.QualifiedName(nombre, idx), carpeta_objetos,
+                     ua.NodeClass.Object, ua.ObjectIds.Organizes, ua.ObjectIds.BaseObjectType)
+        item.NodeAttributes = _atributos(ua.ObjectAttributes(), nombre)
+        items.append(item)
+    ids_dispositivos = dict(zip(nombres_dispositivos, _agregar(sesion, items)))
+
+    # --- Variables ---
+    items = []
+    for variable in variables:
+        analogico = variable.unidad is not None or variable.rango is not None
+        item = _item(ua.NodeId(f"{variable.dispositivo}.{variable.nombre}", idx),
+                     ua.QualifiedName(variable.nombre, idx), ids_dispositivos[variable.dispositivo],
+                     ua.NodeClass.Variable, ua.ObjectIds.HasComponent,
+                     ua.ObjectIds.AnalogItemType if analogico else ua.ObjectIds.BaseDataVariableType)
+        item.NodeAttributes = _atributos_variable(variable.nombre, ua.Variant(variable.valor, variable.tipo),
+                                                  TIPOS_DATO[variable.tipo])
+        items.append(item)
+    ids_variables = _agregar(sesion, items)
+
+    # --- Propiedades de ingeniería ---
+    items = []
+    for variable, nodeid in zip(variables, ids_variables):
+        if variable.unidad is not None:
+            unidad = ua.EUInformation()
+            unidad.NamespaceUri = URI_UNIDADES
+            unidad.UnitId = -1 # Sin código UNECE: vale el DisplayName
+            unidad.DisplayName = ua.LocalizedText(variable.unidad)
+            unidad.Description = ua.LocalizedText(variable.unidad)
+            items.append(_propiedad(nodeid, "EngineeringUnits", unidad, ua.ObjectIds.EUInformation))
+        if variable.rango is not None:
+            rango = ua.Range()
+            rango.Low, rango.High = float(variable.rango[0]), float(variable.rango[1])
+            items.append(_propiedad(nodeid, "EURange", rango, ua.ObjectIds.Range))
+    _agregar(sesion, items)
+
+    nodos = {variable.clave: servidor.get_node(nodeid) for variable, nodeid in zip(variables, ids_variables)}
+    dispositivos = {nombre: servidor.get_node(nodeid) for nombre, nodeid in ids_dispositivos.items()}
+    return nodos, dispositivos
+
+class EscritorValores:
+    """
+    Escribe escaneos en los nodos como una sola llamada Write, solo con
+    los valores que cambiaron. Lo usa un único hilo (el bucle del
+    servidor o el oyente del maestro en el gateway).
+    """
+
+    def __init__(self, servidor, nodos, tipos):
+        self._sesion = servidor.iserver.isession
+        self._nodeids = {clave: nodos[clave].nodeid for clave in tipos}
+        self._tipos = tipos # clave -> VariantType (solo se escriben estas claves)
+        self._ultimos = {}
+        self.escritos = 0
+        self.salteados = 0
+
+    def escribir(self, valores, timestamps=None, timestamp_ns=None):
+        """
+        valores: {clave: valor}; timestamps: {clave: adquisición en ns}
+        (si falta, timestamp_ns del escaneo; si tampoco hay, ahora).
+        Devuelve cuántos nodos se escribieron.
+        """
+        ultimos = self._ultimos
+        cambios = [(clave, valor) for clave, valor in valores.items()
+                   if clave in self._nodeids and ultimos.get(clave, _SIN_VALOR) != valor]
+        self.salteados += len(valores) - len(cambios)
+        if not cambios:
+            return 0
+
+        ahora = datetime.utcnow()
+        fechas = {} # Muchos tags comparten el sello de su bloque
+        escrituras = []
+        for clave, valor in cambios:
+            t_ns = (timestamps.get(clave) if timestamps else None) or timestamp_ns
+            fecha = fechas.get(t_ns)
+            if fecha is None:
+                fecha = fechas[t_ns] = fecha_desde_ns(t_ns) if t_ns else ahora
+            escritura = ua.WriteValue()
+            escritura.NodeId = self._nodeids[clave]
+            escritura.AttributeId = ua.AttributeIds.Value
+            escritura.Value = ua.DataValue(ua.Variant(valor, self._tipos.get(clave)),
+                                           sourceTimestamp=fecha, serverTimestamp=ahora)
+            escrituras.append(escritura)
+        parametros = ua.WriteParameters()
+        parametros.NodesToWrite = escrituras
+        resultados = self._sesion.write(parametros)
+
+        for (clave, valor), resultado in zip(cambios, resultados):
+            if resultado.is_good():
+                ultimos[clave] = valor
+            else:
+                print(f"⚠️ No se pudo escribir el nodo '{clave}': {resultado}")
+        self.escritos += len(cambios)
+        return len(cambios)
+
+    def olvidar(self):
+        """La próxima escritura vuelve a mandar todos los valores."""
+        self._ultimos.clear()
+
+# --- Auxiliares ---
+def _item(nodeid, nombre, padre, clase, referencia, tipo):
+    item = ua.AddNodesItem()
+    item.RequestedNewNodeId = nodeid
+    item.BrowseName = nombre
+    item.ParentNodeId = padre
+    item.NodeClass = clase
+    item.ReferenceTypeId = ua.NodeId(referencia)
+    item.TypeDefinition = ua.NodeId(tipo)
+    return item
+
+def _atributos(atributos, nombre):
+    atributos.DisplayName = ua.LocalizedText(nombre)
+    atributos.Description = ua.LocalizedText(nombre)
+    atributos.WriteMask = 0
+    atributos.UserWriteMask = 0
+    return atributos
+
+def _atributos_variable(nombre, valor, tipo_dato):
+    """Variable escalar de solo lectura."""
+    atributos = _atributos(ua.VariableAttributes(), nombre)
+    atributos.Value = valor
+    atributos.DataType = ua.NodeId(tipo_dato)
+    atributos.ValueRank = ua.ValueRank.Scalar
+    atributos.Historizing = False
+    atributos.AccessLevel = ua.AccessLevel.CurrentRead.mask
+    atributos.UserAccessLevel = ua.AccessLevel.CurrentRead.mask
+    return atributos
+
+def _propiedad(padre, nombre, valor, tipo_dato):
+    item = _item(ua.NodeId(f"{padre.Identifier}.{nombre}", padre.NamespaceIndex), ua.QualifiedName(nombre, 0),
+                 padre, ua.NodeClass.Variable, ua.ObjectIds.HasProperty, ua.ObjectIds.PropertyType)
+    item.NodeAttributes = _atributos_variable(nombre, ua.Variant(valor, ua.VariantType.ExtensionObject), tipo_dato)
+    return item
+
+def _agregar(sesion, items):
+    """Un AddNodes para todos los items; devuelve los NodeIds creados."""
+    if not items:
+        return []
+    resultados = sesion.add_nodes(items)
+    for resultado in resultados:
+        resultado.StatusCode.check()
+    return [resultado.AddedNodeId for resultado in resultados]
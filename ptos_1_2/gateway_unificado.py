@@ -0,0 +1,297 @@
+# ---------- Gateway unificado: Maestro Modbus + Servidor OPC UA + MQTT ----------
+#
+# Modo de un solo proceso. En vez de tres scripts encadenados (maestro ->
+# imagen de proceso -> servidor OPC -> opc.tcp -> bridge -> MQTT), cada
+# escaneo del maestro actualiza directamente una tabla de tags en
+# memoria, los nodos OPC UA y los tópicos MQTT: la latencia extremo a
+# extremo pasa a ser la de un escaneo, sin serializar nada entre medio.
+#
+# Reutiliza los scripts existentes (se cargan como módulos, sin ejecutar
+# su __main__), así que el despliegue en tres procesos sigue disponible.
+#
+# ---------------------------------------------------------------------
+
+import asyncio
+import importlib.util
+import json
+import os
+import ssl
+import threading
+import time
+import uuid
+
+import paho.mqtt.client as mqtt
+
+from outbox_mqtt import OutboxMQTT
+from metricas_modbus import actualizar_nodos_diagnostico
+from traza_latencia import TRAZA_NO, TRAZA_PROPIEDADES, preparar, propiedades_mqtt
+from publicacion_mqtt import FORMATO_NO, AliasTopicos, EstadosRetenidos, codificar_escaneo
+from agregacion_ventanas import AgregadorVentanas, topico_agregado
+from espacio_opc import EscritorValores
+
+def cargar_script(nombre_archivo, nombre_modulo):
+    """Importa un script de esta carpeta (los nombres tienen espacios)."""
+    ruta = os.path.join(os.path.dirname(os.path.abspath(__file__)), nombre_archivo)
+    spec = importlib.util.spec_from_file_location(nombre_modulo, ruta)
+    modulo = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(modulo)
+    return modulo
+
+maestro_modbus = cargar_script("maestro_modbus_json (1).py", "maestro_modbus")
+servidor_opc = cargar_script("servidor_opc_json (1).py", "servidor_opc")
+
+# --- Configuración ---
+TOPIC_BASE = maestro_modbus.TOPIC_BASE
+HEARTBEAT_PERIOD = 2.0 # s entre heartbeats (y refresco completo de los tópicos)
+PUB_QOS_STATUS = 1
+OUTBOX_DB = "outbox_mqtt.db"
+TRAZA_MQTT = TRAZA_NO # "propiedades" (MQTT v5) o "sobre" (JSON): traza de latencia de los tags
+AGG_VENTANAS = [] # Ej. [10, 60]: min/max/media/último/cantidad por ventana en {TOPIC_BASE}/agg/{duración}s/...
+AGG_QOS = 1
+AGG_GRACIA = 0.0 # s que una ventana sigue aceptando muestras atrasadas antes de publicarse
+PUBLICAR_CRUDOS = "todos" # "todos" (cambios + refresco periódico), "cambios" (solo cambios: alarmas) o "no"
+PAYLOAD_ESCANEO = FORMATO_NO # "json" / "msgpack": un mensaje por escaneo en {TOPIC_BASE}/escaneo (ver publicacion_mqtt.py)
+QOS_ESCANEO = 0
+TOPIC_ALIAS = False # Topic Alias de MQTT v5 en los tópicos QoS 0
+
+TOPIC_OPC_SERVER = f"{TOPIC_BASE}/state/opc_server"
+TOPIC_OPC_CLIENTE = f"{TOPIC_BASE}/state/opc_cliente"
+TOPICO_ESCANEO = f"{TOPIC_BASE}/escaneo"
+
+# Tag del maestro / contador / estado -> (nodo OPC, tópico MQTT, QoS, retain)
+# (mismos tópicos que publica el bridge en el despliegue separado; los
+# de los tags salen del mapa de tags del maestro)
+PUBLICACIONES = {
+    **maestro_modbus.MAPA_TAGS.publicaciones(TOPIC_BASE),
+    "aceptadas":     ("ok",      f"{TOPIC_BASE}/estadistica/modbus_aceptadas", PUB_QOS_STATUS, False),
+    "error_crc":     ("crc",     f"{TOPIC_BASE}/estadistica/modbus_crc_error", PUB_QOS_STATUS, False),
+    "no_alcanzado":  ("nr",      f"{TOPIC_BASE}/estadistica/modbus_no_alcanzado", PUB_QOS_STATUS, False),
+    "excepcion_esclavo": ("exc", f"{TOPIC_BASE}/estadistica/modbus_excepcion_esclavo", PUB_QOS_STATUS, False),
+    "esclavo":       ("esclavo", f"{TOPIC_BASE}/state/modbus_esclavo", PUB_QOS_STATUS, True),
+    "maestro":       ("maestro", f"{TOPIC_BASE}/state/modbus_maestro", PUB_QOS_STATUS, True),
+}
+CONTADORES = ("aceptadas", "error_crc", "no_alcanzado", "excepcion_esclavo")
+TIPOS_VARIANTE = servidor_opc.TIPOS_VARIANTE # clave OPC -> tipo del nodo de cada tag
+MAPA_TAGS = maestro_modbus.MAPA_TAGS
+
+class TablaTags:
+    """Último valor de cada tag y estado, compartido por el maestro, el
+    servidor OPC UA y el publicador MQTT."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._valores = {}
+
+    def actualizar(self, nuevos):
+        """Guarda los valores y devuelve solo los que cambiaron."""
+        with self._lock:
+            cambios = {nombre: valor for nombre, valor in nuevos.items()
+                       if self._valores.get(nombre) != valor}
+            self._valores.update(cambios)
+        return cambios
+
+    def instantanea(self):
+        with self._lock:
+            return dict(self._valores)
+
+def publicador_agregados(duracion):
+    def publicar_resumen(nombre, resumen):
+        if outbox is not None:
+            outbox.publicar(topico_agregado(TOPIC_BASE, duracion, MAPA_TAGS[nombre].topico),
+                            json.dumps(resumen), qos=AGG_QOS)
+    return publicar_resumen
+
+# --- Globales ---
+tabla = TablaTags()
+agregadores = [AgregadorVentanas(duracion, publicador_agregados(duracion), gracia=AGG_GRACIA)
+               for duracion in AGG_VENTANAS]
+opc_nodes = {}
+escritor = None # EscritorValores de los nodos OPC (una escritura por escaneo)
+nodos_diagnostico = {}
+mqtt_client = None
+outbox = None
+alias_topicos = AliasTopicos() if TOPIC_ALIAS else None
+# Retenidos de estado: solo en las transiciones (y una vez por conexión)
+estados_retenidos = EstadosRetenidos(lambda *args, **kwargs: outbox.publicar(*args, **kwargs))
+
+def escribir_opc(cambios, valores=None, timestamp_ns=None):
+    """Vuelca los cambios de un escaneo a los nodos OPC en una sola
+    escritura; los tags leídos llevan timestamp_ns como SourceTimestamp.
+    Devuelve el instante de la escritura (ns) o None sin servidor."""
+    if escritor is None:
+        return None
+    escritor.escribir({PUBLICACIONES[nombre][0]: valor for nombre, valor in cambios.items() if nombre in PUBLICACIONES},
+                      {PUBLICACIONES[nombre][0]: timestamp_ns for nombre in valores or () if nombre in PUBLICACIONES})
+    return time.time_ns()
+
+def publicar(nombre, valor, timestamp_ns=None, t_opc=None, lote=None):
+    """Tópico MQTT de un tag. Con timestamp_ns (adquisición) y t_opc
+    (escritura en el nodo OPC) el mensaje lleva la traza de latencia.
+    Con `lote` (dict), los no retenidos se juntan ahí en vez de publicarse."""
+    clave, topico, qos, retener = PUBLICACIONES[nombre]
+    traza = None
+    if timestamp_ns is not None and t_opc is not None and clave in TIPOS_VARIANTE:
+        traza = {"t_adq": timestamp_ns, "t_opc": t_opc, "t_bridge": t_opc} # Sin bridge: ese salto es nulo
+    if outbox is None or (PUBLICAR_CRUDOS == "no" and clave in TIPOS_VARIANTE):
+        return
+    if retener:
+        estados_retenidos.actualizar(topico, valor, qos)
+    elif lote is not None:
+        lote[clave] = valor
+    else:
+        properties = None
+        if traza is not None and TRAZA_MQTT != TRAZA_NO:
+            traza["t_pub"] = time.time_ns()
+            valor, properties = preparar(valor, traza, TRAZA_MQTT)
+        outbox.publicar(topico, valor, qos=qos, retain=retener, properties=properties)
+
+def publicar_lote(lote, timestamp_ns=None):
+    """Un solo mensaje (PAYLOAD_ESCANEO) con {clave: valor} del escaneo."""
+    contenido = {"valores": lote}
+    properties = None
+    if timestamp_ns is not None:
+        contenido["t_adq"] = timestamp_ns
+        if TRAZA_MQTT != TRAZA_NO:
+            ahora = time.time_ns()
+            traza = {"t_adq": timestamp_ns, "t_opc": ahora, "t_bridge": ahora, "t_pub": ahora}
+            if TRAZA_MQTT == TRAZA_PROPIEDADES:
+                properties = propiedades_mqtt(traza)
+            else:
+                contenido["traza"] = traza
+    outbox.publicar(TOPICO_ESCANEO, codificar_escaneo(contenido, PAYLOAD_ESCANEO),
+                    qos=QOS_ESCANEO, properties=properties)
+
+def al_escanear(estado, valores, tags_leidos, stats, registros, timestamp_ns=None):
+    """Oyente de publicar_escaneo() del maestro: vuelca el escaneo a OPC y MQTT."""
+    if valores and agregadores:
+        t = timestamp_ns / 1e9 if timestamp_ns is not None else None
+        for agregador in agregadores:
+            for nombre, valor in valores.items():
+                agregador.agregar(nombre, valor, t)
+    nuevos = dict(valores or {})
+    nuevos.update({nombre: stats[nombre] for nombre in CONTADORES})
+    nuevos["esclavo"] = estado
+    nuevos["maestro"] = "DETENIDO" if estado == "DETENIDO" else "RUNNING"
+    cambios = tabla.actualizar(nuevos)
+    t_opc = escribir_opc(cambios, valores, timestamp_ns)
+    lote = {} if PAYLOAD_ESCANEO != FORMATO_NO else None
+    for nombre, valor in cambios.items():
+        if nombre in PUBLICACIONES:
+            publicar(nombre, valor, timestamp_ns if valores and nombre in valores else None, t_opc, lote)
+    if lote and outbox is not None:
+        publicar_lote(lote, timestamp_ns if valores else None)
+
+def publicar_metricas(instantanea):
+    """Snapshot periódico de métricas: nodos de diagnóstico OPC y MQTT pci/metrics."""
+    actualizar_nodos_diagnostico(opc_nodes["diagnostico"], nodos_diagnostico, instantanea)
+    if mqtt_client.is_connected():
+        mqtt_client.publish(maestro_modbus.TOPICO_METRICAS, json.dumps(instantanea), qos=0)
+
+async def latido():
+    """Heartbeat de estado y refresco periódico de todos los tópicos
+    (los clientes MQTT reciben datos aunque los valores no cambien).
+    Con PUBLICAR_CRUDOS distinto de "todos", los tags de datos no se
+    refrescan; además se cierran las ventanas de agregación vencidas.
+    Los retenidos solo salen si cambiaron o tras una reconexión."""
+    while True:
+        lote = {} if PAYLOAD_ESCANEO != FORMATO_NO else None
+        for nombre, valor in tabla.instantanea().items():
+            if nombre in PUBLICACIONES and (PUBLICAR_CRUDOS == "todos" or PUBLICACIONES[nombre][0] not in TIPOS_VARIANTE):
+                publicar(nombre, valor, lote=lote)
+        if lote:
+            publicar_lote(lote)
+        for agregador in agregadores:
+            agregador.vencer()
+        estados_retenidos.actualizar(TOPIC_OPC_SERVER, "RUNNING", PUB_QOS_STATUS, persistir=False)
+        estados_retenidos.actualizar(TOPIC_OPC_CLIENTE, "RUNNING", PUB_QOS_STATUS, persistir=False)
+        await asyncio.sleep(HEARTBEAT_PERIOD)
+
+async def principal():
+    tarea_latido = asyncio.create_task(latido())
+    try:
+        await maestro_modbus.principal()
+    finally:
+        tarea_latido.cancel()
+
+def on_connect(client, userdata, flags, reason_code, properties=None):
+    maestro_modbus.on_connect(client, userdata, flags, reason_code, properties)
+    # Los alias valen por conexión, y el LWT pudo pisar los retenidos
+    if alias_topicos is not None:
+        alias_topicos.reiniciar(properties)
+    estados_retenidos.olvidar()
+
+def crear_cliente_mqtt():
+    """Un solo cliente: recibe los comandos (callbacks del maestro) y publica los datos."""
+    cliente = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, client_id=f"gateway-pci-{uuid.uuid4().hex[:6]}",
+                          protocol=mqtt.MQTTv5 if TRAZA_MQTT == TRAZA_PROPIEDADES or TOPIC_ALIAS else mqtt.MQTTv311)
+    cliente.on_connect = on_connect
+    cliente.on_message = maestro_modbus.on_message
+    cliente.will_set(TOPIC_OPC_CLIENTE, payload="CRASHED", qos=PUB_QOS_STATUS, retain=True)
+    cliente.username_pw_set(maestro_modbus.MQTT_USERNAME, maestro_modbus.MQTT_PASSWORD)
+    cliente.tls_set(
+        ca_certs=maestro_modbus.CA_CERT_FILE,
+        cert_reqs=ssl.CERT_REQUIRED,
+        tls_version=ssl.PROTOCOL_TLSv1_2
+    )
+    print(f"Usando SSL/TLS con el certificado: {maestro_modbus.CA_CERT_FILE}")
+    return cliente
+
+# --- Bucle Principal ---
+if __name__ == "__main__":
+
+    try:
+        mqtt_client = crear_cliente_mqtt()
+    except FileNotFoundError:
+        print(f"❌ ERROR: No se encontró el archivo de certificado '{maestro_modbus.CA_CERT_FILE}'")
+        exit()
+    except Exception as e:
+        print(f"Error al configurar SSL: {e}")
+        exit()
+
+    servidor, opc_nodes = servidor_opc.iniciar_servidor_opcua()
+    escritor = EscritorValores(servidor, opc_nodes, servidor_opc.TIPOS_NODOS)
+
+    mqtt_client.connect_async(maestro_modbus.BROKER, maestro_modbus.PORT, keepalive=60)
+    mqtt_client.loop_start()
+    outbox = OutboxMQTT(mqtt_client, OUTBOX_DB, alias=alias_topicos)
+    outbox.iniciar()
+
+    maestro_modbus.oyentes_escaneo.append(al_escanear)
+    for bus in maestro_modbus.buses:
+        print(f"{bus}:")
+        for bloque in bus.planificador.bloques:
+            print(f"  Grupo de sondeo: {bloque}")
+
+    metricas = maestro_modbus.metricas
+    maestro_modbus.verificar_carga_bus()
+    maestro_modbus.registrar_medidores()
+    maestro_modbus.iniciar_grabador()
+    metricas.registrar_medidor("cola_outbox", outbox.pendientes)
+    metricas.iniciar_publicacion(maestro_modbus.METRICAS_PERIODO, publicar_metricas)
+    if maestro_modbus.METRICAS_HTTP_PUERTO:
+        metricas.iniciar_http(maestro_modbus.METRICAS_HTTP_PUERTO)
+    print("Gateway unificado: Maestro Modbus + Servidor OPC UA + MQTT en un solo proceso")
+
+    try:
+        asyncio.run(principal())
+
+    except KeyboardInterrupt:
+        print("Cerrando gateway...")
+
+    finally:
+        for bus in maestro_modbus.buses:
+            bus.cerrar_puerto()
+        if maestro_modbus.grabador is not None:
+            maestro_modbus.grabador.cerrar()
+        maestro_modbus.publicar_escaneo("DETENIDO")
+        try:
+            for topico in (TOPIC_OPC_CLIENTE, TOPIC_OPC_SERVER):
+                mqtt_client.publish(topico, "", qos=PUB_QOS_STATUS, retain=True).wait_for_publish(timeout=2.0)
+        except (RuntimeError, ValueError) as e:
+            print(f"No se pudieron limpiar los estados retenidos: {e}")
+        print(f"Cerrando outbox ({outbox.pendientes()} mensajes pendientes quedan en disco)...")
+        outbox.cerrar()
+        mqtt_client.loop_stop()
+        mqtt_client.disconnect()
+        servidor.stop()
+        print("Estado 'DETENIDO' publicado.")
@@ -0,0 +1,305 @@
+# ---------- Historiador en memoria para el servidor OPC UA ----------
+#
+# Cada variable historizada guarda sus últimos N cambios en un buffer
+# circular compacto (int64 timestamp + float64 valor = 16 bytes por
+# muestra), en RAM o, opcionalmente, en un archivo mapeado en memoria
+# (sobrevive a reinicios del servidor). Sirve:
+#   - HistoryReadRaw: muestras crudas entre dos instantes.
+#   - HistoryReadProcessed: mínimo / máximo / promedio / cantidad por
+#     intervalo (python-opcua no lo implementa; lo agrega HistorialManager).
+#
+# Con NumPy instalado los agregados se calculan vectorizados sobre el
+# mismo buffer, sin copias; sin NumPy se usa Python puro.
+#
+# ---------------------------------------------------------------------
+
+import mmap
+import os
+import re
+from datetime import datetime, timedelta
+
+from opcua import ua
+from opcua.server.history import HistoryManager, HistoryStorageInterface, UaNodeAlreadyHistorizedError
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+PROFUNDIDAD_POR_DEFECTO = 36000   # p. ej. 1 h a 10 muestras/s
+_EPOCA = datetime(1970, 1, 1)
+_MICROSEGUNDO = timedelta(microseconds=1)
+_CABECERA = 16                    # cabeza (int64) + cantidad (int64)
+
+def a_microsegundos(fecha):
+    """datetime UTC naive (como los usa python-opcua) -> µs desde 1970."""
+    return (fecha - _EPOCA) // _MICROSEGUNDO
+
+def desde_microsegundos(us):
+    return _EPOCA + timedelta(microseconds=us)
+
+class BufferCircular:
+    """
+    Buffer circular de (timestamp_us, valor). Si se pasa `archivo`, el
+    almacenamiento es un mmap de ese archivo (se reabre con su contenido).
+    """
+
+    def __init__(self, capacidad, archivo=None):
+        self.capacidad = capacidad
+        tamano = _CABECERA + 16 * capacidad
+        if archivo is None:
+            self._almacen = bytearray(tamano)
+        else:
+            nuevo = not os.path.exists(archivo) or os.path.getsize(archivo) != tamano
+            with open(archivo, "w+b" if nuevo else "r+b") as f:
+                if nuevo:
+                    f.truncate(tamano)
+                self._almacen = mmap.mmap(f.fileno(), tamano)
+        vista = memoryview(self._almacen)
+        self._estado = vista[:_CABECERA].cast("q")         # [cabeza, cantidad]
+        self.timestamps = vista[_CABECERA:_CABECERA + 8 * capacidad].cast("q")
+        self.valores = vista[_CABECERA + 8 * capacidad:].cast("d")
+
+    def __len__(self):
+        return self._estado[1]
+
+    def agregar(self, timestamp_us, valor):
+        cabeza, cantidad = self._estado[0], self._estado[1]
+        self.timestamps[cabeza] = timestamp_us
+        self.valores[cabeza] = valor
+        self._estado[0] = (cabeza + 1) % self.capacidad
+        if cantidad < self.capacidad:
+            self._estado[1] = cantidad + 1
+
+    def _fisico(self, i):
+        """Índice lógico (0 = más viejo) -> índice en el buffer."""
+        return (self._estado[0] - self._estado[1] + i) % self.capacidad
+
+    def _buscar(self, timestamp_us, derecha=False):
+        """Bisección sobre el orden lógico (las muestras llegan en orden)."""
+        bajo, alto = 0, len(self)
+        while bajo < alto:
+            medio = (bajo + alto) // 2
+            t = self.timestamps[self._fisico(medio)]
+            if t < timestamp_us or (derecha and t == timestamp_us):
+                bajo = medio + 1
+            else:
+                alto = medio
+        return bajo
+
+    def rango(self, inicio_us, fin_us):
+        """Índices lógicos [desde, hasta) con inicio_us <= t <= fin_us."""
+        return self._buscar(inicio_us), self._buscar(fin_us, derecha=True)
+
+    def muestra(self, i):
+        j = self._fisico(i)
+        return self.timestamps[j], self.valores[j]
+
+    def segmentos(self, desde, hasta):
+        """Los (a lo sumo dos) tramos físicos contiguos de [desde, hasta),
+        como pares de memoryviews (timestamps, valores), sin copia."""
+        tramos = []
+        while desde < hasta:
+            j = self._fisico(desde)
+            largo = min(hasta - desde, self.capacidad - j)
+            tramos.append((self.timestamps[j:j + largo], self.valores[j:j + largo]))
+            desde += largo
+        return tramos
+
+    def cerrar(self):
+        for vista in (self._estado, self.timestamps, self.valores):
+            vista.release()
+        if isinstance(self._almacen, mmap.mmap):
+            self._almacen.close()
+
+# --- Agregados ---
+MINIMO = "minimo"
+MAXIMO = "maximo"
+PROMEDIO = "promedio"
+CANTIDAD = "cantidad"
+
+AGREGADOS_OPC = {
+    ua.ObjectIds.AggregateFunction_Minimum: MINIMO,
+    ua.ObjectIds.AggregateFunction_Maximum: MAXIMO,
+    ua.ObjectIds.AggregateFunction_Average: PROMEDIO,
+    ua.ObjectIds.AggregateFunction_Count: CANTIDAD,
+}
+
+MAX_INTERVALOS = 10000            # tope por nodo en un ReadProcessed
+
+class DemasiadosIntervalos(Exception):
+    """El ReadProcessed pide más intervalos que MAX_INTERVALOS."""
+
+def agregar_intervalos(buffer, inicio_us, fin_us, intervalo_us, agregado):
+    """Devuelve [(inicio_intervalo_us, valor | None)] para [inicio, fin)."""
+    if -(-(fin_us - inicio_us) // intervalo_us) > MAX_INTERVALOS:
+        raise DemasiadosIntervalos(fin_us - inicio_us, intervalo_us)
+    resultados = []
+    t = inicio_us
+    while t < fin_us:
+        t_fin = min(t + intervalo_us, fin_us)
+        desde, hasta = buffer.rango(t, t_fin - 1)
+        resultados.append((t, _agregado(buffer, desde, hasta, agregado)))
+        t = t_fin
+    return resultados
+
+def _agregado(buffer, desde, hasta, agregado):
+    if agregado == CANTIDAD:
+        return hasta - desde
+    if hasta <= desde:
+        return None
+    parciales = []
+    for _, valores in buffer.segmentos(desde, hasta):
+        datos = np.frombuffer(valores, dtype=np.float64) if np is not None else valores
+        if agregado == MINIMO:
+            parciales.append(float(datos.min()) if np is not None else min(datos))
+        elif agregado == MAXIMO:
+            parciales.append(float(datos.max()) if np is not None else max(datos))
+        else:
+            parciales.append(float(datos.sum()) if np is not None else sum(datos))
+    if agregado == MINIMO:
+        return min(parciales)
+    if agregado == MAXIMO:
+        return max(parciales)
+    return sum(parciales) / (hasta - desde)
+
+# --- Backend de historia para python-opcua ---
+class HistorialRing(HistoryStorageInterface):
+    """
+    Almacenamiento de historia con un BufferCircular por nodo.
+    `count` de historize_node_data_change es la profundidad del buffer.
+    Con `directorio`, cada buffer vive en un archivo mapeado en memoria.
+    """
+
+    def __init__(self, profundidad=PROFUNDIDAD_POR_DEFECTO, directorio=None):
+        self.profundidad = profundidad
+        self.directorio = directorio
+        self.buffers = {}
+        if directorio:
+            os.makedirs(directorio, exist_ok=True)
+
+    def new_historized_node(self, node_id, period, count=0):
+        if node_id in self.buffers:
+            raise UaNodeAlreadyHistorizedError(node_id)
+        archivo = None
+        if self.directorio:
+            nombre = re.sub(r"[^A-Za-z0-9_]", "_", node_id.to_string())
+            archivo = os.path.join(self.directorio, f"hist_{nombre}.bin")
+        self.buffers[node_id] = BufferCircular(count or self.profundidad, archivo)
+
+    def save_node_value(self, node_id, datavalue):
+        valor = datavalue.Value.Value if datavalue.Value is not None else None
+        if not isinstance(valor, (int, float)):
+            return  # Solo se historizan valores numéricos (incluye bool)
+        fecha = datavalue.SourceTimestamp or datavalue.ServerTimestamp or datetime.utcnow()
+        self.buffers[node_id].agregar(a_microsegundos(fecha), float(valor))
+
+    def read_node_history(self, node_id, start, end, nb_values):
+        """Misma semántica que HistoryDict (inicio/fin sin especificar,
+        orden inverso si start > end, punto de continuación)."""
+        buffer = self.buffers.get(node_id)
+        if buffer is None or len(buffer) == 0:
+            return [], None
+        epoca_win = ua.get_win_epoch()
+        start = None if start in (None, epoca_win) else a_microsegundos(start)
+        end = None if end in (None, epoca_win) else a_microsegundos(end)
+
+        inverso = start is None or (end is not None and start > end)
+        if start is None:
+            desde, hasta = buffer.rango(end if end is not None else -2**62, 2**62)
+        elif end is None:
+            desde, hasta = buffer.rango(start, 2**62)
+        else:
+            desde, hasta = buffer.rango(min(start, end), max(start, end))
+
+        indices = range(hasta - 1, desde - 1, -1) if inverso else range(desde, hasta)
+        cont = None
+        if nb_values and len(indices) > nb_values:
+            cont = desde_microsegundos(buffer.muestra(indices[nb_values])[0])
+            indices = indices[:nb_values]
+        return [_data_value(*buffer.muestra(i)) for i in indices], cont
+
+    def read_processed(self, node_id, inicio, fin, intervalo_ms, agregado):
+        buffer = self.buffers.get(node_id)
+        if buffer is None:
+            return None
+        if len(buffer) == 0:
+            return []
+        inicio_us, fin_us = a_microsegundos(inicio), a_microsegundos(fin)
+        intervalo_us = int(intervalo_ms * 1000)
+        # Fuera de [más vieja, más nueva] solo habría intervalos sin datos:
+        # se recorta el rango (sin mover la grilla de intervalos), así un
+        # StartTime sin especificar (1601) no genera millones de vueltas
+        mas_vieja, mas_nueva = buffer.muestra(0)[0], buffer.muestra(len(buffer) - 1)[0]
+        if intervalo_us and inicio_us < mas_vieja:
+            inicio_us += (mas_vieja - inicio_us) // intervalo_us * intervalo_us
+        elif not intervalo_us:
+            inicio_us = max(inicio_us, mas_vieja)
+        fin_us = min(fin_us, mas_nueva + 1)
+        if fin_us <= inicio_us:
+            return []
+        intervalo_us = intervalo_us or fin_us - inicio_us
+        resultados = []
+        for t, valor in agregar_intervalos(buffer, inicio_us, fin_us, intervalo_us, agregado):
+            if valor is None:
+                dv = ua.DataValue(status=ua.StatusCode(ua.StatusCodes.BadNoData))
+                dv.SourceTimestamp = desde_microsegundos(t)
+            else:
+                dv = _data_value(t, valor)
+            resultados.append(dv)
+        return resultados
+
+    # Eventos: no se historizan
+    def new_historized_event(self, source_id, evtypes, period, count=0):
+        pass
+
+    def save_event(self, event):
+        pass
+
+    def read_event_history(self, source_id, start, end, nb_values, evfilter):
+        return [], None
+
+    def stop(self):
+        for buffer in self.buffers.values():
+            buffer.cerrar()
+        self.buffers.clear()
+
+def _data_value(timestamp_us, valor):
+    dv = ua.DataValue(ua.Variant(valor, ua.VariantType.Double))
+    dv.SourceTimestamp = desde_microsegundos(timestamp_us)
+    dv.ServerTimestamp = dv.SourceTimestamp
+    return dv
+
+class HistorialManager(HistoryManager):
+    """HistoryManager de python-opcua + soporte de ReadProcessedDetails."""
+
+    def read_history(self, params):
+        detalles = params.HistoryReadDetails
+        if not isinstance(detalles, ua.ReadProcessedDetails):
+            return super().read_history(params)
+        return [self._leer_procesado(detalles, rv, i) for i, rv in enumerate(params.NodesToRead)]
+
+    def _leer_procesado(self, detalles, rv, i):
+        resultado = ua.HistoryReadResult()
+        tipos = detalles.AggregateType
+        agregado = AGREGADOS_OPC.get(tipos[i].Identifier) if i < len(tipos) else None
+        if agregado is None:
+            resultado.StatusCode = ua.StatusCode(ua.StatusCodes.BadAggregateNotSupported)
+            return resultado
+        try:
+            valores = self.storage.read_processed(rv.NodeId, detalles.StartTime, detalles.EndTime,
+                                                  detalles.ProcessingInterval, agregado)
+        except DemasiadosIntervalos:
+            resultado.StatusCode = ua.StatusCode(ua.StatusCodes.BadTooManyOperations)
+            return resultado
+        if valores is None:
+            resultado.StatusCode = ua.StatusCode(ua.StatusCodes.BadHistoryOperationUnsupported)
+            return resultado
+        resultado.HistoryData = ua.HistoryData()
+        resultado.HistoryData.DataValues = valores
+        return resultado
+
+def instalar_historial(servidor, historial):
+    """Reemplaza el gestor de historia del servidor (llamar antes de start())."""
+    servidor.iserver.history_manager = HistorialManager(servidor.iserver)
+    servidor.iserver.history_manager.set_storage(historial)
@@ -0,0 +1,235 @@
+# ---------- Imagen de proceso en memoria compartida ----------
+#
+# Reemplaza el traspaso por datos_modbus.json entre el maestro Modbus y
+# el servidor OPC UA. El maestro escribe cada escaneo en un archivo
+# mapeado en memoria (mmap; en Linux vive en /dev/shm, o sea, en RAM) con
+# un layout binario fijo; el servidor lo mapea de solo lectura y lee los
+# registros sin abrir, parsear ni copiar archivos.
+#
+# Layout (little-endian, todo alineado a 8 bytes):
+#   [cabecera 64 B] magic, versión, n_tags, generación (seqlock),
+#                   timestamp del escaneo (ns), estado, estadísticas,
+#                   tamaño del descriptor, n_registros
+#   [descriptor]    JSON con [nombre, desplazamiento, cantidad] por tag
+#                   (se escribe una sola vez; hace la imagen autodescriptiva)
+#   [timestamps]    int64 por tag: última lectura OK (ns)
+#   [estados]       uint16 por tag: estado del último intento
+#   [registros]     uint16 por registro
+#
+# Seqlock: el escritor pone la generación en impar, escribe, y la deja
+# en par. El lector reintenta si la ve impar o si cambió mientras leía.
+# La generación arranca en la hora en ns (par), no en 0: tras reiniciar
+# el maestro, un lector que recuerda la última generación vista no
+# confunde un escaneo nuevo con uno viejo.
+#
+# ---------------------------------------------------------------------
+
+import itertools
+import json
+import mmap
+import os
+import struct
+import tempfile
+import time
+
+MAGIC = b"PCIM"
+VERSION = 1
+CABECERA_BYTES = 64
+NOMBRE_ARCHIVO = "pci_imagen_proceso.bin"
+RUTA_POR_DEFECTO = os.path.join("/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir(),
+                                NOMBRE_ARCHIVO)
+PLAZO_LECTURA_S = 0.5             # tope para conseguir una instantánea consistente
+ESPERA_MIN_LECTURA_S = 0.00005    # backoff entre intentos mientras el escritor publica
+ESPERA_MAX_LECTURA_S = 0.001
+
+# Códigos de estado (mismo vocabulario que usaba el JSON)
+ESTADOS = ["INICIANDO", "OK", "ERROR_TIMEOUT", "ERROR_CRC", "ERROR_TRAMA_INCOMPLETA",
+           "ERROR_ESCLAVO", "ERROR_INTERNO", "ERROR_DESCONECTADO", "DETENIDO",
+           "ERROR_CONFIRMACION", "ERROR_CUARENTENA"]
+_CODIGO_ESTADO = {nombre: i for i, nombre in enumerate(ESTADOS)}
+CODIGO_DESCONOCIDO = 0xFFFF
+
+# Estadísticas que viajan en la cabecera, en orden
+STATS = ["aceptadas", "error_crc", "no_alcanzado", "excepcion_esclavo"]
+
+_cabecera = struct.Struct("<4sHHQqHH4III")
+_OFFSET_GENERACION = 8
+
+def _alinear(n):
+    return (n + 7) & ~7
+
+def codigo_estado(estado):
+    return _CODIGO_ESTADO.get(estado, CODIGO_DESCONOCIDO)
+
+def nombre_estado(codigo):
+    return ESTADOS[codigo] if codigo < len(ESTADOS) else "DESCONOCIDO"
+
+class ImagenProceso:
+    """Usar ImagenProceso.crear() en el maestro e ImagenProceso.abrir() en los lectores."""
+
+    def __init__(self, ruta, mapa, escritura):
+        self.ruta = ruta
+        self._mapa = mapa
+        self._escritura = escritura
+        self._inodo = os.stat(ruta).st_ino
+
+        (magic, version, n_tags, _, _, _, _, *_stats, tam_descriptor, n_registros) = \
+            _cabecera.unpack_from(mapa, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{ruta} no es una imagen de proceso v{VERSION}")
+
+        descriptor = json.loads(bytes(mapa[CABECERA_BYTES:CABECERA_BYTES + tam_descriptor]))
+        self.tags = [(nombre, desplazamiento, cantidad) for nombre, desplazamiento, cantidad in descriptor]
+        self._indice = {nombre: i for i, (nombre, _, _) in enumerate(self.tags)}
+
+        vista = memoryview(mapa)
+        inicio = CABECERA_BYTES + _alinear(tam_descriptor)
+        self._generacion = vista[_OFFSET_GENERACION:_OFFSET_GENERACION + 8].cast("Q")
+        self.timestamps = vista[inicio:inicio + 8 * n_tags].cast("q")
+        inicio += 8 * n_tags
+        self.estados = vista[inicio:inicio + 2 * n_tags].cast("H")
+        inicio += _alinear(2 * n_tags)
+        # Vista directa (sin copia) de los registros crudos
+        self.registros = vista[inicio:inicio + 2 * n_registros].cast("H")
+
+    # --- Creación / apertura ---
+    @classmethod
+    def crear(cls, tags, ruta=RUTA_POR_DEFECTO):
+        """Crea la imagen para una lista de Tag (planificador_modbus).
+        Se escribe en un temporal y se reemplaza de forma atómica: los
+        lectores detectan el cambio de archivo y se vuelven a mapear."""
+        descriptor = []
+        n_registros = 0
+        for tag in tags:
+            descriptor.append([tag.nombre, n_registros, tag.cantidad])
+            n_registros += tag.cantidad
+        descriptor_json = json.dumps(descriptor).encode("utf-8")
+        n_tags = len(descriptor)
+
+        tamano = (CABECERA_BYTES + _alinear(len(descriptor_json)) + 8 * n_tags
+                  + _alinear(2 * n_tags) + _alinear(2 * n_registros))
+        contenido = bytearray(tamano)
+        ahora = time.time_ns()
+        _cabecera.pack_into(contenido, 0, MAGIC, VERSION, n_tags, ahora & ~1, ahora,
+                            codigo_estado("INICIANDO"), 0, 0, 0, 0, 0,
+                            len(descriptor_json), n_registros)
+        contenido[CABECERA_BYTES:CABECERA_BYTES + len(descriptor_json)] = descriptor_json
+
+        ruta_tmp = ruta + ".tmp"
+        with open(ruta_tmp, "wb") as f:
+            f.write(contenido)
+        os.replace(ruta_tmp, ruta)
+
+        with open(ruta, "r+b") as f:
+            mapa = mmap.mmap(f.fileno(), tamano)
+        return cls(ruta, mapa, escritura=True)
+
+    @classmethod
+    def abrir(cls, ruta=RUTA_POR_DEFECTO):
+        """Mapea una imagen existente de solo lectura (FileNotFoundError si
+        el maestro todavía no la creó)."""
+        with open(ruta, "rb") as f:
+            mapa = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return cls(ruta, mapa, escritura=False)
+
+    def vigente(self):
+        """False si el maestro recreó la imagen (hay que volver a abrir)."""
+        try:
+            return os.stat(self.ruta).st_ino == self._inodo
+        except FileNotFoundError:
+            return False
+
+    def cerrar(self):
+        for vista in (self._generacion, self.timestamps, self.estados, self.registros):
+            vista.release()
+        self._mapa.close()
+
+    # --- Escritura (maestro) ---
+    def publicar(self, estado, stats, valores=None, tags_leidos=(), timestamp_ns=None):
+        """
+        Publica un escaneo. `valores` es {nombre_tag: valor | lista}
+        (solo si la lectura fue OK); `tags_leidos` son los tags que se
+        intentaron leer, a los que se les actualiza el estado.
+        """
+        if timestamp_ns is None:
+            timestamp_ns = time.time_ns()
+        codigo = codigo_estado(estado)
+        generacion = self._generacion[0]
+        self._generacion[0] = generacion + 1  # impar: escritura en curso
+
+        for nombre in tags_leidos:
+            self.estados[self._indice[nombre]] = codigo
+        if valores:
+            for nombre, valor in valores.items():
+                i = self._indice[nombre]
+                _, desplazamiento, cantidad = self.tags[i]
+                if cantidad == 1:
+                    self.registros[desplazamiento] = valor
+                else:
+                    self.registros[desplazamiento:desplazamiento + cantidad] = memoryview(
+                        struct.pack(f"{cantidad}H", *valor)).cast("H")
+                self.timestamps[i] = timestamp_ns
+        struct.pack_into("<qHH4I", self._mapa, 16, timestamp_ns, codigo, 0,
+                         *(stats.get(clave, 0) for clave in STATS))
+
+        self._generacion[0] = generacion + 2  # par: escaneo consistente
+
+    # --- Lectura (servidor OPC / bridge) ---
+    def generacion(self):
+        return self._generacion[0]
+
+    def leer(self, decodificador=None):
+        """
+        Devuelve una instantánea consistente con la misma forma que tenía
+        datos_modbus.json: estado, timestamp_lectura, un valor por tag y
+        los contadores stats_*. Agrega 'generacion', 'timestamp_ns' y
+        'timestamps_tag' ({tag: adquisición de su última lectura OK, ns}).
+        Con un decodificador (mapa_tags, armado con decodificador_imagen())
+        los tags van en unidades de ingeniería en vez de registros crudos.
+        """
+        limite = time.monotonic() + PLAZO_LECTURA_S
+        espera = 0.0
+        for intento in itertools.count():
+            if intento:
+                if time.monotonic() > limite:
+                    break
+                time.sleep(espera)  # 0 la primera vez: solo cede la CPU al escritor
+                espera = min(espera * 2 or ESPERA_MIN_LECTURA_S, ESPERA_MAX_LECTURA_S)
+            g1 = self._generacion[0]
+            if g1 & 1:
+                continue
+            (timestamp_ns, codigo, _, aceptadas, error_crc, no_alcanzado, excepcion) = \
+                struct.unpack_from("<qHH4I", self._mapa, 16)
+            datos = {
+                "estado": nombre_estado(codigo),
+                "timestamp_lectura": timestamp_ns // 1_000_000_000,
+                "timestamp_ns": timestamp_ns,
+                "generacion": g1,
+            }
+            registros = self.registros
+            if decodificador is not None:
+                datos.update(decodificador.como_dict(registros.tolist()))
+            else:
+                for nombre, desplazamiento, cantidad in self.tags:
+                    if cantidad == 1:
+                        datos[nombre] = registros[desplazamiento]
+                    else:
+                        datos[nombre] = registros[desplazamiento:desplazamiento + cantidad].tolist()
+            datos["timestamps_tag"] = dict(zip(self._indice, self.timestamps.tolist()))
+            datos["stats_aceptadas"] = aceptadas
+            datos["stats_crc"] = error_crc
+            datos["stats_no_alcanzado"] = no_alcanzado
+            datos["stats_excepcion_esclavo"] = excepcion
+            if self._generacion[0] == g1:
+                return datos
+        raise TimeoutError("No se pudo obtener una lectura consistente de la imagen de proceso")
+
+    def decodificador_imagen(self, mapa):
+        """Decodificador (mapa_tags.MapaTags) para el layout de esta imagen."""
+        return mapa.decodificador([(nombre, desplazamiento) for nombre, desplazamiento, _ in self.tags],
+                                  len(self.registros))
+
+    def estado_tag(self, nombre):
+        """(estado, timestamp_ns) del último intento de lectura de un tag."""
+        i = self._indice[nombre]
+        return nombre_estado(self.estados[i]), self.timestamps[i]
@@ -0,0 +1,47 @@
+# ---------- Lectura en lote de nodos OPC UA ----------
+#
+# Lee todos los nodos monitoreados por el bridge en UN solo servicio
+# Read, en vez de un get_value() (un viaje de ida y vuelta) por nodo.
+# Pide además los timestamps de origen y de servidor de cada valor.
+#
+# ---------------------------------------------------------------------
+
+from collections import namedtuple
+
+from opcua import ua
+
+# valor: Python nativo (None si el StatusCode no es Good, o si el nodo
+# tiene un valor nulo con estado Good: la calidad se mira con lectura_buena())
+Lectura = namedtuple("Lectura", ["valor", "estado", "timestamp_origen", "timestamp_servidor"])
+
+def lectura_buena(lectura):
+    """True si el StatusCode es Good (sin StatusCode, el servidor lo omitió: Good)."""
+    return lectura.estado is None or lectura.estado.is_good()
+
+def armar_peticion(nodos):
+    """ReadParameters para una lista de nodos (se puede reutilizar entre ciclos)."""
+    parametros = ua.ReadParameters()
+    parametros.TimestampsToReturn = ua.TimestampsToReturn.Both
+    for nodo in nodos:
+        lectura = ua.ReadValueId()
+        lectura.NodeId = nodo.nodeid
+        lectura.AttributeId = ua.AttributeIds.Value
+        parametros.NodesToRead.append(lectura)
+    return parametros
+
+def leer_lote(client, nodes_opc, parametros=None):
+    """
+    Lee los nodos de `nodes_opc` ({clave: Node}) en una sola petición.
+    Devuelve {clave: Lectura}.
+    """
+    claves = list(nodes_opc)
+    if parametros is None:
+        parametros = armar_peticion(nodes_opc[clave] for clave in claves)
+    resultados = client.uaclient.read(parametros)
+
+    lecturas = {}
+    for clave, dv in zip(claves, resultados):
+        bueno = dv.StatusCode is None or dv.StatusCode.is_good()
+        valor = dv.Value.Value if (bueno and dv.Value is not None) else None
+        lecturas[clave] = Lectura(valor, dv.StatusCode, dv.SourceTimestamp, dv.ServerTimestamp)
+    return lecturas
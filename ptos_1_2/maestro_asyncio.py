@@ -0,0 +1,128 @@
+# ---------- Maestro Modbus sobre asyncio ----------
+#
+# Un único "dueño" del puerto serie: todas las transacciones (lecturas
+# periódicas y comandos que llegan por MQTT) pasan por una cola con
+# prioridad y se ejecutan de a una en un hilo dedicado al bus. Así:
+#   - Los comandos del operador se adelantan a las lecturas pendientes y
+#     llegan al dispositivo en, como mucho, una transacción.
+#   - Cada escritura lee y valida su respuesta sin chocar con las
+#     lecturas (no hay locks compartidos con el hilo de red de paho).
+#
+# Las operaciones de bus son funciones bloqueantes normales (pyserial);
+# se ejecutan en un ThreadPoolExecutor de un solo hilo, que actúa como
+# el descriptor no bloqueante del puerto para el bucle de eventos.
+#
+# ---------------------------------------------------------------------
+
+import asyncio
+import itertools
+from concurrent.futures import ThreadPoolExecutor
+
+PRIORIDAD_COMANDO = 0
+PRIORIDAD_LECTURA = 1
+
+class MaestroAsyncio:
+    """
+    planificador: PlanificadorSondeo con los bloques a leer.
+    leer_bloque(bloque) -> (estado, datos): transacción bloqueante de lectura.
+    al_leer(bloque, estado, datos): se llama en el bucle tras cada lectura.
+    """
+
+    def __init__(self, planificador, leer_bloque, al_leer=None):
+        self.planificador = planificador
+        self.leer_bloque = leer_bloque
+        self.al_leer = al_leer
+        self.loop = None
+        self._cola = None
+        self._secuencia = itertools.count()
+        self._ejecutor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="bus-modbus")
+        self._en_curso = None # concurrent.futures.Future de la transacción en el hilo del bus
+
+    # --- API para encolar trabajo ---
+    async def enviar(self, funcion, *args, prioridad=PRIORIDAD_COMANDO):
+        """Encola funcion(*args) para el hilo del bus y espera su resultado."""
+        futuro = self.loop.create_future()
+        await self._cola.put((prioridad, next(self._secuencia), funcion, args, futuro))
+        return await futuro
+
+    def enviar_desde_hilo(self, funcion, *args, prioridad=PRIORIDAD_COMANDO):
+        """Versión thread-safe de enviar() (p. ej. desde on_message de paho).
+        Devuelve un concurrent.futures.Future; no bloquea al llamador."""
+        if self.loop is None:
+            raise RuntimeError("El maestro todavía no está en ejecución")
+        return asyncio.run_coroutine_threadsafe(
+            self.enviar(funcion, *args, prioridad=prioridad), self.loop)
+
+    def pendientes(self):
+        """Cantidad de peticiones esperando turno en el bus."""
+        return self._cola.qsize() if self._cola is not None else 0
+
+    # --- Tareas internas ---
+    async def _tarea_bus(self):
+        while True:
+            _, _, funcion, args, futuro = await self._cola.get()
+            if futuro.cancelled():
+                continue
+            try:
+                self._en_curso = self._ejecutor.submit(funcion, *args)
+                resultado = await asyncio.wrap_future(self._en_curso)
+            except OSError as e:
+                # Fallo del puerto (SerialException hereda de OSError): abortamos todo
+                futuro.set_exception(e)
+                raise
+            except Exception as e:
+                futuro.set_exception(e)
+            else:
+                futuro.set_result(resultado)
+
+    def _leer_a_tiempo(self, bloque, vencimiento):
+        """En el hilo del bus: mide el retraso real de inicio y lee."""
+        self.planificador.registrar_inicio(bloque, vencimiento)
+        return self.leer_bloque(bloque)
+
+    async def _tarea_sondeo(self):
+        while True:
+            _, espera = self.planificador.proximo()
+            if espera > 0:
+                await asyncio.sleep(espera)
+            bloque, vencimiento = self.planificador.tomar_con_vencimiento()
+            try:
+                (estado, datos) = await self.enviar(self._leer_a_tiempo, bloque, vencimiento,
+                                                    prioridad=PRIORIDAD_LECTURA)
+                if self.al_leer is not None:
+                    self.al_leer(bloque, estado, datos)
+            except OSError:
+                raise # El puerto cayó: ejecutar() termina y el llamador reconecta
+            except Exception as e:
+                # Un error de una lectura (decodificador, grabador, imagen...) no detiene el sondeo
+                print(f"⚠️ Error procesando la lectura de {bloque}: {e!r}")
+
+    async def ejecutar(self):
+        """Corre hasta que el puerto falle (relanza la excepción) o se cancele."""
+        self.loop = asyncio.get_running_loop()
+        self._cola = asyncio.PriorityQueue()
+        tareas = [asyncio.create_task(self._tarea_bus()),
+                  asyncio.create_task(self._tarea_sondeo())]
+        try:
+            await asyncio.gather(*tareas)
+        finally:
+            for tarea in tareas:
+                tarea.cancel()
+            await asyncio.gather(*tareas, return_exceptions=True)
+            # Cancelar la tarea no detiene la transacción que ya está en el
+            # hilo del bus: la esperamos (la acota el timeout del puerto) para
+            # que nadie cierre el puerto con una lectura en curso
+            if self._en_curso is not None and not self._en_curso.done():
+                await asyncio.gather(asyncio.wrap_future(self._en_curso), return_exceptions=True)
+            self._en_curso = None
+            # Avisamos a quien esté esperando un comando que no se va a ejecutar
+            while not self._cola.empty():
+                _, _, _, _, futuro = self._cola.get_nowait()
+                if not futuro.done():
+                    futuro.set_exception(ConnectionError("Maestro Modbus detenido"))
+            self.loop = None
+
+    def cerrar(self, esperar=True):
+        """Libera el hilo del bus (esperar=True: hasta que termine la transacción en curso).
+        Tras ejecutar() ya no queda ninguna, así que no bloquea."""
+        self._ejecutor.shutdown(wait=esperar)
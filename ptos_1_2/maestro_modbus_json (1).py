@@ -1,3 +1,4 @@
+import asyncio
 import serial
 import time
 import struct
@@ -7,30 +8,101 @@ import os
 import paho.mqtt.client as mqtt
 import ssl
 import uuid
+from collections import namedtuple
+
+from crc_modbus import calcular_crc
+from planificador_modbus import PlanificadorSondeo
+from receptor_rtu import configurar_puerto, longitud_respuesta, tiempo_trama, transaccion
+from tramas_modbus import confirmar_escritura
+from comandos_modbus import EtapaComandos, estado_escritura, trama_escritura, COIL
+from maestro_asyncio import MaestroAsyncio
+from imagen_proceso import ImagenProceso, RUTA_POR_DEFECTO
+from notificador_escaneo import EmisorEscaneo
+from metricas_modbus import MetricasModbus, PUERTO_HTTP
+from salud_esclavos import SaludEsclavos
+from servidor_modbus_tcp import CacheRegistros, ServidorModbusTCP, ExcepcionModbus, EXCEPCION_SIN_RESPUESTA
+from registro_muestras import GrabadorMuestras
+from mapa_tags import MapaTags, struct_registros, RUTA_POR_DEFECTO as RUTA_MAPA_TAGS
 
 # --- 1.d) Configuración MODBUS (Lectura) ---
 PUERTO_SERIAL = "COM7"
 BAUD_RATE = 9600
+
+# --- Buses RS-485: un maestro independiente por puerto ---
+# Cada puerto tiene su propio hilo de bus, planificador, timeouts por
+# esclavo y estadísticas; todos vuelcan en la misma tabla de tags (imagen
+# de proceso, OPC UA, MQTT, Modbus TCP). Los tags van al puerto de su
+# esclavo; esclavos=None toma los que no estén asignados a otro puerto.
+# Los IDs de esclavo no se repiten entre buses: los comandos (MQTT y
+# Modbus TCP) se enrutan por ID.
+PuertoSerie = namedtuple("PuertoSerie", ["puerto", "baudios", "esclavos"])
+PUERTOS_SERIE = [
+    PuertoSerie(PUERTO_SERIAL, BAUD_RATE, None),
+    # PuertoSerie("COM8", 19200, (2, 3)),
+]
 PARITY = serial.PARITY_NONE
 STOP_BITS = serial.STOPBITS_ONE
 BYTE_SIZE = serial.EIGHTBITS
-TIMEOUT_ESPERA = 1.0
+TIMEOUT_ESPERA = 1.0 # Timeout inicial y máximo; luego se adapta por esclavo (RTT)
+TIMEOUT_MINIMO = 0.05
+FALLOS_CUARENTENA = 3 # Timeouts seguidos para dejar de sondear un esclavo (salvo pruebas)
+ECO_ADAPTADOR = False # True si el adaptador RS-485 devuelve lo que transmite
 
 ID_ESCLAVO = 1
 FUNCION_LEER_REGISTROS = 0x03
 REGISTRO_INICIO = 0
 CANTIDAD_REGISTROS = 4
 
+# --- Tags de sondeo: se declaran en mapa_tags.json ---
+# (esclavo, dirección, tipo, escala, periodo, nodo OPC y tópico MQTT; el
+# mismo archivo lo leen el servidor OPC UA, el bridge y el gateway).
+# El planificador agrupa los rangos contiguos en una sola petición y
+# respeta el periodo del tag más rápido de cada grupo.
+ARCHIVO_MAPA_TAGS = RUTA_MAPA_TAGS
+MAPA_TAGS = MapaTags.cargar(ARCHIVO_MAPA_TAGS)
+TAGS_SONDEO = MAPA_TAGS.tags_sondeo()
+# Escaneo a tasa fija: si no es None, reemplaza el periodo de todos los tags
+# (p. ej. 0.05 s). Al arrancar se avisa si el bus no da abasto a esa tasa.
+PERIODO_ESCANEO = None
+if PERIODO_ESCANEO is not None:
+    TAGS_SONDEO = [tag._replace(periodo=PERIODO_ESCANEO) for tag in TAGS_SONDEO]
+
 # --- Configuración MODBUS (Escritura) ---
 FUNCION_ESCRIBIR_COIL = 0x05     # Escribir 1 bit (digital 0/1)
 FUNCION_ESCRIBIR_REGISTRO = 0x06 # Escribir 16 bits (analógico 0-255)
 COIL_LED_DIGITAL = 0             # Bobina para el LED digital
 REGISTRO_LED_ANALOG = 4          # Registro para el LED analógico
+# Fusionar escrituras contiguas en FC15/FC16. Desactivado: esclavo_integrador.ino
+# solo implementa FC05/FC06 y la fachada TCP deja que un cliente escriba
+# direcciones contiguas (o mande un FC16), que fusionadas el esclavo rechaza.
+# Activar solo con esclavos que acepten FC15/FC16.
+ESCRITURA_MULTIPLE = False
+# Reenvíos de un comando perdido (timeout, CRC, trama incompleta): a
+# diferencia de las lecturas, no hay un próximo sondeo que lo repita
+REINTENTOS_ESCRITURA = 1
 
-# --- 2.a) Configuración de Archivo JSON ---
+# --- 2.a) Traspaso al servidor OPC UA ---
+# La imagen de proceso en memoria compartida es el canal principal; el
+# archivo JSON queda como exportación opcional para depuración.
+RUTA_IMAGEN_PROCESO = RUTA_POR_DEFECTO
+EXPORTAR_JSON = False
 JSON_FILE = "datos_modbus.json"
 JSON_TMP_FILE = "datos_modbus.tmp"
 
+# --- 2.b) Métricas (latencias, ocupación del bus, colas) ---
+METRICAS_PERIODO = 10.0 # s entre publicaciones en MQTT y avisos al servidor OPC UA
+METRICAS_HTTP_PUERTO = PUERTO_HTTP # Endpoint Prometheus en localhost (None = desactivado)
+
+# --- 2.c) Fachada Modbus TCP (SCADA/HMI leen la caché, no el bus serie) ---
+MODBUS_TCP_PUERTO = 5020 # None = desactivado (el 502 estándar requiere privilegios)
+MODBUS_TCP_DIRECCION = "0.0.0.0"
+MODBUS_TCP_MAX_EDAD = 5.0 # s: registros más viejos se responden con excepción 0x0B
+
+# --- 2.d) Registro binario de escaneos (histórico de semanas, p. ej. en la SD) ---
+DIRECTORIO_MUESTRAS = None # Ej. "muestras": un registro por escaneo (None = desactivado)
+MUESTRAS_SEGMENTO_MB = 16 # Tamaño de cada segmento antes de rotar
+MUESTRAS_MAX_MB = 4096 # Al superarlo se borran los segmentos más viejos
+
 # --- 3. Configuración de MQTT ---
 TOPIC_BASE = "pci"
 BROKER = "j72b9212.ala.us-east-1.emqxsl.com"
@@ -42,6 +114,65 @@ CA_CERT_FILE = "emqxsl-ca.crt"
 # Tópicos a los que este script se suscribirá
 TOPICO_SUB_DIG = f"{TOPIC_BASE}/value1/dig"
 TOPICO_SUB_ANALOG = f"{TOPIC_BASE}/value1/analog"
+TOPICO_METRICAS = f"{TOPIC_BASE}/metrics"
+
+# --- Buses ---
+class BusSerie:
+    """Un puerto RS-485: su maestro asyncio (único dueño del puerto, con
+    su propio hilo de bus), planificador, etapa de comandos, salud de
+    esclavos y contadores."""
+
+    def __init__(self, puerto, baudios, tags):
+        self.puerto = puerto
+        self.baudios = baudios
+        self.tags = tags
+        self.esclavos = {tag.esclavo for tag in tags}
+        self.planificador = PlanificadorSondeo(tags)
+        self.etapa_comandos = EtapaComandos(ESCRITURA_MULTIPLE) # Escrituras pendientes (último valor gana)
+        self.salud = SaludEsclavos(TIMEOUT_ESPERA, TIMEOUT_MINIMO, TIMEOUT_ESPERA, FALLOS_CUARENTENA)
+        self.stats = dict.fromkeys(('aceptadas', 'error_crc', 'no_alcanzado', 'excepcion_esclavo'), 0)
+        self.ser = None
+        self.maestro = None # MaestroAsyncio
+        self.estado = "INICIANDO"
+        self.t_adquisicion = None # time.time_ns() de la última respuesta de lectura
+
+    def disponible(self):
+        return self.maestro is not None and self.ser is not None and self.ser.is_open
+
+    def leer_bloque(self, bloque):
+        """Transacción de lectura de un grupo del planificador (hilo del bus)."""
+        return ciclo_maestro_modbus(self.ser, bloque.esclavo, bloque.funcion, bloque.inicio,
+                                    bloque.cantidad, bus=self)
+
+    def cerrar_puerto(self):
+        if self.ser and self.ser.is_open:
+            self.ser.close()
+        self.ser = None
+
+    def __repr__(self):
+        return f"Bus({self.puerto}, {self.baudios} baudios, esclavos={sorted(self.esclavos)})"
+
+def crear_buses(puertos, tags):
+    """Reparte los tags entre los puertos según el esclavo."""
+    asignados = {}
+    for p in puertos:
+        for esclavo in p.esclavos or ():
+            if esclavo in asignados:
+                raise ValueError(f"Esclavo {esclavo} asignado a {asignados[esclavo]} y a {p.puerto}")
+            asignados[esclavo] = p.puerto
+    if sum(p.esclavos is None for p in puertos) > 1:
+        raise ValueError("Solo un puerto puede tomar los esclavos no asignados (esclavos=None)")
+
+    buses = []
+    for p in puertos:
+        if p.esclavos is None:
+            tags_bus = [tag for tag in tags if tag.esclavo not in asignados]
+        else:
+            tags_bus = [tag for tag in tags if tag.esclavo in p.esclavos]
+        if not tags_bus:
+            raise ValueError(f"El puerto {p.puerto} no tiene tags para sondear")
+        buses.append(BusSerie(p.puerto, p.baudios, tags_bus))
+    return buses
 
 # --- Globales ---
 stats_lock = threading.Lock()
@@ -50,79 +181,81 @@ stats = {
     'error_crc': 0,
     'no_alcanzado': 0,
     'excepcion_esclavo': 0
-}
-ser = None 
-serial_lock = threading.Lock()
-
-# --- Funciones CRC ---
-def calcular_crc(trama_bytes):
-    crc_registro = 0xFFFF
-    polinomio = 0xA001
-    for byte in trama_bytes:
-        crc_registro ^= byte
-        for _ in range(8):
-            if crc_registro & 0x0001:
-                crc_registro = (crc_registro >> 1) ^ polinomio
-            else:
-                crc_registro = crc_registro >> 1
-    return struct.pack('<H', crc_registro)
+} # Totales de todos los buses (los de cada uno están en BusSerie.stats)
+buses = crear_buses(PUERTOS_SERIE, TAGS_SONDEO)
+bus_por_esclavo = {esclavo: bus for bus in buses for esclavo in bus.esclavos}
+valores_tags = {} # Último valor conocido de cada tag (en unidades de ingeniería)
+imagen = None # ImagenProceso compartida con el servidor OPC UA
+emisor = None # Aviso de "escaneo nuevo" al servidor OPC UA
+grabador = None # GrabadorMuestras (si DIRECTORIO_MUESTRAS está configurado)
+metricas = MetricasModbus() # Latencias por esclavo/FC, timeouts, reintentos, bus ocupado
+cache_tcp = CacheRegistros(TAGS_SONDEO, MODBUS_TCP_MAX_EDAD) # Último valor de cada registro sondeado
+oyentes_escaneo = [] # f(estado, valores, tags_leidos, stats, registros, timestamp_ns) por escaneo (gateway_unificado.py)
 
-def verificar_crc(trama_completa):
-    if len(trama_completa) < 4:
-        return False
-    trama_datos = trama_completa[:-2]
-    crc_recibido = trama_completa[-2:]
-    crc_calculado = calcular_crc(trama_datos)
-    return crc_recibido == crc_calculado
+def contar(bus, clave):
+    with stats_lock:
+        stats[clave] += 1
+        bus.stats[clave] += 1
 
 # --- Bucle Maestro MODBUS (Lectura) ---
-def ciclo_maestro_modbus(ser_local):
-    pdu = struct.pack('>HH', REGISTRO_INICIO, CANTIDAD_REGISTROS)
-    trama_sin_crc = struct.pack('BB', ID_ESCLAVO, FUNCION_LEER_REGISTROS) + pdu
+# Datos de una lectura OK: los registros y los bytes de datos de la
+# respuesta, para que al_leer los decodifique sin re-empaquetar
+LecturaOK = namedtuple("LecturaOK", ["registros", "crudos"])
+
+def ciclo_maestro_modbus(ser_local, id_esclavo=ID_ESCLAVO, funcion=FUNCION_LEER_REGISTROS,
+                         inicio=REGISTRO_INICIO, cantidad=CANTIDAD_REGISTROS, bus=None):
+    bus = bus or bus_por_esclavo.get(id_esclavo, buses[0])
+    salud = bus.salud
+    pdu = struct.pack('>HH', inicio, cantidad)
+    trama_sin_crc = struct.pack('BB', id_esclavo, funcion) + pdu
     crc = calcular_crc(trama_sin_crc)
     trama_completa = trama_sin_crc + crc
 
+    if not salud.habilitado(id_esclavo):
+        return ("ERROR_CUARENTENA", None) # No ocupa el bus hasta el próximo sondeo de prueba
+
+    estado = None
     try:
-        ser_local.reset_input_buffer()
-        ser_local.reset_output_buffer()
-        ser_local.write(trama_completa)
-        
-        inicio_respuesta = ser_local.read(3)
-        # Validamos que hayamos recibido al menos 3 bytes
-        if len(inicio_respuesta) < 3:
-            # Si no recibimos nada o recibimos basura incompleta
-            # No contamos esto como "no alcanzado" inmediatamente para no spamear logs,
-            # pero retornamos error para que el bucle reintente.
-            return ("ERROR_TRAMA_INCOMPLETA", None)
-
-        if inicio_respuesta[1] == (FUNCION_LEER_REGISTROS + 0x80):
-            # ... (Manejo de excepción esclavo) ...
-            with stats_lock:
-                stats['excepcion_esclavo'] += 1
-            ser_local.read(2) 
-            return ("ERROR_ESCLAVO", None) 
-
-        conteo_bytes = inicio_respuesta[2]
-        resto_respuesta = ser_local.read(conteo_bytes + 2)
-        respuesta = inicio_respuesta + resto_respuesta
-
-        if verificar_crc(respuesta):
-            with stats_lock:
-                stats['aceptadas'] += 1
+        longitud_esperada = longitud_respuesta(funcion, cantidad)
+        try:
+            t0 = time.perf_counter()
+            (estado, respuesta) = transaccion(ser_local, trama_completa, id_esclavo, funcion,
+                                              longitud_esperada, salud.timeout(id_esclavo), bus.baudios,
+                                              eco=ECO_ADAPTADOR)
+            duracion = time.perf_counter() - t0
+            salud.registrar(id_esclavo, estado, duracion - tiempo_trama(bus.baudios, longitud_esperada))
+        finally:
+            if estado is None: # Sin resultado: que no quede colgado el sondeo de prueba
+                salud.cancelar_sondeo(id_esclavo)
+        bus.t_adquisicion = time.time_ns() # Sello de adquisición (traza de latencia)
+        metricas.registrar_transaccion(id_esclavo, funcion, estado, duracion, bus.puerto)
+
+        if estado == "ERROR_ESCLAVO":
+            # Trama de excepción completa (5 bytes, CRC verificado)
+            contar(bus, 'excepcion_esclavo')
+            print(f"ESTADO: EXCEPCION ESCLAVO (código {respuesta[2]})")
+            return ("ERROR_ESCLAVO", None)
+
+        if estado == "OK":
+            contar(bus, 'aceptadas')
             
-            datos_payload = respuesta[3:-2]
-            registros = []
-            for i in range(0, len(datos_payload), 2):
-                registro = struct.unpack('>H', datos_payload[i:i+2])[0]
-                registros.append(registro)
+            # Un solo unpack precompilado para todo el bloque
+            crudos = respuesta[3:-2]
+            registros = struct_registros(cantidad).unpack(crudos)
             
             print(f"ESTADO: ACEPTADA. Datos: {registros}")
-            return ("OK", registros)
-        else:
+            return ("OK", LecturaOK(registros, crudos))
+
+        if estado == "ERROR_CRC":
             print("ESTADO: CRC ERROR")
-            with stats_lock:
-                stats['error_crc'] += 1
-            return ("ERROR_CRC", None)
+            contar(bus, 'error_crc')
+
+        if estado == "ERROR_TIMEOUT":
+            # Esclavo mudo: también es "no alcanzado" (no solo las caídas del puerto)
+            contar(bus, 'no_alcanzado')
+
+        # ERROR_TRAMA_INCOMPLETA: el planificador reintenta en el próximo vencimiento
+        return (estado, None)
 
     except (serial.SerialException, OSError) as e:
         raise e 
@@ -140,6 +273,72 @@ def escribir_json_seguro(datos):
     except Exception as e:
         print(f"ERROR: No se pudo escribir en el archivo JSON: {e}")
 
+# --- Escritura MODBUS (se ejecuta en el hilo del bus) ---
+def ciclo_escritura_modbus(ser_local, trama_completa, id_esclavo, funcion, bus=None):
+    """Envía un comando FC05/FC06/FC15/FC16 y valida la respuesta del esclavo.
+    Si se perdió, lo reenvía hasta REINTENTOS_ESCRITURA veces (las
+    escrituras son idempotentes), salvo que el esclavo entre en cuarentena."""
+    bus = bus or bus_por_esclavo.get(id_esclavo, buses[0])
+    for intento in range(REINTENTOS_ESCRITURA + 1):
+        print(f"Enviando comando: {trama_completa.hex()}" + (f" (reintento {intento})" if intento else ""))
+        t0 = time.perf_counter()
+        (estado, respuesta) = transaccion(ser_local, trama_completa, id_esclavo, funcion,
+                                          longitud_respuesta(funcion), bus.salud.timeout(id_esclavo), bus.baudios,
+                                          eco=ECO_ADAPTADOR)
+        duracion = time.perf_counter() - t0
+        metricas.registrar_transaccion(id_esclavo, funcion, estado, duracion, bus.puerto, reintento=intento > 0)
+        bus.salud.registrar(id_esclavo, estado, duracion - tiempo_trama(bus.baudios, longitud_respuesta(funcion)))
+        if estado == "OK" and not confirmar_escritura(trama_completa, respuesta):
+            estado = "ERROR_CONFIRMACION"
+
+        contador = {"OK": 'aceptadas', "ERROR_CRC": 'error_crc', "ERROR_ESCLAVO": 'excepcion_esclavo',
+                    "ERROR_TIMEOUT": 'no_alcanzado'}.get(estado)
+        if contador is not None:
+            contar(bus, contador)
+        if estado not in ("ERROR_TIMEOUT", "ERROR_CRC", "ERROR_TRAMA_INCOMPLETA") \
+                or id_esclavo in bus.salud.en_cuarentena():
+            break
+    return (estado, respuesta)
+
+def vaciar_comandos(bus):
+    """Toma el lote de escrituras pendientes del bus (ya colapsadas y
+    fusionadas) y lo ejecuta. Devuelve [(Escritura, estado)] y resuelve
+    con eso la confirmación del lote."""
+    lote, confirmacion = bus.etapa_comandos.tomar_lote()
+    resultados = []
+    try:
+        for escritura in lote:
+            trama_completa = trama_escritura(escritura)
+            (estado, _) = ciclo_escritura_modbus(bus.ser, trama_completa, escritura.esclavo, escritura.funcion, bus)
+            resultados.append((escritura, estado))
+    except BaseException as e:
+        confirmacion.set_exception(e)
+        raise
+    confirmacion.set_result(resultados)
+    return resultados
+
+def programar_vaciado(bus, confirmacion):
+    """Programa un vaciado de comandos en el maestro del bus (thread-safe).
+    Si no se puede programar o el vaciado no llega a correr, libera el
+    vaciado pendiente para que la próxima escritura lo reintente."""
+    try:
+        futuro = bus.maestro.enviar_desde_hilo(vaciar_comandos, bus)
+    except Exception:
+        bus.etapa_comandos.liberar_vaciado(confirmacion)
+        raise
+    futuro.add_done_callback(lambda f: _informar_comando(bus, confirmacion, f))
+    return futuro
+
+def _informar_comando(bus, confirmacion, futuro):
+    """Callback del resultado de un lote encolado."""
+    try:
+        for escritura, estado in futuro.result():
+            print(f"Comando FC{escritura.funcion:02d} dir={escritura.inicio} "
+                  f"valores={list(escritura.valores)} -> {estado}")
+    except BaseException as e: # También CancelledError (maestro cerrado)
+        bus.etapa_comandos.liberar_vaciado(confirmacion)
+        print(f"Comando NO ejecutado: {e!r}")
+
 # --- Callbacks de MQTT ---
 def on_connect(client, userdata, flags, reason_code, properties=None):
     print(f"✅ Conectado a MQTT {BROKER}:{PORT} (rc={reason_code})")
@@ -149,57 +348,239 @@ def on_connect(client, userdata, flags, reason_code, properties=None):
     print(f"Suscrito a {TOPICO_SUB_ANALOG}")
 
 def on_message(client, userdata, msg):
-    """Callback cuando llega un mensaje de MQTT (Control)."""
-    global ser 
-    global serial_lock 
-
-    if ser is None or not ser.is_open:
+    """Callback cuando llega un mensaje de MQTT (Control).
+    No toca el puerto: deja el valor en la etapa de comandos (último valor
+    gana) y, si no hay ya un vaciado en cola, programa uno en el maestro,
+    que lo ejecuta antes que cualquier lectura pendiente."""
+    bus = bus_por_esclavo.get(ID_ESCLAVO)
+    if bus is None or not bus.disponible():
         return
 
     payload = msg.payload.decode('utf-8')
     print(f"\n--- [MQTT RECIBIDO] Tópico: {msg.topic}, Payload: {payload} ---")
 
     try:
-        trama_sin_crc = None
         if msg.topic == TOPICO_SUB_DIG:
             valor = int(payload)
             if valor == 1:
-                payload_modbus = 0xFF00 # ON
                 print("Comando: ENCENDER LED Digital")
             else:
-                payload_modbus = 0x0000 # OFF
                 print("Comando: APAGAR LED Digital")
-            
-            pdu = struct.pack('>HH', COIL_LED_DIGITAL, payload_modbus)
-            trama_sin_crc = struct.pack('BB', ID_ESCLAVO, FUNCION_ESCRIBIR_COIL) + pdu
+            programar, confirmacion = bus.etapa_comandos.escribir_coil(ID_ESCLAVO, COIL_LED_DIGITAL, valor == 1)
 
         elif msg.topic == TOPICO_SUB_ANALOG:
             valor = int(payload)
             if not 0 <= valor <= 255: 
                 return
             print(f"Comando: AJUSTAR LED Analógico a {valor}")
-            pdu = struct.pack('>HH', REGISTRO_LED_ANALOG, valor)
-            trama_sin_crc = struct.pack('BB', ID_ESCLAVO, FUNCION_ESCRIBIR_REGISTRO) + pdu
+            programar, confirmacion = bus.etapa_comandos.escribir_registro(ID_ESCLAVO, REGISTRO_LED_ANALOG, valor)
         
         else:
             return 
 
-        if trama_sin_crc:
-            crc = calcular_crc(trama_sin_crc)
-            trama_completa = trama_sin_crc + crc
-
-            # --- ¡CAMBIO CLAVE! ---
-            # Enviamos y NO esperamos respuesta.
-            # Esto evita el bloqueo (deadlock) y el error de eco.
-            with serial_lock:
-                print(f"Enviando comando: {trama_completa.hex()}")
-                ser.write(trama_completa) 
-                # Eliminamos ser.read() aquí.
-                print("Comando enviado.") 
+        if programar:
+            programar_vaciado(bus, confirmacion)
 
     except Exception as e:
         print(f"Error en on_message: {e}")
 
+# --- Lecturas periódicas ---
+def publicar_escaneo(estado, valores=None, tags_leidos=(), registros=None, timestamp_ns=None):
+    """Publica un escaneo en la imagen de proceso (y en el JSON si
+    EXPORTAR_JSON está activo). `valores`: {tag: valor de ingeniería};
+    `registros`: {tag: registro(s) crudo(s)}, que es lo que guarda la
+    imagen (el servidor OPC UA los decodifica con el mismo mapa).
+    `timestamp_ns`: instante de adquisición (llegada de la respuesta)."""
+    if timestamp_ns is None:
+        timestamp_ns = time.time_ns()
+    with stats_lock:
+        stats_actuales = dict(stats)
+
+    if imagen is not None:
+        imagen.publicar(estado, stats_actuales, registros, tags_leidos, timestamp_ns)
+        if emisor is not None:
+            emisor.notificar(imagen.generacion())
+
+    for oyente in oyentes_escaneo:
+        try:
+            oyente(estado, valores, tags_leidos, stats_actuales, registros, timestamp_ns)
+        except Exception as e: # Un oyente roto no detiene el sondeo ni a los demás oyentes
+            print(f"⚠️ Error en el oyente de escaneo {getattr(oyente, '__qualname__', oyente)}: {e!r}")
+
+    if EXPORTAR_JSON:
+        datos_para_json = {
+            "estado": estado,
+            "timestamp_lectura": timestamp_ns // 1_000_000_000,
+            "timestamp_ns": timestamp_ns
+        }
+        if estado == "OK":
+            datos_para_json.update(valores_tags)
+        datos_para_json["stats_aceptadas"] = stats_actuales['aceptadas']
+        datos_para_json["stats_crc"] = stats_actuales['error_crc']
+        datos_para_json["stats_no_alcanzado"] = stats_actuales['no_alcanzado']
+        datos_para_json["stats_excepcion_esclavo"] = stats_actuales['excepcion_esclavo']
+        escribir_json_seguro(datos_para_json)
+    return stats_actuales
+
+def al_leer(bloque, estado, datos_leidos):
+    """Publica el resultado de cada lectura (datos_leidos: LecturaOK si estado == "OK")."""
+    bus = bus_por_esclavo[bloque.esclavo]
+    bus.estado = estado
+    valores = registros = None
+    if estado == "OK":
+        if bloque.decodificador is None:
+            bloque.decodificador = MAPA_TAGS.decodificador_bloque(bloque)
+        registros = bloque.repartir(datos_leidos.registros)
+        decodificador = bloque.decodificador
+        valores = dict(zip(decodificador.nombres, decodificador.decodificar(datos_leidos.crudos)))
+        valores_tags.update(valores)
+    if grabador is not None:
+        grabador.registrar(bloque.esclavo, bloque.funcion, estado, bloque.inicio, bloque.cantidad,
+                           datos_leidos.registros if estado == "OK" else None)
+    
+    stats_actuales = publicar_escaneo(estado, valores, [tag.nombre for tag, _ in bloque.tags], registros,
+                                      bus.t_adquisicion if estado == "OK" else None)
+    print(f"Stats -> A: {stats_actuales['aceptadas']} | CRC: {stats_actuales['error_crc']} | NR: {stats_actuales['no_alcanzado']} | Estado: {estado}")
+
+# --- Escrituras desde Modbus TCP ---
+async def escribir_desde_tcp(esclavo, escrituras):
+    """Mismo camino que los comandos MQTT: etapa de comandos + vaciado en el bus.
+    Si ya había un vaciado en cola, las escrituras se suman a ese lote.
+    Responde recién cuando el esclavo confirmó (o no) cada escritura."""
+    bus = bus_por_esclavo.get(esclavo)
+    if bus is None or not bus.disponible():
+        raise ExcepcionModbus(EXCEPCION_SIN_RESPUESTA)
+    pendientes = [] # (tipo, dirección, confirmación del lote que la lleva)
+    try:
+        for tipo, direccion, valor in escrituras:
+            if tipo == COIL:
+                programar, confirmacion = bus.etapa_comandos.escribir_coil(esclavo, direccion, valor)
+            else:
+                programar, confirmacion = bus.etapa_comandos.escribir_registro(esclavo, direccion, valor)
+            if programar:
+                programar_vaciado(bus, confirmacion)
+            pendientes.append((tipo, direccion, confirmacion))
+        for tipo, direccion, confirmacion in pendientes:
+            resultados = await asyncio.wrap_future(confirmacion)
+            if estado_escritura(resultados, esclavo, tipo, direccion) != "OK":
+                return False
+    except (RuntimeError, OSError) as e: # Maestro detenido o puerto caído durante el vaciado
+        print(f"Escritura Modbus TCP NO ejecutada: {e!r}")
+        raise ExcepcionModbus(EXCEPCION_SIN_RESPUESTA)
+    return True
+
+# --- Métricas ---
+def registrar_medidores():
+    """Colas, atrasos y salud que se leen al exportar las métricas: el
+    total de todos los buses y, si hay más de uno, cada bus por separado
+    (sufijo _bus0, _bus1... en el orden de PUERTOS_SERIE)."""
+    medidores = {
+        "cola_bus": lambda b: b.maestro.pendientes() if b.maestro is not None else 0,
+        "cola_comandos": lambda b: b.etapa_comandos.pendientes(),
+        "sondeos_atrasados": lambda b: b.planificador.atrasos,
+        "esclavos_en_cuarentena": lambda b: len(b.salud.en_cuarentena()),
+    }
+    for nombre, medir in medidores.items():
+        metricas.registrar_medidor(nombre, lambda medir=medir: sum(medir(b) for b in buses))
+    jitter = [b.planificador.jitter for b in buses]
+    metricas.registrar_medidor("jitter_medio_ms", lambda: round(1000 * max(j.media for j in jitter), 3))
+    metricas.registrar_medidor("jitter_desvio_ms", lambda: round(1000 * max(j.desvio for j in jitter), 3))
+    metricas.registrar_medidor("jitter_max_ms", lambda: round(1000 * max(j.maximo for j in jitter), 3))
+    if len(buses) > 1:
+        for i, bus in enumerate(buses):
+            for nombre, medir in medidores.items():
+                metricas.registrar_medidor(f"{nombre}_bus{i}", lambda medir=medir, bus=bus: medir(bus))
+            for clave in bus.stats:
+                metricas.registrar_medidor(f"{clave}_bus{i}", lambda clave=clave, bus=bus: bus.stats[clave])
+            metricas.registrar_medidor(f"conectado_bus{i}", lambda bus=bus: int(bus.disponible()))
+
+def iniciar_grabador():
+    """Arranca el registro de escaneos si DIRECTORIO_MUESTRAS está configurado."""
+    global grabador
+    if DIRECTORIO_MUESTRAS:
+        ancho = max(bloque.cantidad for bus in buses for bloque in bus.planificador.bloques)
+        grabador = GrabadorMuestras(DIRECTORIO_MUESTRAS, ancho, MUESTRAS_SEGMENTO_MB * 1024 * 1024,
+                                    MUESTRAS_MAX_MB * 1024 * 1024).iniciar()
+        print(f"Registro de escaneos en {DIRECTORIO_MUESTRAS} ({ancho} registros por escaneo)")
+    return grabador
+
+def verificar_carga_bus():
+    for bus in buses:
+        carga = bus.planificador.carga_bus(bus.baudios)
+        print(f"Carga de {bus.puerto} pedida por los periodos: {carga:.0%}")
+        if carga > 1.0:
+            print(f"⚠️ A {bus.baudios} baudios {bus.puerto} no alcanza para esos periodos: habrá sondeos atrasados")
+
+def publicar_metricas(instantanea):
+    """Snapshot periódico: MQTT pci/metrics y aviso al servidor OPC UA."""
+    if mqtt_client.is_connected():
+        mqtt_client.publish(TOPICO_METRICAS, json.dumps(instantanea), qos=0)
+    if emisor is not None:
+        emisor.notificar_metricas(instantanea)
+
+async def ejecutar_maestro(bus):
+    """Abre el puerto del bus y corre su maestro asyncio; reconecta ante
+    fallos sin afectar a los demás buses."""
+    while True: 
+        try:
+            bus.ser = serial.Serial(
+                port=bus.puerto,
+                baudrate=bus.baudios,
+                parity=PARITY,
+                stopbits=STOP_BITS,
+                bytesize=BYTE_SIZE,
+                timeout=TIMEOUT_ESPERA
+            )
+            # Fin de trama por silencio t3.5 (no por el timeout completo)
+            configurar_puerto(bus.ser, bus.baudios)
+                
+            print(f"Maestro MODBUS (asyncio) iniciado en {bus.puerto}")
+            bus.estado = "INICIANDO"
+            publicar_escaneo("INICIANDO")
+            
+            bus.maestro = MaestroAsyncio(bus.planificador, bus.leer_bloque, al_leer)
+            # Un vaciado programado en el maestro anterior ya no va a correr
+            bus.etapa_comandos.liberar_vaciado()
+            await bus.maestro.ejecutar()
+
+        except (serial.SerialException, OSError) as e:
+            print(f"ESTADO: ERROR SERIAL en {bus.puerto} (Desconexión). {e}")
+            print("Reintentando conexión en 5 segundos...")
+            
+            bus.cerrar_puerto()
+            bus.estado = "ERROR_DESCONECTADO"
+            contar(bus, 'no_alcanzado')
+            publicar_escaneo("ERROR_DESCONECTADO", tags_leidos=[tag.nombre for tag in bus.tags])
+                
+            await asyncio.sleep(5) 
+
+        except Exception as e:
+            # Falla propia de este bus: se reinicia solo este maestro, no los demás
+            print(f"ESTADO: ERROR INTERNO en el maestro de {bus.puerto}: {e!r}")
+            print("Reiniciando el maestro en 5 segundos...")
+            bus.cerrar_puerto()
+            bus.estado = "ERROR_INTERNO"
+            await asyncio.sleep(5)
+
+        finally:
+            if bus.maestro is not None:
+                bus.maestro.cerrar(esperar=True)
+            bus.maestro = None
+
+async def principal():
+    """Un maestro por bus y, si está configurada, la fachada Modbus TCP,
+    todos en el mismo bucle (cada bus transacciona en su propio hilo)."""
+    servidor_tcp = None
+    if MODBUS_TCP_PUERTO:
+        oyentes_escaneo.append(cache_tcp.al_escanear)
+        servidor_tcp = ServidorModbusTCP(cache_tcp, escribir_desde_tcp, ID_ESCLAVO)
+        await servidor_tcp.iniciar(MODBUS_TCP_DIRECCION, MODBUS_TCP_PUERTO)
+    try:
+        await asyncio.gather(*(ejecutar_maestro(bus) for bus in buses))
+    finally:
+        if servidor_tcp is not None:
+            servidor_tcp.cerrar()
+
 # --- Bucle Principal ---
 if __name__ == "__main__":
     
@@ -225,75 +606,34 @@ if __name__ == "__main__":
 
     mqtt_client.connect_async(BROKER, PORT, keepalive=60)
     mqtt_client.loop_start() 
+
+    imagen = ImagenProceso.crear(TAGS_SONDEO, RUTA_IMAGEN_PROCESO)
+    print(f"Imagen de proceso en {RUTA_IMAGEN_PROCESO}")
+    emisor = EmisorEscaneo()
+    for bus in buses:
+        print(f"{bus}:")
+        for bloque in bus.planificador.bloques:
+            print(f"  Grupo de sondeo: {bloque}")
+
+    verificar_carga_bus()
+    registrar_medidores()
+    iniciar_grabador()
+    metricas.iniciar_publicacion(METRICAS_PERIODO, publicar_metricas)
+    if METRICAS_HTTP_PUERTO:
+        metricas.iniciar_http(METRICAS_HTTP_PUERTO)
     
     try:
-        while True: 
-            try:
-                ser = serial.Serial(
-                    port=PUERTO_SERIAL,
-                    baudrate=BAUD_RATE,
-                    parity=PARITY,
-                    stopbits=STOP_BITS,
-                    bytesize=BYTE_SIZE,
-                    timeout=TIMEOUT_ESPERA
-                )
-                    
-                print(f"Maestro MODBUS (Serial simple) iniciado en {PUERTO_SERIAL}")
-                escribir_json_seguro({"estado": "INICIANDO", "timestamp_lectura": int(time.time())}) 
-                
-                while True: 
-                    
-                    with serial_lock:
-                        (estado, datos_leidos) = ciclo_maestro_modbus(ser)
-                    
-                    datos_para_json = {
-                        "estado": estado,
-                        "timestamp_lectura": int(time.time())
-                    }
-                    
-                    if estado == "OK":
-                        datos_para_json["potenciometro"] = datos_leidos[0]
-                        datos_para_json["ultrasonido"] = datos_leidos[1]
-                        datos_para_json["boton_1"] = datos_leidos[2]
-                        datos_para_json["boton_2"] = datos_leidos[3]
-                    
-                    with stats_lock:
-                        datos_para_json["stats_aceptadas"] = stats['aceptadas']
-                        datos_para_json["stats_crc"] = stats['error_crc']
-                        datos_para_json["stats_no_alcanzado"] = stats['no_alcanzado']
-                        
-                        print(f"Stats -> A: {stats['aceptadas']} | CRC: {stats['error_crc']} | NR: {stats['no_alcanzado']} | Estado: {estado}")
-                    
-                    escribir_json_seguro(datos_para_json)
-
-                    time.sleep(2) 
-
-            except (serial.SerialException, OSError) as e:
-                print(f"ESTADO: ERROR SERIAL (Desconexión). {e}")
-                print("Reintentando conexión en 5 segundos...")
-                
-                if ser and ser.is_open:
-                    ser.close()
-                ser = None 
-                
-                with stats_lock:
-                    stats['no_alcanzado'] += 1
-                    datos_error = {
-                        "estado": "ERROR_DESCONECTADO",
-                        "timestamp_lectura": int(time.time()),
-                        "stats_no_alcanzado": stats['no_alcanzado']
-                    }
-                escribir_json_seguro(datos_error)
-                    
-                time.sleep(5) 
+        asyncio.run(principal())
                 
     except KeyboardInterrupt:
         print("Cerrando script Modbus y MQTT...")
         
     finally:
-        if ser and ser.is_open:
-            ser.close()
+        for bus in buses:
+            bus.cerrar_puerto()
+        if grabador is not None:
+            grabador.cerrar()
         mqtt_client.loop_stop()
         mqtt_client.disconnect()
-        escribir_json_seguro({"estado": "DETENIDO", "timestamp_lectura": int(time.time())})
-        print("Estado 'DETENIDO' escrito en JSON.")
\ No newline at end of file
+        publicar_escaneo("DETENIDO")
+        print("Estado 'DETENIDO' publicado.")
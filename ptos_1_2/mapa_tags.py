@@ -0,0 +1,306 @@
+# ---------- Mapa de tags declarativo y decodificador precompilado ----------
+#
+# Un solo archivo (mapa_tags.json) describe cada tag del esclavo: dónde
+# está (esclavo, función, dirección), cómo se interpreta (tipo, orden de
+# palabras, escala/offset, campo de bits), cada cuánto se sondea y con qué
+# nombre aparece en OPC UA y en MQTT. De ahí salen:
+#   - los Tag del planificador (maestro),
+#   - los nodos del servidor OPC UA y los tópicos del bridge / gateway,
+#   - un Decodificador por bloque de sondeo.
+#
+# El Decodificador compila todos los campos de un bloque en un único
+# struct.Struct (con bytes de relleno en los huecos): cada respuesta se
+# decodifica con una sola llamada en C, sin importar cuántos registros
+# tenga, y el resultado se escribe en un registro (lista) preasignado.
+# El orden de palabras de los tipos de 32 bits (CDAB, BADC, DCBA) se
+# resuelve con una permutación de bytes precalculada (itemgetter).
+#
+# Tipos: uint16, int16, uint32, int32, float32.
+# valor = crudo * escala + offset; con "bit" se extrae
+# (crudo >> bit) & (2**bits - 1) antes de escalar.
+#
+# Para muchos equipos iguales, "plantillas" define los tags de un tipo de
+# equipo (direcciones relativas, sin esclavo) y "dispositivos" la lista
+# de equipos: {"nombre": "Bomba_01", "esclavo": 2, "plantilla": "bomba",
+# "direccion_base": 0}. Cada tag generado se llama Bomba_01_<nombre>,
+# cuelga del objeto OPC UA Bomba_01 y publica en Bomba_01/<tópico>.
+# "unidad" y "rango" ([mín, máx]) van al nodo como EngineeringUnits y
+# EURange; "historial": false lo deja fuera del historiador OPC UA.
+# "banda_muerta" ([absoluta, porcentual]) es la banda del bridge MQTT
+# para ese tag (sin ella, la banda por defecto del bridge).
+#
+# ---------------------------------------------------------------------
+
+import json
+import os
+import struct
+from collections import namedtuple
+from functools import lru_cache
+from operator import itemgetter
+
+from planificador_modbus import Tag, FUNCION_LEER_REGISTROS
+
+RUTA_POR_DEFECTO = os.path.join(os.path.dirname(os.path.abspath(__file__)), "mapa_tags.json")
+DISPOSITIVO_POR_DEFECTO = "Dispositivo1" # Objeto OPC UA de los tags sin "dispositivo"
+
+# tipo -> (código struct, registros)
+TIPOS = {
+    "uint16":  ("H", 1),
+    "int16":   ("h", 1),
+    "uint32":  ("I", 2),
+    "int32":   ("i", 2),
+    "float32": ("f", 2),
+}
+# Orden de los 4 bytes de un valor de 32 bits en el cable -> posición de A, B, C, D
+ORDENES = {
+    "ABCD": (0, 1, 2, 3),  # Big-endian (Modbus estándar)
+    "CDAB": (2, 3, 0, 1),  # Palabras invertidas (la mayoría de los PLC "little-endian")
+    "BADC": (1, 0, 3, 2),  # Bytes invertidos dentro de cada palabra
+    "DCBA": (3, 2, 1, 0),  # Little-endian
+}
+
+DefinicionTag = namedtuple("DefinicionTag", [
+    "nombre", "esclavo", "direccion", "tipo", "periodo", "funcion", "orden",
+    "escala", "offset", "bit", "bits", "nodo_opc", "clave", "topico", "qos", "retain",
+    "dispositivo", "unidad", "rango", "historial", "banda_muerta",
+])
+
+@lru_cache(maxsize=None)
+def struct_registros(cantidad):
+    """struct.Struct para `cantidad` registros big-endian (uno por tamaño)."""
+    return struct.Struct(f">{cantidad}H")
+
+class Decodificador:
+    """
+    Decodifica un tramo de registros en valores de ingeniería.
+    campos: [(DefinicionTag, desplazamiento en registros)];
+    cantidad: registros del tramo (los que no usa ningún tag se saltean).
+    """
+
+    def __init__(self, campos, cantidad):
+        self.nombres = [definicion.nombre for definicion, _ in campos]
+        self.cantidad = cantidad
+        self._registros = struct_registros(cantidad)
+
+        # Un campo del struct por tramo distinto (varios tags de bits
+        # pueden compartir el mismo registro)
+        tramos = {}
+        for definicion, desplazamiento in campos:
+            tramos.setdefault(_tramo(definicion, desplazamiento), len(tramos))
+        ordenados = sorted(tramos)
+
+        formato = [">"]
+        permutacion = list(range(2 * cantidad))
+        permutar = False
+        posicion = 0
+        for desplazamiento, n, codigo, orden in ordenados:
+            if desplazamiento < posicion:
+                raise ValueError(f"Campos solapados en el registro {desplazamiento} del tramo")
+            if desplazamiento + n > cantidad:
+                raise ValueError(f"Campo fuera del tramo en el registro {desplazamiento}")
+            if desplazamiento > posicion:
+                formato.append(f"{2 * (desplazamiento - posicion)}x")
+            formato.append(codigo)
+            if orden != "ABCD":
+                base = 2 * desplazamiento
+                permutacion[base:base + 4] = [base + i for i in ORDENES[orden]]
+                permutar = True
+            posicion = desplazamiento + n
+        if posicion < cantidad:
+            formato.append(f"{2 * (cantidad - posicion)}x")
+        self._struct = struct.Struct("".join(formato))
+        self._permutar = itemgetter(*permutacion) if permutar else None
+
+        indice_campo = {tramo: i for i, tramo in enumerate(ordenados)}
+        indices = [indice_campo[_tramo(definicion, desplazamiento)] for definicion, desplazamiento in campos]
+        self._campos = _compilar(campos, indices)
+        # Si todos los campos son uint16, los registros ya separados son
+        # los valores crudos: se toman directamente, sin volver a empaquetar
+        self._registros_directos = None
+        if all(codigo == "H" for _, _, codigo, _ in ordenados):
+            self._registros_directos = _compilar(campos, [desplazamiento for _, desplazamiento in campos])
+        self.valores = [0] * len(campos) # Registro preasignado: un valor por tag
+
+    def decodificar(self, datos):
+        """Bytes del tramo (tal como vienen en la respuesta) -> self.valores."""
+        if self._permutar is not None:
+            datos = bytes(self._permutar(datos))
+        return self._volcar(self._struct.unpack(datos), *self._campos)
+
+    def decodificar_registros(self, registros):
+        """Igual que decodificar(), a partir de los registros ya separados
+        (lectores de la imagen de proceso). En el maestro se decodifican
+        directamente los bytes de la respuesta con decodificar()."""
+        if self._registros_directos is not None:
+            return self._volcar(registros, *self._registros_directos)
+        return self.decodificar(self._registros.pack(*registros))
+
+    def _volcar(self, crudos, tomar, transformaciones):
+        valores = self.valores
+        valores[:] = tomar(crudos)
+        for i, j, escala, offset, bit, mascara in transformaciones:
+            crudo = crudos[j]
+            if bit is not None:
+                crudo = (crudo >> bit) & mascara
+            valores[i] = crudo * escala + offset
+        return valores
+
+    def como_dict(self, registros):
+        return dict(zip(self.nombres, self.decodificar_registros(registros)))
+
+class MapaTags:
+    """Definiciones de tags cargadas de mapa_tags.json."""
+
+    def __init__(self, definiciones):
+        self.definiciones = definiciones
+        self._por_nombre = {definicion.nombre: definicion for definicion in definiciones}
+        if len(self._por_nombre) != len(definiciones):
+            raise ValueError("Hay nombres de tag repetidos en el mapa")
+        if len({definicion.clave for definicion in definiciones}) != len(definiciones):
+            raise ValueError("Hay claves de tag repetidas en el mapa")
+        if len({(d.dispositivo, d.nodo_opc) for d in definiciones}) != len(definiciones):
+            raise ValueError("Hay nodos OPC repetidos dentro de un mismo dispositivo")
+        _verificar_solapamientos(definiciones)
+
+    @classmethod
+    def cargar(cls, ruta=RUTA_POR_DEFECTO):
+        with open(ruta, "r", encoding="utf-8") as f:
+            contenido = json.load(f)
+        entradas = contenido.get("tags", []) + _expandir_dispositivos(contenido)
+        return cls([_definicion(entrada) for entrada in entradas])
+
+    def __getitem__(self, nombre):
+        return self._por_nombre[nombre]
+
+    def __iter__(self):
+        return iter(self.definiciones)
+
+    # --- Maestro ---
+    def tags_sondeo(self):
+        """Tags del planificador (cantidad = registros que ocupa el tipo)."""
+        return [Tag(d.nombre, d.esclavo, d.direccion, TIPOS[d.tipo][1], d.periodo, d.funcion)
+                for d in self.definiciones]
+
+    def decodificador(self, tags, cantidad):
+        """Decodificador para [(nombre_tag, desplazamiento)] dentro de un tramo."""
+        return Decodificador([(self[nombre], desplazamiento) for nombre, desplazamiento in tags], cantidad)
+
+    def decodificador_bloque(self, bloque):
+        """Decodificador de un Bloque del planificador."""
+        return self.decodificador([(tag.nombre, desplazamiento) for tag, desplazamiento in bloque.tags],
+                                  bloque.cantidad)
+
+    # --- OPC UA / MQTT ---
+    def valor_inicial(self, nombre):
+        """0 o 0.0 según el tipo de dato que va a tener el nodo OPC UA."""
+        d = self[nombre]
+        real = (d.tipo == "float32" or not float(d.escala).is_integer()
+                or not float(d.offset).is_integer())
+        return 0.0 if real else 0
+
+    def dispositivos(self):
+        """Objetos OPC UA de los tags, en orden de aparición."""
+        return list(dict.fromkeys(definicion.dispositivo for definicion in self.definiciones))
+
+    def publicaciones(self, topic_base):
+        """{nombre_tag: (clave OPC, tópico MQTT, QoS, retain)}"""
+        return {d.nombre: (d.clave, f"{topic_base}/{d.topico}", d.qos, d.retain)
+                for d in self.definiciones}
+
+# --- Auxiliares ---
+def _expandir_dispositivos(contenido):
+    """Entradas de tag de cada dispositivo según su plantilla."""
+    plantillas = contenido.get("plantillas", {})
+    entradas = []
+    for dispositivo in contenido.get("dispositivos", []):
+        nombre = dispositivo["nombre"]
+        if dispositivo["plantilla"] not in plantillas:
+            raise ValueError(f"Dispositivo '{nombre}': plantilla '{dispositivo['plantilla']}' desconocida")
+        base = dispositivo.get("direccion_base", 0)
+        for tag in plantillas[dispositivo["plantilla"]]:
+            entradas.append({
+                **tag,
+                "nombre": f"{nombre}_{tag['nombre']}",
+                "esclavo": dispositivo["esclavo"],
+                "direccion": base + tag["direccion"],
+                "dispositivo": nombre,
+                "nodo_opc": tag.get("nodo_opc", tag["nombre"]),
+                "clave": f"{nombre}_{tag.get('clave', tag['nombre'])}",
+                "topico": f"{nombre}/{tag.get('topico', 'datos/' + tag['nombre'])}",
+            })
+    return entradas
+
+def _tramo(definicion, desplazamiento):
+    """(desplazamiento, registros, código struct, orden): identifica un campo del struct."""
+    codigo, n = TIPOS[definicion.tipo]
+    return (desplazamiento, n, codigo, definicion.orden if n == 2 else "ABCD")
+
+def _compilar(campos, indices):
+    """(tomar, transformaciones) para volcar los crudos en el registro de valores.
+    indices[i]: posición en los crudos del campo del tag i."""
+    if len(indices) == 1:
+        tomar = lambda crudos, j=indices[0]: (crudos[j],)
+    else:
+        tomar = itemgetter(*indices)
+    transformaciones = [] # (índice del tag, índice del crudo, escala, offset, bit, máscara)
+    for i, ((definicion, _), j) in enumerate(zip(campos, indices)):
+        if definicion.bit is not None or definicion.escala != 1 or definicion.offset != 0:
+            mascara = (1 << definicion.bits) - 1 if definicion.bit is not None else None
+            transformaciones.append((i, j, definicion.escala, definicion.offset, definicion.bit, mascara))
+    return tomar, transformaciones
+
+def _definicion(entrada):
+    """Entrada del JSON -> DefinicionTag (con valores por defecto y validación)."""
+    nombre = entrada["nombre"]
+    tipo = entrada.get("tipo", "uint16")
+    orden = entrada.get("orden", "ABCD")
+    if tipo not in TIPOS:
+        raise ValueError(f"Tag '{nombre}': tipo '{tipo}' desconocido ({', '.join(TIPOS)})")
+    if orden not in ORDENES:
+        raise ValueError(f"Tag '{nombre}': orden '{orden}' desconocido ({', '.join(ORDENES)})")
+    bit = entrada.get("bit")
+    bits = entrada.get("bits", 1)
+    if bit is not None and (tipo not in ("uint16", "uint32") or bit < 0 or bit + bits > 16 * TIPOS[tipo][1]):
+        raise ValueError(f"Tag '{nombre}': campo de bits fuera del registro")
+    rango = entrada.get("rango")
+    if rango is not None and (len(rango) != 2 or rango[0] > rango[1]):
+        raise ValueError(f"Tag '{nombre}': el rango debe ser [mínimo, máximo]")
+    banda_muerta = entrada.get("banda_muerta")
+    if banda_muerta is not None and (len(banda_muerta) != 2 or min(banda_muerta) < 0):
+        raise ValueError(f"Tag '{nombre}': la banda muerta debe ser [absoluta, porcentual] >= 0")
+    return DefinicionTag(
+        nombre=nombre,
+        esclavo=entrada["esclavo"],
+        direccion=entrada["direccion"],
+        tipo=tipo,
+        periodo=entrada.get("periodo", 1.0),
+        funcion=entrada.get("funcion", FUNCION_LEER_REGISTROS),
+        orden=orden,
+        escala=entrada.get("escala", 1),
+        offset=entrada.get("offset", 0),
+        bit=bit,
+        bits=bits,
+        nodo_opc=entrada.get("nodo_opc", nombre),
+        clave=entrada.get("clave", nombre),
+        topico=entrada.get("topico", f"datos/{nombre}"),
+        qos=entrada.get("qos", 0),
+        retain=entrada.get("retain", False),
+        dispositivo=entrada.get("dispositivo", DISPOSITIVO_POR_DEFECTO),
+        unidad=entrada.get("unidad"),
+        rango=tuple(rango) if rango is not None else None,
+        historial=entrada.get("historial", True),
+        banda_muerta=tuple(banda_muerta) if banda_muerta is not None else None,
+    )
+
+def _verificar_solapamientos(definiciones):
+    """Dos tags pueden compartir registros solo si leen exactamente el
+    mismo tramo con el mismo tipo (p. ej. varios bits de un registro)."""
+    tramos = {}
+    for d in definiciones:
+        n = TIPOS[d.tipo][1]
+        for direccion in range(d.direccion, d.direccion + n):
+            clave = (d.esclavo, d.funcion, direccion)
+            tramo = (d.direccion, d.tipo, d.orden if n == 2 else "ABCD")
+            otro = tramos.setdefault(clave, (tramo, d.nombre))
+            if otro[0] != tramo:
+                raise ValueError(f"Tag '{d.nombre}' se solapa con '{otro[1]}' en el registro {direccion}")
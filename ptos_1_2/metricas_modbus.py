@@ -0,0 +1,277 @@
+# ---------- Métricas de transacciones y del bus Modbus ----------
+#
+# Instrumentación a nivel transacción, para ver qué esclavo o grupo de
+# sondeo se come el presupuesto del bus antes de agregar dispositivos:
+#   - Histograma de latencia (ida y vuelta) por esclavo y código de función.
+#   - Cantidad de transacciones por resultado (OK, timeout, CRC, excepción...).
+#   - Reintentos: reenvíos explícitos de una trama tras un fallo (los
+#     marca quien reintenta; el sondeo periódico no cuenta como reintento).
+#   - Ocupación del bus (% del tiempo en transacciones, ventana deslizante),
+#     por puerto si hay varios buses.
+#   - Sondeos atrasados (overruns del planificador) y profundidad de colas.
+#
+# Se exponen como:
+#   - instantanea(): dict (payload JSON de MQTT pci/metrics y del aviso
+#     que recibe el servidor OPC UA para sus nodos de diagnóstico, por el
+#     mismo canal que los escaneos: ver notificador_escaneo.py).
+#   - texto_prometheus(): formato de exposición de Prometheus, servido por
+#     iniciar_http() en localhost.
+#
+# ---------------------------------------------------------------------
+
+import json
+import re
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+LIMITES_LATENCIA = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)  # s
+VENTANA_OCUPACION = 60.0  # s para el % de bus ocupado
+PUERTO_HTTP = 9102
+
+class Histograma:
+    """Histograma acumulativo con los límites de LIMITES_LATENCIA (+Inf)."""
+
+    def __init__(self, limites=LIMITES_LATENCIA):
+        self.limites = limites
+        self.cubetas = [0] * (len(limites) + 1)
+        self.cantidad = 0
+        self.suma = 0.0
+        self.maximo = 0.0
+
+    def observar(self, valor):
+        i = 0
+        while i < len(self.limites) and valor > self.limites[i]:
+            i += 1
+        self.cubetas[i] += 1
+        self.cantidad += 1
+        self.suma += valor
+        self.maximo = max(self.maximo, valor)
+
+    def percentil(self, p):
+        """Aproximación por el límite superior de la cubeta."""
+        if self.cantidad == 0:
+            return 0.0
+        objetivo = p * self.cantidad
+        acumulado = 0
+        for limite, cuenta in zip(self.limites, self.cubetas):
+            acumulado += cuenta
+            if acumulado >= objetivo:
+                return min(limite, self.maximo)
+        return self.maximo
+
+class MetricasModbus:
+
+    def __init__(self, ventana=VENTANA_OCUPACION, reloj=time.monotonic):
+        self.ventana = ventana
+        self.reloj = reloj
+        self._lock = threading.Lock()
+        self._inicio = reloj()
+        self._latencias = {}     # (esclavo, funcion) -> Histograma
+        self._resultados = {}    # (esclavo, funcion, estado) -> cantidad
+        self._reintentos = {}    # (esclavo, funcion) -> cantidad
+        self._ocupacion = {}     # bus -> deque de (fin, duración) dentro de la ventana
+        self._ocupado_total = {} # bus -> s acumulados en transacciones
+        self._medidores = {}     # nombre -> función sin argumentos (colas, atrasos...)
+
+    # --- Registro ---
+    def registrar_transaccion(self, esclavo, funcion, estado, duracion, bus=None, reintento=False):
+        """Una transacción completa (se llama en el hilo del bus).
+        `bus`: puerto serie, para la ocupación de cada bus por separado;
+        `reintento`: la trama se reenvía tras un fallo."""
+        fin = self.reloj()
+        with self._lock:
+            clave = (esclavo, funcion)
+            if clave not in self._latencias:
+                self._latencias[clave] = Histograma()
+                self._reintentos[clave] = 0
+            if estado != "ERROR_TIMEOUT":
+                # Un timeout no es una latencia: solo mide el tiempo de espera
+                self._latencias[clave].observar(duracion)
+            clave_estado = (esclavo, funcion, estado)
+            self._resultados[clave_estado] = self._resultados.get(clave_estado, 0) + 1
+
+            if reintento:
+                self._reintentos[clave] += 1
+
+            if bus not in self._ocupacion:
+                self._ocupacion[bus] = deque()
+                self._ocupado_total[bus] = 0.0
+            self._ocupacion[bus].append((fin, duracion))
+            self._ocupado_total[bus] += duracion
+            self._podar(fin)
+
+    def registrar_medidor(self, nombre, funcion):
+        """Valor instantáneo leído al exportar (p. ej. lambda: maestro.pendientes())."""
+        self._medidores[nombre] = funcion
+
+    def _podar(self, ahora):
+        for ocupacion in self._ocupacion.values():
+            while ocupacion and ocupacion[0][0] < ahora - self.ventana:
+                ocupacion.popleft()
+
+    def _bus_ocupado(self, ahora):
+        """{bus: fracción ocupada}"""
+        self._podar(ahora)
+        ventana = min(self.ventana, max(ahora - self._inicio, 1e-9))
+        return {bus: min(1.0, sum(d for _, d in ocupacion) / ventana)
+                for bus, ocupacion in self._ocupacion.items()}
+
+    def _leer_medidores(self):
+        valores = {}
+        for nombre, funcion in list(self._medidores.items()):
+            try:
+                valores[nombre] = funcion()
+            except Exception:
+                valores[nombre] = None
+        return valores
+
+    # --- Exportación ---
+    def instantanea(self):
+        ahora = self.reloj()
+        medidores = self._leer_medidores()
+        with self._lock:
+            transacciones = {}
+            for (esclavo, funcion), histograma in self._latencias.items():
+                resultados = {estado: n for (e, f, estado), n in self._resultados.items()
+                              if (e, f) == (esclavo, funcion)}
+                transacciones[f"e{esclavo}_fc{funcion:02d}"] = {
+                    "total": sum(resultados.values()),
+                    "resultados": resultados,
+                    "timeouts": resultados.get("ERROR_TIMEOUT", 0),
+                    "reintentos": self._reintentos[(esclavo, funcion)],
+                    "latencia_media_ms": round(1000 * histograma.suma / histograma.cantidad, 2) if histograma.cantidad else 0.0,
+                    "latencia_p95_ms": round(1000 * histograma.percentil(0.95), 2),
+                    "latencia_max_ms": round(1000 * histograma.maximo, 2),
+                    "histograma_ms": {**{str(int(l * 1000)): n for l, n in zip(histograma.limites, histograma.cubetas)},
+                                      "inf": histograma.cubetas[-1]},
+                }
+            ocupado = self._bus_ocupado(ahora)
+            return {
+                "timestamp": time.time(),
+                # El bus más cargado (con un solo puerto, la ocupación de ese puerto)
+                "bus_ocupado_pct": round(100 * max(ocupado.values(), default=0.0), 2),
+                "bus_ocupado_s": round(sum(self._ocupado_total.values()), 3),
+                "buses": {str(bus): {"ocupado_pct": round(100 * fraccion, 2),
+                                     "ocupado_s": round(self._ocupado_total[bus], 3)}
+                          for bus, fraccion in ocupado.items()},
+                "medidores": medidores,
+                "transacciones": transacciones,
+            }
+
+    def texto_prometheus(self):
+        ahora = self.reloj()
+        medidores = self._leer_medidores()
+        lineas = []
+        with self._lock:
+            lineas += ["# HELP modbus_latencia_segundos Tiempo de ida y vuelta de las transacciones Modbus",
+                       "# TYPE modbus_latencia_segundos histogram"]
+            for (esclavo, funcion), h in sorted(self._latencias.items()):
+                etiquetas = f'esclavo="{esclavo}",funcion="{funcion}"'
+                acumulado = 0
+                for limite, cuenta in zip(h.limites, h.cubetas):
+                    acumulado += cuenta
+                    lineas.append(f'modbus_latencia_segundos_bucket{{{etiquetas},le="{limite}"}} {acumulado}')
+                lineas.append(f'modbus_latencia_segundos_bucket{{{etiquetas},le="+Inf"}} {h.cantidad}')
+                lineas.append(f"modbus_latencia_segundos_sum{{{etiquetas}}} {h.suma:.6f}")
+                lineas.append(f"modbus_latencia_segundos_count{{{etiquetas}}} {h.cantidad}")
+
+            lineas += ["# HELP modbus_transacciones_total Transacciones Modbus por resultado",
+                       "# TYPE modbus_transacciones_total counter"]
+            for (esclavo, funcion, estado), n in sorted(self._resultados.items()):
+                lineas.append(f'modbus_transacciones_total{{esclavo="{esclavo}",funcion="{funcion}",estado="{estado}"}} {n}')
+
+            lineas += ["# HELP modbus_reintentos_total Tramas reenviadas tras un fallo",
+                       "# TYPE modbus_reintentos_total counter"]
+            for (esclavo, funcion), n in sorted(self._reintentos.items()):
+                lineas.append(f'modbus_reintentos_total{{esclavo="{esclavo}",funcion="{funcion}"}} {n}')
+
+            lineas += ["# HELP modbus_bus_ocupado_ratio Fracción del tiempo con el bus en una transacción",
+                       "# TYPE modbus_bus_ocupado_ratio gauge"]
+            for bus, fraccion in sorted(self._bus_ocupado(ahora).items(), key=lambda par: str(par[0])):
+                lineas.append(f'modbus_bus_ocupado_ratio{_etiqueta_bus(bus)} {fraccion:.4f}')
+            lineas += ["# HELP modbus_bus_ocupado_segundos_total Tiempo acumulado en transacciones",
+                       "# TYPE modbus_bus_ocupado_segundos_total counter"]
+            for bus, total in sorted(self._ocupado_total.items(), key=lambda par: str(par[0])):
+                lineas.append(f'modbus_bus_ocupado_segundos_total{_etiqueta_bus(bus)} {total:.6f}')
+
+        for nombre, valor in sorted(medidores.items()):
+            if valor is not None:
+                lineas += [f"# TYPE modbus_{nombre} gauge", f"modbus_{nombre} {valor}"]
+        return "\n".join(lineas) + "\n"
+
+    def iniciar_publicacion(self, periodo, publicar):
+        """Llama a publicar(instantanea) cada `periodo` s en un hilo propio."""
+        def bucle():
+            while True:
+                time.sleep(periodo)
+                try:
+                    publicar(self.instantanea())
+                except Exception as e:
+                    print(f"Error publicando métricas: {e}")
+        threading.Thread(target=bucle, name="metricas-publicacion", daemon=True).start()
+
+    def iniciar_http(self, puerto=PUERTO_HTTP, direccion="127.0.0.1"):
+        """Endpoint /metrics (Prometheus) y /metrics.json en un hilo propio."""
+        metricas = self
+
+        class Manejador(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path == "/metrics":
+                    cuerpo = metricas.texto_prometheus().encode("utf-8")
+                    tipo = "text/plain; version=0.0.4; charset=utf-8"
+                elif self.path == "/metrics.json":
+                    cuerpo = json.dumps(metricas.instantanea()).encode("utf-8")
+                    tipo = "application/json"
+                else:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", tipo)
+                self.send_header("Content-Length", str(len(cuerpo)))
+                self.end_headers()
+                self.wfile.write(cuerpo)
+
+            def log_message(self, *args):
+                pass  # Sin una línea por scrape en la consola
+
+        servidor = ThreadingHTTPServer((direccion, puerto), Manejador)
+        threading.Thread(target=servidor.serve_forever, name="metricas-http", daemon=True).start()
+        print(f"Métricas Prometheus en http://{direccion}:{puerto}/metrics")
+        return servidor
+
+def _etiqueta_bus(bus):
+    return f'{{bus="{bus}"}}' if bus is not None else ""
+
+# --- Nodos OPC UA de diagnóstico ---
+def aplanar(instantanea):
+    """{nombre_de_nodo: número} con lo que se publica como diagnóstico OPC."""
+    planos = {"Bus_Ocupado_Pct": instantanea["bus_ocupado_pct"]}
+    buses = instantanea.get("buses", {})
+    if len(buses) > 1:
+        for bus, ocupacion in buses.items():
+            planos[f"Bus_{re.sub(r'[^0-9A-Za-z]+', '_', bus).strip('_')}_Ocupado_Pct"] = ocupacion["ocupado_pct"]
+    for nombre, valor in instantanea["medidores"].items():
+        if valor is not None:
+            planos["_".join(p.capitalize() for p in nombre.split("_"))] = valor
+    for clave, t in instantanea["transacciones"].items():
+        prefijo = clave.upper()
+        planos[f"{prefijo}_Transacciones"] = t["total"]
+        planos[f"{prefijo}_Timeouts"] = t["timeouts"]
+        planos[f"{prefijo}_Reintentos"] = t["reintentos"]
+        planos[f"{prefijo}_Latencia_Media_ms"] = t["latencia_media_ms"]
+        planos[f"{prefijo}_Latencia_P95_ms"] = t["latencia_p95_ms"]
+        planos[f"{prefijo}_Latencia_Max_ms"] = t["latencia_max_ms"]
+    return planos
+
+def actualizar_nodos_diagnostico(objeto, nodos, instantanea):
+    """Crea (la primera vez) y actualiza las variables de diagnóstico bajo
+    `objeto`. `nodos` es el dict {nombre: Node} que se va completando."""
+    idx = objeto.nodeid.NamespaceIndex
+    for nombre, valor in aplanar(instantanea).items():
+        valor = float(valor)
+        if nombre not in nodos:
+            nodos[nombre] = objeto.add_variable(idx, nombre, valor)
+        else:
+            nodos[nombre].set_value(valor)
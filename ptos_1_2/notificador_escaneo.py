@@ -0,0 +1,182 @@
+# ---------- Notificación de escaneos nuevos ----------
+#
+# Canal por el que el maestro Modbus avisa "hay un escaneo nuevo" al
+# servidor OPC UA, para que este se despierte exactamente cuando hay
+# datos en vez de dormir un intervalo fijo.
+#
+#   - POSIX: socket Unix de datagramas (un datagrama por escaneo).
+#   - Windows: datagramas UDP en 127.0.0.1.
+#   - Respaldo (modo JSON): inotify sobre el archivo de traspaso.
+#
+# El emisor nunca bloquea: si no hay nadie escuchando, el aviso se pierde
+# y el lector lo cubre con su timeout de vigilancia.
+#
+# Por el mismo canal viaja, cada METRICAS_PERIODO, la instantánea de
+# métricas del maestro (JSON con prefijo "M") para los nodos de
+# diagnóstico del servidor OPC UA: sin archivo intermedio que releer.
+#
+# ---------------------------------------------------------------------
+
+import json
+import os
+import select
+import socket
+import struct
+import tempfile
+
+RUTA_SOCKET = os.path.join(tempfile.gettempdir(), "pci_escaneo.sock")
+DIRECCION_UDP = ("127.0.0.1", 48400)
+USAR_SOCKET_UNIX = os.name == "posix"
+
+_generacion = struct.Struct("<Q")
+PREFIJO_METRICAS = b"M"
+# Máximo de un aviso de métricas (un escaneo ocupa 8 bytes). Bien por debajo
+# de los 64 KB de UDP y del buffer por defecto de AF_UNIX (~208 KB): más
+# grande, sendto() falla con EMSGSIZE y la instantánea se pierde en silencio
+TAM_DATAGRAMA = 60000
+
+def direccion_por_defecto():
+    return RUTA_SOCKET if USAR_SOCKET_UNIX else DIRECCION_UDP
+
+def _crear_socket():
+    familia = socket.AF_UNIX if USAR_SOCKET_UNIX else socket.AF_INET
+    sock = socket.socket(familia, socket.SOCK_DGRAM)
+    sock.setblocking(False)
+    return sock
+
+class EmisorEscaneo:
+    """Lado del maestro: notificar() después de cada publicación."""
+
+    def __init__(self, direccion=None):
+        self.direccion = direccion or direccion_por_defecto()
+        self._sock = _crear_socket()
+
+    def notificar(self, generacion=0):
+        try:
+            self._sock.sendto(_generacion.pack(generacion), self.direccion)
+        except OSError:
+            # Nadie escuchando (servidor caído) o buffer lleno: no es un error
+            pass
+
+    def notificar_metricas(self, instantanea):
+        """Instantánea de MetricasModbus para los nodos de diagnóstico."""
+        datos = PREFIJO_METRICAS + json.dumps(instantanea, separators=(",", ":")).encode("utf-8")
+        if len(datos) > TAM_DATAGRAMA:
+            print(f"⚠️ Métricas de {len(datos)} bytes: no entran en un aviso, no se envían")
+            return
+        try:
+            self._sock.sendto(datos, self.direccion)
+        except OSError:
+            pass
+
+    def cerrar(self):
+        self._sock.close()
+
+class ReceptorEscaneo:
+    """Lado del servidor: esperar(timeout) vuelve en cuanto llega un aviso."""
+
+    def __init__(self, direccion=None):
+        self.direccion = direccion or direccion_por_defecto()
+        self._sock = _crear_socket()
+        if USAR_SOCKET_UNIX and isinstance(self.direccion, str):
+            try:
+                os.unlink(self.direccion)  # Socket huérfano de una ejecución anterior
+            except FileNotFoundError:
+                pass
+        self._sock.bind(self.direccion)
+        self._buffer = bytearray(TAM_DATAGRAMA)
+        self._metricas = None
+
+    def fileno(self):
+        return self._sock.fileno()
+
+    def esperar(self, timeout):
+        """Devuelve la última generación notificada, o None si venció el
+        timeout sin avisos. Descarta los avisos acumulados (solo importa
+        el más reciente); las métricas quedan para tomar_metricas()."""
+        listos, _, _ = select.select([self._sock], [], [], timeout)
+        if not listos:
+            return None
+        generacion = None
+        while True:
+            try:
+                n = self._sock.recv_into(self._buffer)
+            except BlockingIOError:
+                return generacion
+            if n == _generacion.size:
+                generacion = _generacion.unpack_from(self._buffer)[0]
+            elif self._buffer[:1] == PREFIJO_METRICAS:
+                try:
+                    self._metricas = json.loads(self._buffer[1:n])
+                except ValueError:
+                    pass
+
+    def tomar_metricas(self):
+        """Última instantánea de métricas recibida (una sola vez), o None."""
+        metricas, self._metricas = self._metricas, None
+        return metricas
+
+    def cerrar(self):
+        self._sock.close()
+        if USAR_SOCKET_UNIX and isinstance(self.direccion, str):
+            try:
+                os.unlink(self.direccion)
+            except FileNotFoundError:
+                pass
+
+# --- Respaldo: inotify sobre el archivo de traspaso (solo Linux) ---
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_NONBLOCK = 0o4000
+_evento_inotify = struct.Struct("iIII")
+
+class ReceptorInotify:
+    """
+    Se despierta cuando el archivo `ruta` se reescribe o se reemplaza con
+    os.replace (como hace escribir_json_seguro). Vigila el directorio,
+    porque el reemplazo cambia el inodo del archivo.
+    """
+
+    def __init__(self, ruta):
+        import ctypes
+        import ctypes.util
+
+        self._libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self._fd = self._libc.inotify_init1(IN_NONBLOCK)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 falló")
+        directorio = os.path.dirname(os.path.abspath(ruta))
+        self._nombre = os.path.basename(ruta).encode()
+        if self._libc.inotify_add_watch(self._fd, directorio.encode(), IN_CLOSE_WRITE | IN_MOVED_TO) < 0:
+            os.close(self._fd)
+            raise OSError(ctypes.get_errno(), f"inotify_add_watch falló sobre {directorio}")
+
+    def fileno(self):
+        return self._fd
+
+    def esperar(self, timeout):
+        """True si el archivo cambió antes del timeout, None si no."""
+        listos, _, _ = select.select([self._fd], [], [], timeout)
+        if not listos:
+            return None
+        cambio = None
+        while True:
+            try:
+                datos = os.read(self._fd, 4096)
+            except BlockingIOError:
+                return cambio
+            desplazamiento = 0
+            while desplazamiento < len(datos):
+                _, _, _, largo = _evento_inotify.unpack_from(datos, desplazamiento)
+                inicio = desplazamiento + _evento_inotify.size
+                nombre = datos[inicio:inicio + largo].rstrip(b"\0")
+                if nombre == self._nombre:
+                    cambio = True
+                desplazamiento = inicio + largo
+
+    def tomar_metricas(self):
+        """Sin socket no llegan métricas (modo JSON de depuración)."""
+        return None
+
+    def cerrar(self):
+        os.close(self._fd)
@@ -0,0 +1,210 @@
+# ---------- Outbox en disco para publicaciones MQTT ----------
+#
+# Store-and-forward para cortes del broker (o del enlace WAN):
+#   - Con el broker conectado y sin atrasos, se publica directo.
+#   - Si no hay conexión (o quedan mensajes atrasados, para no romper el
+#     orden), el mensaje se guarda en SQLite en modo WAL.
+#   - Un hilo reenvía lo guardado, en orden y con un tope de mensajes por
+#     segundo, apenas vuelve la conexión; borra cada lote recién cuando
+#     paho confirma que salió.
+#
+# El outbox está acotado (cantidad máxima y retención) con política de
+# descarte configurable, así un corte de horas no infla la RAM: lo
+# pendiente vive en disco. Los INSERT se agrupan en transacciones que se
+# confirman cada INTERVALO_COMMIT segundos (fsync por lote, no por
+# mensaje; con synchronous=NORMAL el WAL solo sincroniza en checkpoints).
+# Las User Properties de MQTT v5 (p. ej. la traza de latencia) se
+# guardan junto al mensaje y se reenvían con él. Con un AliasTopicos
+# (publicacion_mqtt.py), lo que sale directo usa Topic Alias; lo que se
+# reenvía desde el disco va siempre con el tópico completo.
+#
+# ---------------------------------------------------------------------
+
+import json
+import sqlite3
+import threading
+import time
+
+from paho.mqtt.packettypes import PacketTypes
+from paho.mqtt.properties import Properties
+
+DESCARTAR_VIEJOS = "viejos"   # Al llenarse, se pierde lo más antiguo
+DESCARTAR_NUEVOS = "nuevos"   # Al llenarse, se rechaza lo que llega
+
+INTERVALO_COMMIT = 0.5        # s entre commits de mensajes encolados
+LOTE_REENVIO = 100            # Mensajes por lote de reenvío
+TIMEOUT_CONFIRMACION = 10.0   # s para que paho confirme un lote
+
+class OutboxMQTT:
+
+    def __init__(self, mqtt_client, ruta="outbox_mqtt.db", max_mensajes=500_000,
+                 retencion_s=72 * 3600, politica=DESCARTAR_VIEJOS, tasa_reenvio=200.0, alias=None):
+        self.mqtt_client = mqtt_client
+        self.alias = alias
+        self.max_mensajes = max_mensajes
+        self.retencion_s = retencion_s
+        self.politica = politica
+        self.tasa_reenvio = tasa_reenvio
+        self.descartados = 0
+
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(ruta, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("""CREATE TABLE IF NOT EXISTS outbox (
+                                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                                creado REAL NOT NULL,
+                                topico TEXT NOT NULL,
+                                payload BLOB,
+                                qos INTEGER NOT NULL,
+                                retain INTEGER NOT NULL)""")
+        columnas = [fila[1] for fila in self._db.execute("PRAGMA table_info(outbox)")]
+        if "propiedades" not in columnas: # Outbox de una versión anterior
+            self._db.execute("ALTER TABLE outbox ADD COLUMN propiedades TEXT")
+        self._pendientes = self._db.execute("SELECT COUNT(*) FROM outbox").fetchone()[0]
+        self._transaccion_abierta = False
+        self._ultimo_commit = time.monotonic()
+        self._detener = threading.Event()
+        self._hilo = None
+
+    # --- Publicación ---
+    def publicar(self, topico, payload, qos=0, retain=False, persistir=True, properties=None):
+        """
+        Reemplazo de mqtt_client.publish(). Con persistir=False (p. ej.
+        heartbeats) el mensaje se descarta si no hay conexión.
+        """
+        with self._lock:
+            directo = self.mqtt_client.is_connected() and self._pendientes == 0
+        if directo:
+            if self.alias is not None:
+                topico, properties = self.alias.aplicar(topico, qos, properties)
+            return self.mqtt_client.publish(topico, payload, qos=qos, retain=retain, properties=properties)
+        if persistir:
+            self._guardar(topico, payload, qos, retain, properties)
+        return None
+
+    def pendientes(self):
+        with self._lock:
+            return self._pendientes
+
+    def _guardar(self, topico, payload, qos, retain, properties=None):
+        if isinstance(payload, str):
+            payload = payload.encode("utf-8")
+        elif payload is not None and not isinstance(payload, (bytes, bytearray)):
+            payload = str(payload).encode("utf-8")
+        propiedades = None
+        if properties is not None and getattr(properties, "UserProperty", None):
+            propiedades = json.dumps(properties.UserProperty)
+
+        with self._lock:
+            if self._pendientes >= self.max_mensajes:
+                if self.politica == DESCARTAR_NUEVOS:
+                    self.descartados += 1
+                    return
+                self._abrir_transaccion()
+                self._db.execute("DELETE FROM outbox WHERE id = (SELECT MIN(id) FROM outbox)")
+                self._pendientes -= 1
+                self.descartados += 1
+            self._abrir_transaccion()
+            self._db.execute("INSERT INTO outbox (creado, topico, payload, qos, retain, propiedades) "
+                             "VALUES (?, ?, ?, ?, ?, ?)",
+                             (time.time(), topico, payload, qos, int(retain), propiedades))
+            self._pendientes += 1
+            if time.monotonic() - self._ultimo_commit >= INTERVALO_COMMIT:
+                self._confirmar()
+
+    def _abrir_transaccion(self):
+        if not self._transaccion_abierta:
+            self._db.execute("BEGIN")
+            self._transaccion_abierta = True
+
+    def _confirmar(self):
+        if self._transaccion_abierta:
+            self._db.execute("COMMIT")
+            self._transaccion_abierta = False
+        self._ultimo_commit = time.monotonic()
+
+    # --- Mantenimiento y reenvío (hilo propio) ---
+    def _purgar_vencidos(self):
+        with self._lock:
+            self._abrir_transaccion()
+            cursor = self._db.execute("DELETE FROM outbox WHERE creado < ?",
+                                      (time.time() - self.retencion_s,))
+            if cursor.rowcount > 0:
+                self._pendientes -= cursor.rowcount
+                self.descartados += cursor.rowcount
+            self._confirmar()
+
+    def _reenviar_lote(self):
+        """Publica el lote más antiguo; devuelve True si quedó confirmado."""
+        with self._lock:
+            self._confirmar()
+            filas = self._db.execute("SELECT id, topico, payload, qos, retain, propiedades FROM outbox "
+                                     "ORDER BY id LIMIT ?", (LOTE_REENVIO,)).fetchall()
+        if not filas:
+            return False
+
+        envios = []
+        for id_fila, topico, payload, qos, retain, propiedades in filas:
+            if not self.mqtt_client.is_connected():
+                break
+            envios.append((id_fila, self.mqtt_client.publish(topico, payload, qos=qos, retain=bool(retain),
+                                                             properties=_propiedades(propiedades))))
+            if self.tasa_reenvio:
+                time.sleep(1.0 / self.tasa_reenvio)
+
+        ultimo_confirmado = None
+        for id_fila, info in envios:
+            try:
+                info.wait_for_publish(timeout=TIMEOUT_CONFIRMACION)
+            except (RuntimeError, ValueError):
+                break
+            if not info.is_published():
+                break
+            ultimo_confirmado = id_fila
+        if ultimo_confirmado is None:
+            return False
+
+        with self._lock:
+            self._abrir_transaccion()
+            cursor = self._db.execute("DELETE FROM outbox WHERE id <= ?", (ultimo_confirmado,))
+            self._pendientes -= cursor.rowcount
+            self._confirmar()
+        return ultimo_confirmado == filas[-1][0]
+
+    def _bucle(self):
+        ultima_purga = 0.0
+        while not self._detener.is_set():
+            if time.monotonic() - ultima_purga > 60.0:
+                self._purgar_vencidos()
+                ultima_purga = time.monotonic()
+            with self._lock:
+                if time.monotonic() - self._ultimo_commit >= INTERVALO_COMMIT:
+                    self._confirmar()
+                hay_pendientes = self._pendientes > 0
+            if hay_pendientes and self.mqtt_client.is_connected():
+                if self._reenviar_lote():
+                    continue
+            self._detener.wait(INTERVALO_COMMIT)
+
+    def iniciar(self):
+        self._hilo = threading.Thread(target=self._bucle, name="outbox-mqtt", daemon=True)
+        self._hilo.start()
+        if self._pendientes:
+            print(f"Outbox MQTT: {self._pendientes} mensajes pendientes de un corte anterior")
+
+    def cerrar(self):
+        self._detener.set()
+        if self._hilo is not None:
+            self._hilo.join(timeout=5.0)
+        with self._lock:
+            self._confirmar()
+            self._db.close()
+
+def _propiedades(texto):
+    """User Properties guardadas (JSON) -> Properties de PUBLISH, o None."""
+    if not texto:
+        return None
+    propiedades = Properties(PacketTypes.PUBLISH)
+    propiedades.UserProperty = [tuple(par) for par in json.loads(texto)]
+    return propiedades
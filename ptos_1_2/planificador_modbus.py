@@ -0,0 +1,194 @@
+# ---------- Planificador de sondeo Modbus ----------
+#
+# Recibe una lista de tags (esclavo, dirección, cantidad, periodo) y:
+#   1. Agrupa los rangos contiguos o casi contiguos de un mismo esclavo y
+#      función en bloques de, como máximo, 125 registros (límite FC03/FC04).
+#   2. Le da a cada bloque su propio vencimiento (deadline), de modo que
+#      los tags rápidos (botones) no esperan detrás de los lentos.
+#   3. Mide el jitter (retraso del inicio real de cada lectura respecto de
+#      su vencimiento) y cuenta los atrasos: un bloque que se atrasa más de
+#      un periodo salta al presente en vez de acumular lecturas.
+#
+# Los vencimientos avanzan de a un periodo exacto sobre el reloj
+# monótono (no "ahora + periodo"), así el periodo real no deriva con la
+# duración de cada transacción.
+#
+# En un bus RS-485 a 9600 baudios cada petición extra cuesta decenas de
+# milisegundos; leer unos registros de más dentro de un bloque es mucho
+# más barato que otra petición.
+#
+# ---------------------------------------------------------------------
+
+import heapq
+import math
+import time
+from collections import namedtuple
+
+from receptor_rtu import longitud_respuesta, tiempo_trama, tiempos_silencio
+
+FUNCION_LEER_REGISTROS = 0x03   # Holding registers
+FUNCION_LEER_ENTRADAS = 0x04    # Input registers
+FUNCIONES_LECTURA = (FUNCION_LEER_REGISTROS, FUNCION_LEER_ENTRADAS)
+MAX_REGISTROS_POR_PETICION = 125
+HUECO_MAXIMO = 8                # Registros "de relleno" tolerados entre dos tags
+
+# --- Definición de un tag de sondeo ---
+Tag = namedtuple("Tag", ["nombre", "esclavo", "direccion", "cantidad", "periodo", "funcion"])
+Tag.__new__.__defaults__ = (1, FUNCION_LEER_REGISTROS)  # periodo (1 s), funcion
+
+class EstadisticaJitter:
+    """Media, desvío y máximo del retraso de inicio (Welford, O(1) por muestra)."""
+
+    def __init__(self):
+        self.cantidad = 0
+        self.media = 0.0
+        self.maximo = 0.0
+        self._m2 = 0.0
+
+    def observar(self, retraso):
+        self.cantidad += 1
+        delta = retraso - self.media
+        self.media += delta / self.cantidad
+        self._m2 += delta * (retraso - self.media)
+        self.maximo = max(self.maximo, retraso)
+
+    @property
+    def desvio(self):
+        return math.sqrt(self._m2 / self.cantidad) if self.cantidad > 1 else 0.0
+
+    def __repr__(self):
+        return (f"jitter media={1000 * self.media:.2f} ms desvío={1000 * self.desvio:.2f} ms "
+                f"máx={1000 * self.maximo:.2f} ms (n={self.cantidad})")
+
+class Bloque:
+    """Una petición de lectura que cubre uno o más tags."""
+
+    def __init__(self, esclavo, funcion, inicio, cantidad, periodo, tags):
+        self.esclavo = esclavo
+        self.funcion = funcion
+        self.inicio = inicio
+        self.cantidad = cantidad
+        self.periodo = periodo
+        self.tags = tags  # lista de (tag, desplazamiento dentro del bloque)
+        self.jitter = EstadisticaJitter()
+        self.decodificador = None  # mapa_tags.Decodificador (lo compila el maestro en la primera lectura)
+
+    def repartir(self, registros):
+        """Devuelve {nombre_tag: valor} a partir de los registros del bloque.
+        Los tags de un registro dan un entero, los de varios una lista."""
+        valores = {}
+        for tag, desplazamiento in self.tags:
+            if tag.cantidad == 1:
+                valores[tag.nombre] = registros[desplazamiento]
+            else:
+                valores[tag.nombre] = registros[desplazamiento:desplazamiento + tag.cantidad]
+        return valores
+
+    def __repr__(self):
+        nombres = ",".join(tag.nombre for tag, _ in self.tags)
+        return (f"Bloque(esclavo={self.esclavo}, fc={self.funcion:#04x}, "
+                f"inicio={self.inicio}, cantidad={self.cantidad}, periodo={self.periodo}, tags=[{nombres}])")
+
+# --- Agrupamiento de rangos ---
+def agrupar_tags(tags, hueco_maximo=HUECO_MAXIMO, max_registros=MAX_REGISTROS_POR_PETICION):
+    """
+    Fusiona los tags en la menor cantidad de bloques posible.
+    Solo se fusionan tags del mismo esclavo y función cuyo hueco sea
+    <= hueco_maximo y cuyo bloque resultante no supere max_registros.
+    El periodo del bloque es el del tag más rápido que contiene.
+    """
+    for tag in tags:
+        if not 1 <= tag.cantidad <= max_registros:
+            raise ValueError(f"Tag '{tag.nombre}': cantidad fuera de rango (1-{max_registros})")
+        if tag.periodo <= 0:
+            raise ValueError(f"Tag '{tag.nombre}': el periodo debe ser positivo")
+        if tag.funcion not in FUNCIONES_LECTURA:
+            raise ValueError(f"Tag '{tag.nombre}': función {tag.funcion:#04x} no es de lectura (FC03 / FC04)")
+
+    ordenados = sorted(tags, key=lambda t: (t.esclavo, t.funcion, t.direccion))
+    bloques = []
+    actual = None  # [esclavo, funcion, inicio, fin (exclusivo), [tags]]
+
+    for tag in ordenados:
+        fin_tag = tag.direccion + tag.cantidad
+        if (actual is not None
+                and actual[0] == tag.esclavo
+                and actual[1] == tag.funcion
+                and tag.direccion - actual[3] <= hueco_maximo
+                and max(actual[3], fin_tag) - actual[2] <= max_registros):
+            actual[3] = max(actual[3], fin_tag)
+            actual[4].append(tag)
+        else:
+            if actual is not None:
+                bloques.append(actual)
+            actual = [tag.esclavo, tag.funcion, tag.direccion, fin_tag, [tag]]
+    if actual is not None:
+        bloques.append(actual)
+
+    return [
+        Bloque(esclavo, funcion, inicio, fin - inicio,
+               min(t.periodo for t in tags_bloque),
+               [(t, t.direccion - inicio) for t in tags_bloque])
+        for esclavo, funcion, inicio, fin, tags_bloque in bloques
+    ]
+
+# --- Planificador por vencimientos ---
+class PlanificadorSondeo:
+    """
+    Cola de prioridad de bloques ordenada por vencimiento. A igual
+    vencimiento sale primero el bloque de periodo más corto.
+    """
+
+    def __init__(self, tags, hueco_maximo=HUECO_MAXIMO, reloj=time.monotonic):
+        self.bloques = agrupar_tags(tags, hueco_maximo)
+        self.reloj = reloj
+        self.atrasos = 0 # Sondeos que vencieron más de un periodo tarde (overruns)
+        self.jitter = EstadisticaJitter() # De todos los bloques juntos
+        ahora = reloj()
+        self._cola = [(ahora, bloque.periodo, i, bloque) for i, bloque in enumerate(self.bloques)]
+        heapq.heapify(self._cola)
+
+    def proximo(self):
+        """Devuelve (bloque, segundos_hasta_su_vencimiento) sin sacarlo de la cola."""
+        vencimiento, _, _, bloque = self._cola[0]
+        return bloque, max(0.0, vencimiento - self.reloj())
+
+    def siguiente(self, dormir=time.sleep):
+        """Espera al vencimiento del próximo bloque, lo reprograma y lo devuelve."""
+        _, espera = self.proximo()
+        if espera > 0:
+            dormir(espera)
+        return self.tomar()
+
+    def tomar(self):
+        """Saca el próximo bloque sin esperar, lo reprograma y lo devuelve
+        (para quien gestiona la espera por su cuenta, p. ej. asyncio)."""
+        return self.tomar_con_vencimiento()[0]
+
+    def tomar_con_vencimiento(self):
+        """Como tomar(), pero devuelve (bloque, vencimiento que se estaba
+        atendiendo), para medir el jitter con registrar_inicio()."""
+        vencimiento, periodo, i, bloque = heapq.heappop(self._cola)
+        ahora = self.reloj()
+        proximo = vencimiento + bloque.periodo
+        if proximo < ahora:
+            # Vamos atrasados: no acumulamos lecturas pendientes, saltamos al presente
+            proximo = ahora + bloque.periodo
+            self.atrasos += 1
+        heapq.heappush(self._cola, (proximo, periodo, i, bloque))
+        return bloque, vencimiento
+
+    def registrar_inicio(self, bloque, vencimiento, inicio=None):
+        """Anota cuánto tarde empezó realmente la lectura (en el hilo del bus)."""
+        retraso = max(0.0, (self.reloj() if inicio is None else inicio) - vencimiento)
+        bloque.jitter.observar(retraso)
+        self.jitter.observar(retraso)
+        return retraso
+
+    def carga_bus(self, baudios):
+        """Fracción del bus que piden los periodos configurados (petición +
+        respuesta + silencios t3.5). Por encima de 1.0 no hay forma de
+        sostener esos periodos: habrá atrasos."""
+        t35 = tiempos_silencio(baudios)[1]
+        return sum((tiempo_trama(baudios, 8 + longitud_respuesta(b.funcion, b.cantidad)) + 2 * t35) / b.periodo
+                   for b in self.bloques)
@@ -0,0 +1,103 @@
+# ---------- Publicación MQTT compacta ----------
+#
+# Para enlaces celulares medidos y para no gastar conexiones del broker:
+#   - codificar_escaneo(): un solo mensaje por ciclo con todos los tags
+#     y contadores (JSON compacto o, si está instalado, MessagePack) en
+#     lugar de un PUBLISH por tópico.
+#   - AliasTopicos: Topic Alias de MQTT v5. El primer mensaje de un
+#     tópico lleva el nombre y un número de alias; los siguientes, solo
+#     el número (2 bytes en vez de p. ej. "pci/estadistica/..."). Solo
+#     para QoS 0: paho reenvía tal cual los QoS 1/2 pendientes al
+#     reconectar, y en la sesión nueva ese alias ya no existe.
+#   - EstadosRetenidos: los mensajes retenidos de estado se publican solo
+#     cuando cambian (y una vez tras cada reconexión, que es cuando el
+#     broker pudo haber publicado el LWT encima).
+#
+# ---------------------------------------------------------------------
+
+import json
+import threading
+
+from paho.mqtt.packettypes import PacketTypes
+from paho.mqtt.properties import Properties
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+FORMATO_NO = "no"
+FORMATO_JSON = "json"
+FORMATO_MSGPACK = "msgpack"
+
+def codificar_escaneo(contenido, formato=FORMATO_JSON):
+    """dict del escaneo -> payload (bytes / str) en el formato pedido."""
+    if formato == FORMATO_MSGPACK:
+        if msgpack is None:
+            raise RuntimeError("PAYLOAD_ESCANEO = 'msgpack' necesita el paquete msgpack")
+        return msgpack.packb(contenido)
+    return json.dumps(contenido, separators=(",", ":"))
+
+def decodificar_escaneo(payload):
+    """Inversa de codificar_escaneo() (detecta el formato por el primer byte)."""
+    if payload[:1] == b"{":
+        return json.loads(payload)
+    if msgpack is None:
+        raise RuntimeError("El escaneo viene en MessagePack y el paquete msgpack no está instalado")
+    return msgpack.unpackb(payload)
+
+class AliasTopicos:
+    """Asigna Topic Alias a los tópicos QoS 0 (hasta el máximo que anunció el broker)."""
+
+    def __init__(self):
+        self.maximo = 0
+        self._alias = {}
+        self._lock = threading.Lock()
+
+    def reiniciar(self, propiedades_connack=None):
+        """Llamar en on_connect: los alias valen por conexión."""
+        maximo = getattr(propiedades_connack, "TopicAliasMaximum", 0) if propiedades_connack else 0
+        with self._lock:
+            self.maximo = maximo
+            self._alias.clear()
+
+    def aplicar(self, topico, qos, properties=None):
+        """(tópico, properties) a publicar: tópico vacío si el alias ya se envió."""
+        if qos != 0:
+            return topico, properties
+        with self._lock:
+            alias = self._alias.get(topico)
+            nuevo = alias is None
+            if nuevo:
+                if len(self._alias) >= self.maximo:
+                    return topico, properties # Sin alias libres (o el broker no los acepta)
+                alias = self._alias[topico] = len(self._alias) + 1
+        if properties is None:
+            properties = Properties(PacketTypes.PUBLISH)
+        properties.TopicAlias = alias
+        return (topico if nuevo else ""), properties
+
+class EstadosRetenidos:
+    """Publica un retenido solo si su valor cambió desde el último envío."""
+
+    def __init__(self, publicar):
+        self.publicar = publicar # OutboxMQTT.publicar (o la misma firma)
+        self._ultimos = {}
+        self._lock = threading.Lock()
+
+    def actualizar(self, topico, valor, qos=1, persistir=True):
+        """El valor queda registrado solo si el envío se aceptó (publicado o
+        guardado en el outbox): con persistir=False y outbox con atraso el
+        mensaje se descarta, y hay que volver a intentarlo en la próxima."""
+        with self._lock:
+            if self._ultimos.get(topico, object()) == valor:
+                return None
+            resultado = self.publicar(topico, valor, qos=qos, retain=True, persistir=persistir)
+            if persistir or (resultado is not None and getattr(resultado, "rc", 0) == 0):
+                self._ultimos[topico] = valor
+            return resultado
+
+    def olvidar(self):
+        """Tras reconectar se vuelve a publicar cada estado."""
+        with self._lock:
+            self._ultimos.clear()
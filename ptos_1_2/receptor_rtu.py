@@ -0,0 +1,180 @@
+# ---------- Receptor Modbus RTU por longitud ----------
+#
+# Sustituye el esquema reset_input_buffer() + read(3) + read(n) del
+# maestro. El receptor:
+#   - Conoce la longitud de respuesta esperada de cada código de función
+#     (incluidas las tramas de excepción de 5 bytes).
+#   - Espera el primer byte con el timeout de respuesta y, desde ahí, el
+#     fin de trama lo marca el silencio entre caracteres (t3.5, calculado
+#     a partir de los baudios): cada byte recibido renueva el plazo, así
+#     una trama truncada cuesta t3.5 y no el timeout completo. pyserial
+#     en POSIX no aplica inter_byte_timeout, por eso el silencio se mide
+#     acá con select() sobre el descriptor (o sondeando in_waiting).
+#   - Se resincroniza sobre basura (eco del adaptador RS-485, restos de
+#     una respuesta tardía) buscando la cabecera esclavo+función con CRC
+#     válido. Antes de transmitir, descarta lo que siga llegando de una
+#     respuesta tardía hasta ver el bus en silencio t3.5.
+#
+# ---------------------------------------------------------------------
+
+import select
+import time
+
+from crc_modbus import verificar_crc
+
+BITS_POR_CARACTER = 11       # 1 start + 8 datos + paridad/stop + stop
+INTERCARACTER_MINIMO = 0.002 # Piso para adaptadores USB con latencia propia
+BAUDIOS_TIEMPOS_FIJOS = 19200
+LONGITUD_MAXIMA = 256        # ADU RTU más larga
+ESPERA_SONDEO = 0.0005       # Sin descriptor (p. ej. Windows): cada cuánto mirar in_waiting
+
+# --- Tiempos de trama (Modbus over Serial Line, sección 2.5.1.1) ---
+def tiempo_caracter(baudios):
+    """Segundos que tarda un carácter RTU en el bus."""
+    return BITS_POR_CARACTER / baudios
+
+def tiempos_silencio(baudios):
+    """Devuelve (t1.5, t3.5) en segundos. Por encima de 19200 baudios la
+    especificación los fija en 750 us y 1750 us."""
+    if baudios > BAUDIOS_TIEMPOS_FIJOS:
+        return 0.00075, 0.00175
+    t_car = tiempo_caracter(baudios)
+    return 1.5 * t_car, 3.5 * t_car
+
+def tiempo_trama(baudios, longitud):
+    """Segundos que ocupa en el bus una trama de `longitud` bytes."""
+    return longitud * tiempo_caracter(baudios)
+
+# --- Longitudes esperadas ---
+LONGITUD_EXCEPCION = 5
+
+def longitud_respuesta(funcion, cantidad=0):
+    """Longitud de la respuesta normal (con CRC) a una petición `funcion`
+    sobre `cantidad` registros/bits."""
+    if funcion in (0x01, 0x02):
+        return 5 + (cantidad + 7) // 8
+    if funcion in (0x03, 0x04):
+        return 5 + 2 * cantidad
+    if funcion in (0x05, 0x06, 0x0F, 0x10):
+        return 8
+    raise ValueError(f"Código de función no soportado: {funcion:#04x}")
+
+def _longitud_en(buffer, i, funcion):
+    """Longitud de la trama que empieza en buffer[i] (ya sabemos que
+    buffer[i+1] es `funcion` o su excepción). None si falta el byte de conteo."""
+    if buffer[i + 1] & 0x80:
+        return LONGITUD_EXCEPCION
+    if funcion in (0x01, 0x02, 0x03, 0x04):
+        if i + 2 >= len(buffer):
+            return None
+        return 5 + buffer[i + 2]
+    return 8
+
+def buscar_trama(buffer, id_esclavo, funcion):
+    """
+    Busca en `buffer` la primera trama válida de `id_esclavo`/`funcion`.
+    Devuelve (estado, inicio, longitud):
+      - ("OK" | "EXCEPCION", i, L) trama completa con CRC válido.
+      - ("INCOMPLETA", i, L)       cabecera encontrada, faltan bytes (L puede ser None).
+      - ("ERROR_CRC", i, L)        había candidatas, pero ninguna con CRC válido.
+      - ("VACIO", None, None)      no hay ninguna cabecera posible.
+    """
+    excepcion = funcion | 0x80
+    estado_final = ("VACIO", None, None)
+    n = len(buffer)
+    for i in range(n - 1):
+        if buffer[i] != id_esclavo or buffer[i + 1] not in (funcion, excepcion):
+            continue
+        longitud = _longitud_en(buffer, i, funcion)
+        if longitud is None or i + longitud > n:
+            # Puede ser el comienzo real de la respuesta: hay que leer más
+            return ("INCOMPLETA", i, longitud)
+        candidata = buffer if (i == 0 and longitud == n) else bytes(buffer[i:i + longitud])
+        if verificar_crc(candidata):
+            return ("EXCEPCION" if buffer[i + 1] == excepcion else "OK", i, longitud)
+        estado_final = ("ERROR_CRC", i, longitud)
+    return estado_final
+
+# --- Recepción ---
+def configurar_puerto(ser, baudios, intercaracter=None):
+    """Fija el silencio entre caracteres (t3.5) que usa leer_respuesta()."""
+    if intercaracter is None:
+        intercaracter = max(tiempos_silencio(baudios)[1], INTERCARACTER_MINIMO)
+    ser.inter_byte_timeout = intercaracter
+    return intercaracter
+
+def _intercaracter(ser):
+    return ser.inter_byte_timeout or max(tiempos_silencio(ser.baudrate)[1], INTERCARACTER_MINIMO)
+
+def esperar_datos(ser, espera):
+    """True si hay bytes para leer antes de `espera` segundos."""
+    if ser.in_waiting:
+        return True
+    if espera <= 0:
+        return False
+    fileno = getattr(ser, "fileno", None)
+    if fileno is not None:
+        listos, _, _ = select.select([fileno()], [], [], espera)
+        return bool(listos)
+    limite = time.monotonic() + espera
+    while not ser.in_waiting:
+        if time.monotonic() >= limite:
+            return False
+        time.sleep(ESPERA_SONDEO)
+    return True
+
+def descartar_basura(ser):
+    """Descarta restos de respuestas tardías hasta ver el bus en silencio
+    t3.5, sin tocar el buffer de salida. Si no hay nada pendiente vuelve
+    enseguida. Devuelve cuántos bytes se descartaron."""
+    descartados = 0
+    intercaracter = _intercaracter(ser)
+    while descartados < LONGITUD_MAXIMA and esperar_datos(ser, intercaracter if descartados else 0):
+        descartados += len(ser.read(ser.in_waiting or 1))
+    return descartados
+
+def leer_respuesta(ser, id_esclavo, funcion, longitud_esperada):
+    """
+    Lee la respuesta a una petición ya enviada: el primer byte con el
+    timeout del puerto, el resto hasta completar la trama o hasta un
+    silencio t3.5.
+    Devuelve (estado, trama) con estado en:
+    "OK", "ERROR_ESCLAVO", "ERROR_CRC", "ERROR_TRAMA_INCOMPLETA", "ERROR_TIMEOUT".
+    """
+    buffer = ser.read(1)
+    if not buffer:
+        return ("ERROR_TIMEOUT", None)
+    buffer = bytearray(buffer)
+    intercaracter = _intercaracter(ser)
+    limite = time.monotonic() + (ser.timeout or 0) + intercaracter # Cota ante un flujo de basura sin fin
+
+    while True:
+        estado, inicio, longitud = buscar_trama(buffer, id_esclavo, funcion)
+        if estado == "OK":
+            return ("OK", bytes(buffer[inicio:inicio + longitud]))
+        if estado == "EXCEPCION":
+            return ("ERROR_ESCLAVO", bytes(buffer[inicio:inicio + longitud]))
+        error = "ERROR_CRC" if estado == "ERROR_CRC" else "ERROR_TRAMA_INCOMPLETA"
+        if estado != "INCOMPLETA" and len(buffer) >= longitud_esperada:
+            return (error, None)
+        if len(buffer) >= LONGITUD_MAXIMA or time.monotonic() >= limite:
+            return (error, None)
+
+        # Falta el resto (hubo basura delante o llegó cortada): cada byte renueva el plazo t3.5
+        if not esperar_datos(ser, intercaracter):
+            return (error, None)
+        buffer += ser.read(ser.in_waiting or 1)
+
+def transaccion(ser, trama, id_esclavo, funcion, longitud_esperada, timeout_respuesta, baudios, eco=False):
+    """Envía `trama` y lee su respuesta en una sola lectura acotada por
+    timeout_respuesta + el tiempo de transmisión de la respuesta.
+    Con eco=True (adaptadores RS-485 que devuelven lo transmitido) se
+    consume primero el eco de la propia petición."""
+    descartar_basura(ser)
+    timeout = timeout_respuesta + tiempo_trama(baudios, longitud_esperada)
+    if ser.timeout != timeout:
+        ser.timeout = timeout
+    ser.write(trama)
+    if eco:
+        ser.read(len(trama))
+    return leer_respuesta(ser, id_esclavo, funcion, longitud_esperada)
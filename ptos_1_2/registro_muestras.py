@@ -0,0 +1,314 @@
+# ---------- Registro binario de escaneos (solo anexar) ----------
+#
+# datos_modbus.json y la imagen de proceso guardan solo el último
+# escaneo. GrabadorMuestras agrega cada escaneo del maestro a un archivo
+# binario de registros de ancho fijo, en segmentos que rotan por tamaño;
+# al superar el máximo configurado se borran los segmentos más viejos.
+# Pensado para semanas de datos en una tarjeta SD: sin fsync por
+# escaneo, se escribe en bloques cada PERIODO_VOLCADO s. Si se corta la
+# energía, a lo sumo se pierde ese último bloque (el lector ignora un
+# registro final incompleto). Si una escritura falla (SD llena o
+# quitada), el segmento se recorta al último registro completo y lo
+# pendiente se reintenta en el próximo volcado, acotado a MAX_PENDIENTE
+# bytes (se descartan los registros más viejos).
+#
+# Segmento: [cabecera 64 B] + registros. Cada registro (little-endian):
+#   t (int64, ns)  esclavo (u8)  funcion (u8)  estado (u16)
+#   inicio (u16)   cantidad (u16)  pad (u32)   registros (u16 x ancho)
+# `t` es monótono: reloj monótono anclado a la hora de pared al abrir el
+# segmento (un ajuste del NTP no desordena los registros). `estado` usa
+# los códigos de imagen_proceso; si la lectura falló, los registros van
+# en cero (inicio y cantidad siguen indicando qué bloque se intentó).
+#
+# LectorMuestras mapea los segmentos en memoria y devuelve arrays
+# estructurados de NumPy para consultas por rango de tiempo, sin pasar
+# por listas de Python.
+#
+# ---------------------------------------------------------------------
+
+import os
+import struct
+import threading
+import time
+
+from imagen_proceso import codigo_estado
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+MAGIC = b"PCIL"
+VERSION = 1
+CABECERA_BYTES = 64
+PREFIJO = "muestras_"
+EXTENSION = ".bin"
+TAMANO_SEGMENTO = 16 * 1024 * 1024
+TAMANO_MAXIMO = 4 * 1024 * 1024 * 1024
+PERIODO_VOLCADO = 1.0  # s entre escrituras al archivo
+MAX_PENDIENTE = 4 * 1024 * 1024  # bytes en memoria mientras el archivo no acepta escrituras
+
+_cabecera = struct.Struct("<4sHHIqq")
+_encabezado_registro = struct.Struct("<qBBHHH4x")
+
+def tamano_registro(ancho):
+    return _encabezado_registro.size + 2 * ancho
+
+def dtype_registro(ancho):
+    """dtype estructurado de NumPy de un registro con `ancho` registros."""
+    return np.dtype([("t", "<i8"), ("esclavo", "u1"), ("funcion", "u1"), ("estado", "<u2"),
+                     ("inicio", "<u2"), ("cantidad", "<u2"), ("pad", "<u4"),
+                     ("registros", "<u2", (ancho,))])
+
+def listar_segmentos(directorio):
+    """Segmentos del directorio, del más viejo al más nuevo."""
+    try:
+        nombres = os.listdir(directorio)
+    except FileNotFoundError:
+        return []
+    return [os.path.join(directorio, nombre) for nombre in sorted(nombres)
+            if nombre.startswith(PREFIJO) and nombre.endswith(EXTENSION)]
+
+def leer_cabecera(ruta):
+    """(ancho, ancla_pared_ns, ancla_monotonica_ns) de un segmento."""
+    with open(ruta, "rb") as f:
+        magic, version, ancho, _, ancla_pared, ancla_mono = _cabecera.unpack(f.read(_cabecera.size))
+    if magic != MAGIC or version != VERSION:
+        raise ValueError(f"{ruta} no es un segmento de muestras v{VERSION}")
+    return ancho, ancla_pared, ancla_mono
+
+class GrabadorMuestras:
+    """
+    Anexa escaneos a segmentos en `directorio`. `ancho`: registros por
+    registro (el bloque de sondeo más grande). registrar() es barato (se
+    arma el registro en memoria); un hilo lo vuelca al archivo.
+    """
+
+    def __init__(self, directorio, ancho, tamano_segmento=TAMANO_SEGMENTO,
+                 tamano_maximo=TAMANO_MAXIMO, periodo_volcado=PERIODO_VOLCADO,
+                 max_pendiente=MAX_PENDIENTE):
+        self.directorio = directorio
+        self.ancho = ancho
+        self.tamano_segmento = tamano_segmento
+        self.tamano_maximo = tamano_maximo
+        self.periodo_volcado = periodo_volcado
+        self.max_pendiente = max_pendiente
+        self.registros = 0
+        self.descartados = 0 # registros perdidos por no poder escribirlos
+        self._relleno = [0] * ancho
+        self._registro = struct.Struct(f"<qBBHHH4x{ancho}H")
+        self._pendiente = bytearray()
+        self._archivo = None
+        self._escritos = 0
+        self._lock = threading.Lock()
+        self._detener = threading.Event()
+        self._hilo = None
+        os.makedirs(directorio, exist_ok=True)
+
+    def iniciar(self):
+        self._hilo = threading.Thread(target=self._bucle, name="grabador-muestras", daemon=True)
+        self._hilo.start()
+        return self
+
+    def registrar(self, esclavo, funcion, estado, inicio, cantidad, registros=None):
+        """Un escaneo: registros crudos si la lectura fue OK, None si falló."""
+        t = self._ancla_pared + time.monotonic_ns() - self._ancla_mono if self._archivo else None
+        if cantidad > self.ancho:
+            raise ValueError(f"Bloque de {cantidad} registros: el grabador admite {self.ancho}")
+        valores = list(registros) + self._relleno[cantidad:] if registros else self._relleno
+        with self._lock:
+            if self._archivo is None:
+                try:
+                    self._abrir_segmento()
+                    t = self._ancla_pared
+                except OSError:
+                    t = time.time_ns() # Queda pendiente: volcar() vuelve a intentar abrir el segmento
+            self._pendiente += self._registro.pack(t, esclavo, funcion, codigo_estado(estado),
+                                                   inicio, cantidad, *valores)
+            self.registros += 1
+
+    def volcar(self):
+        """Escribe lo pendiente y rota el segmento si se llenó. Ante un
+        OSError deja el segmento en el último registro completo, conserva
+        lo pendiente (acotado) y relanza."""
+        with self._lock:
+            if not self._pendiente:
+                return
+            try:
+                if self._archivo is None:
+                    self._abrir_segmento()
+                self._escribir_todo(self._archivo, self._pendiente)
+            except OSError:
+                self._recortar()
+                self._acotar_pendiente()
+                raise
+            self._escritos += len(self._pendiente)
+            self._pendiente.clear()
+            if self._escritos >= self.tamano_segmento:
+                self._archivo.close()
+                self._archivo = None # El próximo registro abre un segmento nuevo
+                self._podar()
+
+    def cerrar(self):
+        self._detener.set()
+        if self._hilo is not None:
+            self._hilo.join(timeout=2 * self.periodo_volcado)
+        try:
+            self.volcar()
+        except OSError as e:
+            print(f"ERROR: No se pudo escribir el registro de muestras: {e}")
+        with self._lock:
+            if self._archivo is not None:
+                self._archivo.close()
+                self._archivo = None
+
+    # --- Internos ---
+    def _bucle(self):
+        while not self._detener.wait(self.periodo_volcado):
+            try:
+                self.volcar()
+            except OSError as e:
+                print(f"ERROR: No se pudo escribir el registro de muestras: {e}")
+
+    def _abrir_segmento(self):
+        self._ancla_pared = time.time_ns()
+        self._ancla_mono = time.monotonic_ns()
+        ruta = os.path.join(self.directorio, f"{PREFIJO}{self._ancla_pared:019d}{EXTENSION}")
+        archivo = open(ruta, "ab", buffering=0) # Sin buffer: lo que write() acepta ya está en el archivo
+        cabecera = _cabecera.pack(MAGIC, VERSION, self.ancho, tamano_registro(self.ancho),
+                                  self._ancla_pared, self._ancla_mono)
+        try:
+            self._escribir_todo(archivo, cabecera.ljust(CABECERA_BYTES, b"\0"))
+        except OSError:
+            archivo.close()
+            os.remove(ruta) # Un segmento sin cabecera completa no se puede leer
+            raise
+        self._archivo = archivo
+        self._escritos = CABECERA_BYTES
+
+    @staticmethod
+    def _escribir_todo(archivo, datos):
+        """write() hasta el final (sin buffer puede aceptar solo una parte).
+        Las vistas se liberan aun con error, para poder recortar `datos`."""
+        with memoryview(datos) as vista:
+            escritos = 0
+            while escritos < len(vista):
+                with vista[escritos:] as resto:
+                    escritos += archivo.write(resto)
+
+    def _recortar(self):
+        """Quita del segmento un registro escrito a medias. Si ni eso se
+        puede, se abandona el segmento (el próximo volcado abre otro)."""
+        if self._archivo is None:
+            return
+        try:
+            self._archivo.truncate(self._escritos)
+        except OSError as e:
+            print(f"ERROR: No se pudo recortar el segmento de muestras: {e}")
+            try:
+                self._archivo.close()
+            except OSError:
+                pass
+            self._archivo = None
+
+    def _acotar_pendiente(self):
+        """Descarta los registros más viejos si lo pendiente supera max_pendiente."""
+        exceso = len(self._pendiente) - self.max_pendiente
+        if exceso <= 0:
+            return
+        tamano = self._registro.size
+        n = -(-exceso // tamano) # Registros enteros a descartar
+        del self._pendiente[:n * tamano]
+        self.descartados += n
+        print(f"⚠️ Registro de muestras: {n} registros descartados (no se pueden escribir)")
+
+    def _podar(self):
+        """Borra los segmentos más viejos mientras el total supere el máximo."""
+        segmentos = listar_segmentos(self.directorio)
+        total = sum(os.path.getsize(ruta) for ruta in segmentos)
+        for ruta in segmentos[:-1]:
+            if total <= self.tamano_maximo:
+                break
+            total -= os.path.getsize(ruta)
+            os.remove(ruta)
+            print(f"Registro de muestras: segmento {os.path.basename(ruta)} borrado (límite de espacio)")
+
+class LectorMuestras:
+    """Consultas por rango de tiempo sobre los segmentos (requiere NumPy)."""
+
+    def __init__(self, directorio):
+        if np is None:
+            raise RuntimeError("LectorMuestras necesita NumPy")
+        self.directorio = directorio
+
+    def _mapear(self, ruta):
+        """Array estructurado (memmap, sin copia) con los registros completos del segmento."""
+        ancho, _, _ = leer_cabecera(ruta)
+        dtype = dtype_registro(ancho)
+        n = (os.path.getsize(ruta) - CABECERA_BYTES) // dtype.itemsize
+        if n <= 0:
+            return None
+        return np.memmap(ruta, dtype=dtype, mode="r", offset=CABECERA_BYTES, shape=(n,))
+
+    def recorrer(self, desde=None, hasta=None, bloque=4096):
+        """Itera el rango en trozos de hasta `bloque` registros (vistas del
+        memmap, sin copiar), para procesar semanas sin cargarlas enteras."""
+        desde_ns = int(desde * 1e9) if desde is not None else None
+        hasta_ns = int(hasta * 1e9) if hasta is not None else None
+        for ruta in listar_segmentos(self.directorio):
+            datos = self._mapear(ruta)
+            if datos is None:
+                continue
+            t = datos["t"]
+            i = np.searchsorted(t, desde_ns, "left") if desde_ns is not None else 0
+            j = np.searchsorted(t, hasta_ns, "left") if hasta_ns is not None else len(t)
+            for inicio in range(i, j, bloque):
+                yield datos[inicio:min(j, inicio + bloque)]
+
+    def rango(self, desde=None, hasta=None, esclavo=None, funcion=None):
+        """
+        Registros con desde <= t < hasta (segundos epoch; None = sin
+        límite), opcionalmente de un esclavo / función. Devuelve un array
+        estructurado (dtype_registro) con copia solo de lo seleccionado.
+        """
+        desde_ns = int(desde * 1e9) if desde is not None else None
+        hasta_ns = int(hasta * 1e9) if hasta is not None else None
+        partes = []
+        for ruta in listar_segmentos(self.directorio):
+            datos = self._mapear(ruta)
+            if datos is None:
+                continue
+            t = datos["t"]
+            if (desde_ns is not None and t[-1] < desde_ns) or (hasta_ns is not None and t[0] >= hasta_ns):
+                continue
+            i = np.searchsorted(t, desde_ns, "left") if desde_ns is not None else 0
+            j = np.searchsorted(t, hasta_ns, "left") if hasta_ns is not None else len(t)
+            seleccion = datos[i:j]
+            if esclavo is not None:
+                seleccion = seleccion[seleccion["esclavo"] == esclavo]
+            if funcion is not None:
+                seleccion = seleccion[seleccion["funcion"] == funcion]
+            partes.append(seleccion)
+
+        if not partes:
+            return np.zeros(0, dtype=dtype_registro(0))
+        ancho = max(parte.dtype["registros"].shape[0] for parte in partes)
+        resultado = np.zeros(sum(len(parte) for parte in partes), dtype=dtype_registro(ancho))
+        inicio = 0
+        for parte in partes:
+            fin = inicio + len(parte)
+            for campo in ("t", "esclavo", "funcion", "estado", "inicio", "cantidad"):
+                resultado[campo][inicio:fin] = parte[campo]
+            resultado["registros"][inicio:fin, :parte.dtype["registros"].shape[0]] = parte["registros"]
+            inicio = fin
+        return resultado
+
+    def serie(self, esclavo, direccion, desde=None, hasta=None, funcion=0x03):
+        """(tiempos en s epoch (float64), valores (uint16)) de un registro,
+        solo de las lecturas OK que lo incluyen."""
+        datos = self.rango(desde, hasta, esclavo, funcion)
+        desplazamiento = direccion - datos["inicio"].astype(np.int64)
+        validos = ((datos["estado"] == codigo_estado("OK")) & (desplazamiento >= 0)
+                   & (desplazamiento < datos["cantidad"]))
+        filas = np.nonzero(validos)[0]
+        return datos["t"][filas] / 1e9, datos["registros"][filas, desplazamiento[filas]]
@@ -0,0 +1,30 @@
+# ---------- Backoff exponencial con jitter ----------
+#
+# Espera entre reintentos que se duplica en cada fallo (hasta un máximo)
+# y se aleatoriza ("equal jitter": mitad fija + mitad al azar), para que
+# varios clientes que perdieron la conexión a la vez no reintenten todos
+# en el mismo instante.
+#
+# ---------------------------------------------------------------------
+
+import random
+
+class BackoffExponencial:
+
+    def __init__(self, base=0.5, maximo=30.0, factor=2.0, aleatorio=random.random):
+        self.base = base
+        self.maximo = maximo
+        self.factor = factor
+        self.aleatorio = aleatorio
+        self.fallos = 0
+
+    def siguiente(self):
+        """Registra un fallo y devuelve cuántos segundos esperar."""
+        tope = min(self.maximo, self.base * self.factor ** self.fallos)
+        if tope < self.maximo:
+            self.fallos += 1 # Una vez en el máximo no crece más (factor ** fallos desbordaría)
+        return tope / 2 + self.aleatorio() * tope / 2
+
+    def reiniciar(self):
+        """Llamar tras un intento exitoso."""
+        self.fallos = 0
@@ -0,0 +1,117 @@
+# ---------- Reproducción de escaneos grabados ----------
+#
+# Vuelve a inyectar en la imagen de proceso los escaneos que grabó
+# GrabadorMuestras (registro_muestras.py), con el mismo ritmo que tenían
+# o acelerados, y avisa al servidor OPC UA por el socket de notificación
+# como lo haría el maestro. Sirve para depurar el servidor, el bridge y
+# los clientes con datos reales sin el esclavo conectado.
+#
+# El maestro NO debe estar corriendo sobre la misma imagen (usar
+# --imagen para otra ruta y apuntar RUTA_IMAGEN_PROCESO del servidor).
+# El timestamp publicado es la hora actual, para que el watchdog del
+# servidor no marque los datos como viejos; la hora original se imprime.
+#
+# Uso: python reproducir_muestras.py muestras [--velocidad 10] [--desde "2026-01-05 08:00"]
+# ---------------------------------------------------------------------
+
+import argparse
+import datetime
+import time
+
+from imagen_proceso import ImagenProceso, RUTA_POR_DEFECTO, nombre_estado
+from mapa_tags import MapaTags, RUTA_POR_DEFECTO as RUTA_MAPA_TAGS
+from notificador_escaneo import EmisorEscaneo
+from registro_muestras import LectorMuestras
+
+def segundos_epoch(texto):
+    """'2026-01-05 08:00[:00]' (hora local) -> segundos epoch."""
+    return datetime.datetime.fromisoformat(texto).timestamp()
+
+class Reproductor:
+    """Publica registros de LectorMuestras en una ImagenProceso."""
+
+    def __init__(self, tags, imagen, emisor=None):
+        self.tags = tags
+        self.imagen = imagen
+        self.emisor = emisor
+        self.stats = {"aceptadas": 0, "error_crc": 0, "no_alcanzado": 0, "excepcion_esclavo": 0}
+        self._tags_por_tramo = {}
+
+    def tags_en_tramo(self, esclavo, funcion, inicio, cantidad):
+        """[(nombre, desplazamiento, cantidad)] de los tags que caen dentro del tramo leído."""
+        clave = (esclavo, funcion, inicio, cantidad)
+        tags = self._tags_por_tramo.get(clave)
+        if tags is None:
+            tags = [(tag.nombre, tag.direccion - inicio, tag.cantidad) for tag in self.tags
+                    if tag.esclavo == esclavo and tag.funcion == funcion
+                    and inicio <= tag.direccion and tag.direccion + tag.cantidad <= inicio + cantidad]
+            self._tags_por_tramo[clave] = tags
+        return tags
+
+    def publicar(self, registro):
+        esclavo, funcion = int(registro["esclavo"]), int(registro["funcion"])
+        inicio, cantidad = int(registro["inicio"]), int(registro["cantidad"])
+        estado = nombre_estado(int(registro["estado"]))
+        tags = self.tags_en_tramo(esclavo, funcion, inicio, cantidad)
+
+        valores = None
+        if estado == "OK":
+            self.stats["aceptadas"] += 1
+            registros = registro["registros"][:cantidad].tolist()
+            valores = {nombre: registros[d] if n == 1 else registros[d:d + n] for nombre, d, n in tags}
+        elif estado == "ERROR_CRC":
+            self.stats["error_crc"] += 1
+        elif estado == "ERROR_ESCLAVO":
+            self.stats["excepcion_esclavo"] += 1
+        else:
+            self.stats["no_alcanzado"] += 1
+
+        self.imagen.publicar(estado, self.stats, valores, [nombre for nombre, _, _ in tags])
+        if self.emisor is not None:
+            self.emisor.notificar(self.imagen.generacion())
+
+    def reproducir(self, lector, desde=None, hasta=None, velocidad=1.0):
+        """Recorre el rango respetando los intervalos originales / velocidad
+        (velocidad 0 = lo más rápido posible). Devuelve los escaneos publicados."""
+        publicados = 0
+        t0_grabado = t0_real = None
+        for bloque in lector.recorrer(desde, hasta):
+            for registro in bloque:
+                t = int(registro["t"])
+                if t0_grabado is None:
+                    t0_grabado, t0_real = t, time.monotonic()
+                    print(f"Reproduciendo desde {datetime.datetime.fromtimestamp(t / 1e9)}")
+                elif velocidad > 0:
+                    espera = t0_real + (t - t0_grabado) / 1e9 / velocidad - time.monotonic()
+                    if espera > 0:
+                        time.sleep(espera)
+                self.publicar(registro)
+                publicados += 1
+        return publicados
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Reproduce escaneos grabados en la imagen de proceso")
+    parser.add_argument("directorio", help="DIRECTORIO_MUESTRAS del maestro")
+    parser.add_argument("--velocidad", type=float, default=1.0,
+                        help="1 = ritmo original, 10 = diez veces más rápido, 0 = sin esperas")
+    parser.add_argument("--desde", type=segundos_epoch, help='Hora local, ej. "2026-01-05 08:00"')
+    parser.add_argument("--hasta", type=segundos_epoch)
+    parser.add_argument("--imagen", default=RUTA_POR_DEFECTO, help="Imagen de proceso a escribir")
+    parser.add_argument("--mapa", default=RUTA_MAPA_TAGS, help="Mapa de tags (el mismo del maestro)")
+    args = parser.parse_args()
+
+    tags = MapaTags.cargar(args.mapa).tags_sondeo()
+    imagen = ImagenProceso.crear(tags, args.imagen)
+    emisor = EmisorEscaneo()
+    reproductor = Reproductor(tags, imagen, emisor)
+    inicio = time.monotonic()
+    try:
+        n = reproductor.reproducir(LectorMuestras(args.directorio), args.desde, args.hasta, args.velocidad)
+        print(f"{n} escaneos reproducidos en {time.monotonic() - inicio:.1f} s")
+    except KeyboardInterrupt:
+        print("Reproducción interrumpida")
+    finally:
+        imagen.publicar("DETENIDO", reproductor.stats)
+        emisor.notificar(imagen.generacion())
+        emisor.cerrar()
+        imagen.cerrar()
@@ -0,0 +1,142 @@
+# ---------- Timeouts adaptativos y cuarentena de esclavos ----------
+#
+# Con TIMEOUT_ESPERA fijo, un esclavo desenchufado frena el bus un
+# timeout completo por intento. Por cada esclavo:
+#   - Se estima el tiempo de respuesta como el RTO de TCP (RFC 6298):
+#     SRTT y RTTVAR por EWMA, timeout = SRTT + max(G, 4·RTTVAR), acotado
+#     entre un mínimo y el timeout configurado. Los equipos sanos quedan
+#     con timeouts ajustados; un timeout duplica el RTO (hasta el máximo).
+#   - Tras N timeouts seguidos el esclavo entra en cuarentena: sus
+#     lecturas se saltean sin tocar el bus, salvo un sondeo de prueba
+#     espaciado con backoff exponencial. Si responde, vuelve al sondeo
+#     normal. En un bus multipunto, un nodo muerto no baja la tasa de
+#     sondeo de los demás.
+#
+# ---------------------------------------------------------------------
+
+import threading
+import time
+
+from reintentos import BackoffExponencial
+
+ALFA = 1 / 8
+BETA = 1 / 4
+K = 4
+GRANULARIDAD = 0.01       # s: latencia del adaptador USB / planificador del SO
+TIMEOUT_MINIMO = 0.05
+FALLOS_CUARENTENA = 3
+SONDEO_BASE = 1.0         # s hasta el primer sondeo de prueba
+SONDEO_MAXIMO = 60.0
+
+class EstimadorRTT:
+
+    def __init__(self, inicial, minimo=TIMEOUT_MINIMO, maximo=None):
+        self.minimo = minimo
+        self.maximo = maximo if maximo is not None else inicial
+        self.srtt = None
+        self.rttvar = None
+        self.rto = inicial
+
+    def muestra(self, rtt):
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar = (1 - BETA) * self.rttvar + BETA * abs(self.srtt - rtt)
+            self.srtt = (1 - ALFA) * self.srtt + ALFA * rtt
+        self.rto = min(self.maximo, max(self.minimo, self.srtt + max(GRANULARIDAD, K * self.rttvar)))
+
+    def expiro(self):
+        self.rto = min(self.maximo, 2 * self.rto)
+
+class _Esclavo:
+    def __init__(self, timeout_inicial, minimo, maximo, sondeo_base, sondeo_maximo):
+        self.rtt = EstimadorRTT(timeout_inicial, minimo, maximo)
+        self.fallos = 0
+        self.en_cuarentena = False
+        self.proximo_sondeo = 0.0
+        self.sondeando = False
+        self.backoff = BackoffExponencial(sondeo_base, sondeo_maximo)
+
+class SaludEsclavos:
+    """Estado de cada esclavo del bus. Se usa desde el hilo del bus."""
+
+    def __init__(self, timeout_inicial, minimo=TIMEOUT_MINIMO, maximo=None,
+                 fallos_cuarentena=FALLOS_CUARENTENA, sondeo_base=SONDEO_BASE,
+                 sondeo_maximo=SONDEO_MAXIMO, reloj=time.monotonic):
+        self._parametros = (timeout_inicial, minimo, maximo, sondeo_base, sondeo_maximo)
+        self.fallos_cuarentena = fallos_cuarentena
+        self.reloj = reloj
+        self._esclavos = {}
+        self._lock = threading.Lock()
+
+    def _esclavo(self, id_esclavo):
+        if id_esclavo not in self._esclavos:
+            self._esclavos[id_esclavo] = _Esclavo(*self._parametros)
+        return self._esclavos[id_esclavo]
+
+    def habilitado(self, id_esclavo):
+        """False si el esclavo está en cuarentena y todavía no toca sondearlo
+        (la transacción se saltea). Solo un sondeo de prueba a la vez."""
+        with self._lock:
+            esclavo = self._esclavo(id_esclavo)
+            if not esclavo.en_cuarentena:
+                return True
+            if esclavo.sondeando or self.reloj() < esclavo.proximo_sondeo:
+                return False
+            esclavo.sondeando = True
+            return True
+
+    def cancelar_sondeo(self, id_esclavo):
+        """La transacción habilitada no llegó a completarse (falló el puerto
+        o hubo un error interno): libera el sondeo de prueba sin contarlo."""
+        with self._lock:
+            self._esclavo(id_esclavo).sondeando = False
+
+    def proximo_sondeo(self, id_esclavo):
+        """Instante (reloj) del próximo sondeo de prueba; 0 si no está en cuarentena."""
+        with self._lock:
+            esclavo = self._esclavo(id_esclavo)
+            return esclavo.proximo_sondeo if esclavo.en_cuarentena else 0.0
+
+    def timeout(self, id_esclavo):
+        with self._lock:
+            return self._esclavo(id_esclavo).rtt.rto
+
+    def registrar(self, id_esclavo, estado, rtt):
+        """Resultado de una transacción. `rtt`: espera de la respuesta (s)."""
+        with self._lock:
+            esclavo = self._esclavo(id_esclavo)
+            esclavo.sondeando = False
+            if estado != "ERROR_TIMEOUT":
+                # Respondió (aunque sea con CRC malo o excepción): está vivo
+                if estado in ("OK", "ERROR_ESCLAVO"):
+                    esclavo.rtt.muestra(rtt)
+                esclavo.fallos = 0
+                if esclavo.en_cuarentena:
+                    esclavo.en_cuarentena = False
+                    esclavo.backoff.reiniciar()
+                    print(f"✅ Esclavo {id_esclavo} respondió: sale de cuarentena")
+                return
+
+            esclavo.rtt.expiro()
+            esclavo.fallos += 1
+            if esclavo.en_cuarentena or esclavo.fallos >= self.fallos_cuarentena:
+                espera = esclavo.backoff.siguiente()
+                esclavo.proximo_sondeo = self.reloj() + espera
+                if not esclavo.en_cuarentena:
+                    esclavo.en_cuarentena = True
+                    print(f"⚠️ Esclavo {id_esclavo} en cuarentena ({esclavo.fallos} timeouts seguidos); "
+                          f"próximo sondeo en {espera:.1f}s")
+
+    def en_cuarentena(self):
+        with self._lock:
+            return sorted(i for i, e in self._esclavos.items() if e.en_cuarentena)
+
+    def resumen(self):
+        """{id: (rto_ms, srtt_ms, en_cuarentena)}"""
+        with self._lock:
+            return {i: (round(1000 * e.rtt.rto, 1),
+                        round(1000 * e.rtt.srtt, 1) if e.rtt.srtt is not None else None,
+                        e.en_cuarentena)
+                    for i, e in self._esclavos.items()}
@@ -0,0 +1,179 @@
+# ---------- Fachada Modbus TCP sobre la caché del maestro ----------
+#
+# Para SCADA/HMI que solo hablan Modbus TCP: en vez de apuntarlos al
+# esclavo serie (un bus de 9600 baudios no aguanta varios clientes), se
+# les responde desde la última lectura del maestro:
+#   - FC03/FC04: desde la caché de registros que alimenta cada escaneo
+#     (solo las direcciones de TAGS_SONDEO; el resto da excepción 02).
+#     Si algún registro pedido tiene más de `max_edad` segundos, se
+#     responde excepción 0x0B (el dispositivo destino no responde).
+#   - FC05/FC06/FC16: se reenvían a la etapa de comandos del maestro
+#     (mismo camino que los comandos MQTT: último valor gana). Un FC16
+#     se parte en registros sueltos; al bus salen como FC06 salvo que
+#     el maestro tenga ESCRITURA_MULTIPLE (fusión en FC15/FC16).
+# El Unit ID de la cabecera MBAP es el ID del esclavo serie.
+#
+# ---------------------------------------------------------------------
+
+import asyncio
+import struct
+import threading
+import time
+
+from comandos_modbus import COIL, REGISTRO
+
+# Códigos de excepción Modbus
+EXCEPCION_FUNCION = 0x01
+EXCEPCION_DIRECCION = 0x02
+EXCEPCION_VALOR = 0x03
+EXCEPCION_DISPOSITIVO = 0x04
+EXCEPCION_SIN_CAMINO = 0x0A      # Gateway: Unit ID desconocido
+EXCEPCION_SIN_RESPUESTA = 0x0B   # Gateway: el esclavo no respondió (dato viejo)
+
+MAX_REGISTROS_LECTURA = 125
+MAX_REGISTROS_ESCRITURA = 123
+
+_mbap = struct.Struct(">HHHB")
+
+class ExcepcionModbus(Exception):
+    def __init__(self, codigo):
+        super().__init__(f"Excepción Modbus {codigo:#04x}")
+        self.codigo = codigo
+
+class CacheRegistros:
+    """
+    Último valor de cada registro sondeado, indexado por (esclavo, función
+    de lectura, dirección). al_escanear() tiene la firma de los oyentes
+    de publicar_escaneo() del maestro (usa los registros crudos, no los
+    valores de ingeniería).
+    """
+
+    def __init__(self, tags, max_edad=5.0, reloj=time.monotonic):
+        self.max_edad = max_edad
+        self.reloj = reloj
+        self._tags = {tag.nombre: tag for tag in tags}
+        self.esclavos = {tag.esclavo for tag in tags}
+        self._registros = {}
+        self._lock = threading.Lock()
+
+    def al_escanear(self, estado, valores, tags_leidos, stats, registros, timestamp_ns=None):
+        if not registros:
+            return
+        ahora = self.reloj()
+        with self._lock:
+            for nombre, valor in registros.items():
+                tag = self._tags.get(nombre)
+                if tag is None:
+                    continue
+                registros = valor if tag.cantidad > 1 else [valor]
+                for i, registro in enumerate(registros):
+                    self._registros[(tag.esclavo, tag.funcion, tag.direccion + i)] = (registro, ahora)
+
+    def leer(self, esclavo, funcion, inicio, cantidad):
+        """Lista de registros o ExcepcionModbus."""
+        ahora = self.reloj()
+        registros = []
+        with self._lock:
+            for direccion in range(inicio, inicio + cantidad):
+                entrada = self._registros.get((esclavo, funcion, direccion))
+                if entrada is None:
+                    if not any((t.esclavo, t.funcion) == (esclavo, funcion)
+                               and t.direccion <= direccion < t.direccion + t.cantidad
+                               for t in self._tags.values()):
+                        raise ExcepcionModbus(EXCEPCION_DIRECCION)
+                    raise ExcepcionModbus(EXCEPCION_SIN_RESPUESTA) # Sondeado, pero nunca leído
+                valor, instante = entrada
+                if self.max_edad is not None and ahora - instante > self.max_edad:
+                    raise ExcepcionModbus(EXCEPCION_SIN_RESPUESTA)
+                registros.append(valor)
+        return registros
+
+class ServidorModbusTCP:
+    """
+    cache: CacheRegistros.
+    escribir(esclavo, [(tipo, dirección, valor)]): corrutina que entrega las
+    escrituras al maestro (tipo COIL o REGISTRO); devuelve True cuando el
+    esclavo las confirmó, False si alguna falló, o lanza ExcepcionModbus.
+    unidad_por_defecto: esclavo al que van los Unit ID 0 y 255.
+    """
+
+    def __init__(self, cache, escribir, unidad_por_defecto=1):
+        self.cache = cache
+        self.escribir = escribir
+        self.unidad_por_defecto = unidad_por_defecto
+        self.clientes = 0
+        self.peticiones = 0
+        self._servidor = None
+
+    async def iniciar(self, direccion="0.0.0.0", puerto=5020):
+        self._servidor = await asyncio.start_server(self._atender, direccion, puerto)
+        print(f"Servidor Modbus TCP escuchando en {direccion}:{puerto}")
+        return self._servidor
+
+    def cerrar(self):
+        if self._servidor is not None:
+            self._servidor.close()
+
+    async def _atender(self, lector, escritor):
+        self.clientes += 1
+        try:
+            while True:
+                cabecera = await lector.readexactly(_mbap.size)
+                transaccion, protocolo, longitud, unidad = _mbap.unpack(cabecera)
+                if protocolo != 0 or not 2 <= longitud <= 254:
+                    break # No es Modbus TCP: cortamos la conexión
+                pdu = await lector.readexactly(longitud - 1)
+                respuesta = await self.procesar(unidad, pdu)
+                escritor.write(_mbap.pack(transaccion, 0, len(respuesta) + 1, unidad) + respuesta)
+                await escritor.drain()
+        except (asyncio.IncompleteReadError, OSError): # Incluye ConnectionError: solo cae este cliente
+            pass
+        finally:
+            self.clientes -= 1
+            escritor.close()
+
+    async def procesar(self, unidad, pdu):
+        """PDU de petición -> PDU de respuesta (normal o de excepción)."""
+        self.peticiones += 1
+        funcion = pdu[0]
+        try:
+            esclavo = self.unidad_por_defecto if unidad in (0, 255) else unidad
+            if esclavo not in self.cache.esclavos:
+                raise ExcepcionModbus(EXCEPCION_SIN_CAMINO)
+            if funcion in (0x03, 0x04):
+                return self._leer(esclavo, funcion, pdu)
+            if funcion in (0x05, 0x06, 0x10):
+                return await self._escribir(esclavo, funcion, pdu)
+            raise ExcepcionModbus(EXCEPCION_FUNCION)
+        except ExcepcionModbus as e:
+            return bytes([funcion | 0x80, e.codigo])
+        except (struct.error, IndexError):
+            return bytes([funcion | 0x80, EXCEPCION_VALOR]) # PDU truncada
+
+    def _leer(self, esclavo, funcion, pdu):
+        inicio, cantidad = struct.unpack(">HH", pdu[1:5])
+        if not 1 <= cantidad <= MAX_REGISTROS_LECTURA:
+            raise ExcepcionModbus(EXCEPCION_VALOR)
+        registros = self.cache.leer(esclavo, funcion, inicio, cantidad)
+        return struct.pack(f">BB{cantidad}H", funcion, 2 * cantidad, *registros)
+
+    async def _escribir(self, esclavo, funcion, pdu):
+        direccion, valor = struct.unpack(">HH", pdu[1:5])
+        if funcion == 0x05:
+            if valor not in (0x0000, 0xFF00):
+                raise ExcepcionModbus(EXCEPCION_VALOR)
+            escrituras = [(COIL, direccion, valor == 0xFF00)]
+            respuesta = pdu[:5] # Eco
+        elif funcion == 0x06:
+            escrituras = [(REGISTRO, direccion, valor)]
+            respuesta = pdu[:5]
+        else:
+            cantidad, n_bytes = valor, pdu[5]
+            if not 1 <= cantidad <= MAX_REGISTROS_ESCRITURA or n_bytes != 2 * cantidad:
+                raise ExcepcionModbus(EXCEPCION_VALOR)
+            valores = struct.unpack(f">{cantidad}H", pdu[6:6 + n_bytes])
+            escrituras = [(REGISTRO, direccion + i, v) for i, v in enumerate(valores)]
+            respuesta = pdu[:5]
+        if not await self.escribir(esclavo, escrituras):
+            raise ExcepcionModbus(EXCEPCION_DISPOSITIVO)
+        return respuesta
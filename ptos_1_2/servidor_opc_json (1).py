@@ -3,10 +3,39 @@ import json
 import os
 from opcua import Server, ua
 
+from imagen_proceso import ImagenProceso, RUTA_POR_DEFECTO
+from notificador_escaneo import ReceptorEscaneo, ReceptorInotify
+from historiador_opc import HistorialRing, instalar_historial
+from metricas_modbus import actualizar_nodos_diagnostico
+from mapa_tags import MapaTags, RUTA_POR_DEFECTO as RUTA_MAPA_TAGS, DISPOSITIVO_POR_DEFECTO
+from espacio_opc import EscritorValores, Variable, crear_espacio, tipo_variante, variables_mapa
+
 # --- 1. Configuración ---
-JSON_FILE = "datos_modbus.json" # El archivo que escribe el maestro Modbus
-POLL_INTERVAL = 1.0 # Cada cuánto leemos el archivo JSON (en segundos)
+FUENTE_DATOS = "memoria" # "memoria" (imagen de proceso compartida) o "json" (depuración)
+RUTA_IMAGEN_PROCESO = RUTA_POR_DEFECTO # La imagen que escribe el maestro Modbus
+JSON_FILE = "datos_modbus.json" # El archivo que escribe el maestro Modbus (EXPORTAR_JSON)
+POLL_INTERVAL = 1.0 # Máxima espera sin avisos del maestro antes de revisar el watchdog (s)
 JSON_TIMEOUT_SECS = 10.0 # Segundos para detectar un crash del Maestro Modbus
+PROFUNDIDAD_HISTORIAL = 36000 # Muestras guardadas por variable (HistoryRead Raw/Processed)
+DIRECTORIO_HISTORIAL = None # Ej. "historial_opc": buffers en archivos mapeados (None = solo RAM)
+ARCHIVO_MAPA_TAGS = RUTA_MAPA_TAGS # Mismo mapa que el maestro: un nodo por tag, con su tipo
+MAPA_TAGS = MapaTags.cargar(ARCHIVO_MAPA_TAGS)
+# Tipo OPC UA de cada nodo de tag (el mismo con el que se creó)
+TIPOS_VARIANTE = {definicion.clave: tipo_variante(MAPA_TAGS, definicion) for definicion in MAPA_TAGS}
+
+# Contadores y estados del gateway (en el dispositivo por defecto, donde los busca el bridge)
+VARIABLES_GATEWAY = [
+    Variable("ok", DISPOSITIVO_POR_DEFECTO, "Modbus_Aceptadas", 0, ua.VariantType.Int64),
+    Variable("crc", DISPOSITIVO_POR_DEFECTO, "Modbus_Error_CRC", 0, ua.VariantType.Int64),
+    Variable("nr", DISPOSITIVO_POR_DEFECTO, "Modbus_No_Alcanzado", 0, ua.VariantType.Int64),
+    Variable("exc", DISPOSITIVO_POR_DEFECTO, "Modbus_Excepcion_Esclavo", 0, ua.VariantType.Int64),
+    Variable("esclavo", DISPOSITIVO_POR_DEFECTO, "Modbus_Estado_Esclavo", "INICIANDO", ua.VariantType.String),
+    Variable("maestro", DISPOSITIVO_POR_DEFECTO, "Modbus_Estado_Maestro", "INICIANDO", ua.VariantType.String),
+]
+TIPOS_NODOS = {**TIPOS_VARIANTE, **{variable.clave: variable.tipo for variable in VARIABLES_GATEWAY}}
+# (clave OPC, nombre del tag en el escaneo) de cada tag de datos
+CLAVES_TAGS = [(definicion.clave, definicion.nombre) for definicion in MAPA_TAGS]
+CONTADORES = {"ok": "stats_aceptadas", "crc": "stats_crc", "nr": "stats_no_alcanzado", "exc": "stats_excepcion_esclavo"}
 
 def iniciar_servidor_opcua():
     """
@@ -17,65 +46,84 @@ def iniciar_servidor_opcua():
     
     url_servidor = "opc.tcp://0.0.0.0:4840/mi_servidor/"
     servidor.set_endpoint(url_servidor)
+    instalar_historial(servidor, HistorialRing(PROFUNDIDAD_HISTORIAL, DIRECTORIO_HISTORIAL))
     
     nombre_ns = "Servidor_MODBUS_Gateway"
     idx = servidor.register_namespace(nombre_ns)
     
-    objetos = servidor.get_objects_node()
-    mi_dispositivo = objetos.add_object(idx, "Dispositivo1")
-    
     # --- Creación de Nodos OPC UA ---
-    opc_potenciometro = mi_dispositivo.add_variable(idx, "Potenciometro", 0)
-    opc_ultrasonido = mi_dispositivo.add_variable(idx, "Distancia_Ultrasonido", 0)
-    opc_boton_1 = mi_dispositivo.add_variable(idx, "Boton_1", 0)
-    opc_boton_2 = mi_dispositivo.add_variable(idx, "Boton_2", 0)
-    
-    opc_modbus_aceptadas = mi_dispositivo.add_variable(idx, "Modbus_Aceptadas", 0)
-    opc_modbus_error_crc = mi_dispositivo.add_variable(idx, "Modbus_Error_CRC", 0)
-    opc_modbus_no_alcanzado = mi_dispositivo.add_variable(idx, "Modbus_No_Alcanzado", 0)
+    # Un objeto por dispositivo y un nodo por tag del mapa (con su tipo,
+    # unidad y rango), más los contadores y estados del gateway
+    opc_nodes, dispositivos = crear_espacio(servidor, idx, variables_mapa(MAPA_TAGS) + VARIABLES_GATEWAY)
     
-    # --- ¡CAMBIOS AQUÍ! Dos tags de estado separados ---
-    opc_modbus_estado_esclavo = mi_dispositivo.add_variable(idx, "Modbus_Estado_Esclavo", "INICIANDO")
-    opc_modbus_estado_maestro = mi_dispositivo.add_variable(idx, "Modbus_Estado_Maestro", "INICIANDO")
-    # ------------------------------------------------
-    
-    nodos_lista = [opc_potenciometro, opc_ultrasonido, opc_boton_1, opc_boton_2, 
-                   opc_modbus_aceptadas, opc_modbus_error_crc, 
-                   opc_modbus_no_alcanzado, 
-                   opc_modbus_estado_esclavo, # <-- Añadido
-                   opc_modbus_estado_maestro  # <-- Añadido
-                   ]
-                   
-    for nodo in nodos_lista:
-        nodo.set_writable(False) 
-        permiso_lectura = ua.DataValue(ua.AccessLevel.CurrentRead.mask)
-        nodo.set_attribute(ua.AttributeIds.UserAccessLevel, permiso_lectura)
+    # Variables de diagnóstico del maestro (se crean al llegar las métricas)
+    opc_nodes["diagnostico"] = dispositivos[DISPOSITIVO_POR_DEFECTO].add_object(idx, "Diagnostico_Modbus")
     
     servidor.start()
-    print(f"--- Servidor OPC UA iniciado en {url_servidor} ---")
+    print(f"--- Servidor OPC UA iniciado en {url_servidor}: {len(dispositivos)} dispositivos, "
+          f"{len(TIPOS_NODOS)} variables ---")
     
-    # Devolvemos un diccionario de nodos para fácil acceso
-    opc_nodes = {
-        "pot": opc_potenciometro,
-        "ultra": opc_ultrasonido,
-        "btn1": opc_boton_1,
-        "btn2": opc_boton_2,
-        "ok": opc_modbus_aceptadas,
-        "crc": opc_modbus_error_crc,
-        "nr": opc_modbus_no_alcanzado,
-        "esclavo": opc_modbus_estado_esclavo, # <-- Nuevo
-        "maestro": opc_modbus_estado_maestro  # <-- Nuevo
-    }
+    # Historial de las variables numéricas (los estados son texto)
+    historizados = [definicion.clave for definicion in MAPA_TAGS if definicion.historial] + list(CONTADORES)
+    for clave in historizados:
+        servidor.historize_node_data_change(opc_nodes[clave], count=PROFUNDIDAD_HISTORIAL)
     
     return servidor, opc_nodes
 
-# --- Bucle Principal (Lee JSON y actualiza OPC) ---
+imagen = None
+decodificador = None # Registros crudos de la imagen -> valores de ingeniería
+
+def leer_datos():
+    """
+    Devuelve el último escaneo publicado por el maestro como diccionario
+    (misma forma que datos_modbus.json). Lanza FileNotFoundError si el
+    maestro todavía no creó la imagen / el archivo.
+    """
+    global imagen, decodificador
+    if FUENTE_DATOS == "json":
+        with open(JSON_FILE, 'r') as f:
+            return json.load(f)
+
+    if imagen is not None and not imagen.vigente():
+        # El maestro se reinició y recreó la imagen: volvemos a mapearla
+        imagen.cerrar()
+        imagen = None
+    if imagen is None:
+        imagen = ImagenProceso.abrir(RUTA_IMAGEN_PROCESO)
+        decodificador = imagen.decodificador_imagen(MAPA_TAGS)
+        print(f"Imagen de proceso mapeada desde {RUTA_IMAGEN_PROCESO}")
+    return imagen.leer(decodificador)
+
+nodos_diagnostico = {}
+
+def actualizar_diagnostico(opc_nodes, receptor):
+    """Vuelca a OPC las últimas métricas que mandó el maestro (si llegaron
+    nuevas) por el canal de avisos de escaneo."""
+    metricas = receptor.tomar_metricas()
+    if metricas is not None:
+        actualizar_nodos_diagnostico(opc_nodes["diagnostico"], nodos_diagnostico, metricas)
+
+def crear_receptor():
+    """Canal por el que el maestro nos avisa de cada escaneo nuevo.
+    En modo JSON, si no hay aviso por socket, se vigila el archivo con inotify."""
+    if FUENTE_DATOS == "json":
+        try:
+            return ReceptorInotify(JSON_FILE)
+        except (OSError, AttributeError, TypeError) as e:
+            print(f"inotify no disponible ({e}), usando el socket de notificación")
+    return ReceptorEscaneo()
+
+# --- Bucle Principal (Lee la imagen de proceso y actualiza OPC) ---
 if __name__ == "__main__":
     
     servidor_opc, opc_nodes = iniciar_servidor_opcua()
+    escritor = EscritorValores(servidor_opc, opc_nodes, TIPOS_NODOS)
+    receptor = crear_receptor()
     
     estado_maestro_cache = "" # Cache para el estado del maestro
     estado_esclavo_cache = "" # Cache para el estado del esclavo
+    generacion_cache = None # Último escaneo volcado a los nodos OPC
+    marcas_cache = {} # Adquisición (ns) de cada tag ya volcado
     
     try:
         while True:
@@ -84,9 +132,8 @@ if __name__ == "__main__":
             estado_esclavo_actual = ""
             
             try:
-                # 1. Intentar leer el archivo JSON
-                with open(JSON_FILE, 'r') as f:
-                    datos = json.load(f)
+                # 1. Leer el último escaneo del maestro
+                datos = leer_datos()
                 
                 # --- INICIO DEL CAMBIO: Lógica de Vigilante ---
                 
@@ -109,35 +156,51 @@ if __name__ == "__main__":
                 # 3. Obtener el estado del Esclavo Modbus (Hardware)
                 estado_esclavo_actual = estado_esclavo_json
                 
-                # 4. Actualizar tags OPC solo si hay cambios
+                # 4. Estados (se informan solo los cambios)
                 if estado_maestro_actual != estado_maestro_cache:
-                    opc_nodes["maestro"].set_value(estado_maestro_actual)
                     estado_maestro_cache = estado_maestro_actual
                     print(f"Estado Maestro Modbus (Script 1) -> {estado_maestro_actual}")
 
                 if estado_esclavo_actual != estado_esclavo_cache:
-                    opc_nodes["esclavo"].set_value(estado_esclavo_actual)
                     estado_esclavo_cache = estado_esclavo_actual
                     print(f"Estado Esclavo Modbus (Hardware) -> {estado_esclavo_actual}")
 
-                # 5. Actualizar datos (solo si el esclavo está OK)
-                if estado_esclavo_actual == "OK":
-                    opc_nodes["pot"].set_value(datos.get("potenciometro", 0))
-                    opc_nodes["ultra"].set_value(datos.get("ultrasonido", 0))
-                    opc_nodes["btn1"].set_value(datos.get("boton_1", 0))
-                    opc_nodes["btn2"].set_value(datos.get("boton_2", 0))
-                    opc_nodes["ok"].set_value(datos.get("stats_aceptadas", 0))
-                    opc_nodes["crc"].set_value(datos.get("stats_crc", 0))
-                    opc_nodes["nr"].set_value(datos.get("stats_no_alcanzado", 0))
+                # 5. Volcar el escaneo: una sola escritura con lo que cambió.
+                # Solo van los tags leídos desde la última pasada (su marca de
+                # adquisición avanzó): los de un esclavo que no respondió
+                # conservan su último valor y su SourceTimestamp.
+                cambios = {"maestro": estado_maestro_actual, "esclavo": estado_esclavo_actual}
+                timestamps = None
+                generacion = datos.get("generacion")
+                escaneo_nuevo = generacion is None or generacion != generacion_cache
+                generacion_cache = generacion
+                if escaneo_nuevo:
+                    cambios.update({clave: datos.get(campo, 0) for clave, campo in CONTADORES.items()})
+                    # SourceTimestamp: adquisición de cada tag (traza de latencia)
+                    marcas = datos.get("timestamps_tag")
+                    if marcas is None: # JSON de depuración: sin marcas por tag
+                        # Solo trae los tags si el escaneo fue OK; si no, se
+                        # conserva el último valor (no se escribe un 0)
+                        leidos = [(clave, nombre) for clave, nombre in CLAVES_TAGS
+                                  if estado_esclavo_json == "OK" and nombre in datos]
+                        timestamps = {clave: datos.get("timestamp_ns") for clave, _ in leidos}
+                    else:
+                        leidos = [(clave, nombre) for clave, nombre in CLAVES_TAGS
+                                  if marcas.get(nombre) and marcas[nombre] != marcas_cache.get(nombre)]
+                        marcas_cache.update(marcas)
+                        timestamps = {clave: marcas[nombre] for clave, nombre in leidos}
+                    cambios.update({clave: datos.get(nombre, 0) for clave, nombre in leidos})
+                escritor.escribir(cambios, timestamps)
+                
+                actualizar_diagnostico(opc_nodes, receptor)
                 
                 # --- FIN DEL CAMBIO ---
                 
             except FileNotFoundError:
                 estado_maestro_actual = "NO_INICIADO"
                 if estado_maestro_cache != estado_maestro_actual:
-                    print(f"Esperando a que {JSON_FILE} sea creado por el script Modbus...")
-                    opc_nodes["maestro"].set_value(estado_maestro_actual)
-                    opc_nodes["esclavo"].set_value(estado_maestro_actual)
+                    print("Esperando a que el script Modbus publique la imagen de proceso...")
+                    escritor.escribir({"maestro": estado_maestro_actual, "esclavo": estado_maestro_actual})
                     estado_maestro_cache = estado_maestro_actual
                     estado_esclavo_cache = estado_maestro_actual
 
@@ -146,8 +209,11 @@ if __name__ == "__main__":
             except Exception as e:
                 print(f"Error inesperado leyendo JSON: {e}")
             
-            time.sleep(POLL_INTERVAL) # Esperamos antes de la siguiente lectura
+            # Dormimos hasta que el maestro publique un escaneo nuevo
+            # (como mucho POLL_INTERVAL, para que el watchdog siga corriendo)
+            receptor.esperar(POLL_INTERVAL)
                 
     except KeyboardInterrupt:
         print("Cerrando servidor OPC UA...")
+        receptor.cerrar()
         servidor_opc.stop()
\ No newline at end of file
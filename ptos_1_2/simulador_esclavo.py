@@ -0,0 +1,201 @@
+# ---------- Esclavo Modbus RTU simulado sobre un pseudo-terminal ----------
+#
+# Reemplazo de esclavo_integrador.ino para probar y medir el maestro sin
+# Arduino ni adaptador RS-485. Abre un par pty: el simulador atiende el
+# lado "maestro" del pty y el maestro Modbus abre el lado esclavo
+# (`simulador.puerto`, p. ej. /dev/pts/5) como un puerto serie normal.
+#
+# Mismo mapa que el Arduino, por cada ID de esclavo configurado:
+#   - Registros 0-3: potenciómetro, distancia, botón 1, botón 2 (simulados).
+#   - Registro 4: brillo del LED (0-255). Bobina 0: LED ON/OFF (255/0).
+#   - FC03 (y FC04 sobre el mismo mapa), FC05, FC06, FC15, FC16.
+#     Dirección fuera de rango -> excepción 02; función desconocida -> 01.
+#
+# Fallas configurables: retardo de respuesta, CRC corrupto y respuestas
+# descartadas (con probabilidad), y tiempo de bus según los baudios
+# (el pty es instantáneo; se agrega el tiempo que ocuparían en el cable
+# la petición y la respuesta, para que el benchmark por baudios tenga
+# sentido).
+#
+# Uso: python simulador_esclavo.py [--ids 1 2] [--baudios 9600] [--retardo 0.005]
+# ---------------------------------------------------------------------
+
+import argparse
+import math
+import os
+import random
+import select
+import struct
+import threading
+import time
+import tty
+
+from crc_modbus import agregar_crc, verificar_crc
+from receptor_rtu import tiempo_trama, tiempos_silencio
+
+CANTIDAD_REGISTROS = 10 # holdingRegs[10] del Arduino
+REGISTRO_LED = 4
+COIL_LED = 0
+
+EXCEPCION_FUNCION = 0x01
+EXCEPCION_DIRECCION = 0x02
+
+class EsclavoSimulado:
+
+    def __init__(self, ids=(1,), baudios=9600, retardo=0.0, prob_crc=0.0,
+                 prob_descarte=0.0, semilla=None, sensores_vivos=True):
+        self.ids = set(ids)
+        self.baudios = baudios
+        self.retardo = retardo
+        self.prob_crc = prob_crc
+        self.prob_descarte = prob_descarte
+        self.sensores_vivos = sensores_vivos
+        self.azar = random.Random(semilla)
+        self.registros = {i: [0] * CANTIDAD_REGISTROS for i in self.ids}
+        self.silenciado_hasta = 0.0
+        self.atendidas = 0
+
+        self._fd, fd_esclavo = os.openpty()
+        tty.setraw(fd_esclavo)
+        self.puerto = os.ttyname(fd_esclavo)
+        self._fd_esclavo = fd_esclavo # Abierto para que el pty no se cierre sin cliente
+        self._detener = threading.Event()
+        self._hilo = None
+
+    # --- Control ---
+    def silenciar(self, segundos):
+        """No responde a nada durante `segundos` (esclavo caído / cable cortado)."""
+        self.silenciado_hasta = time.monotonic() + segundos
+
+    def iniciar(self):
+        self._hilo = threading.Thread(target=self._bucle, name="esclavo-simulado", daemon=True)
+        self._hilo.start()
+        return self
+
+    def cerrar(self):
+        self._detener.set()
+        if self._hilo is not None:
+            self._hilo.join(timeout=1.0)
+        os.close(self._fd)
+        os.close(self._fd_esclavo)
+
+    # --- Sensores simulados ---
+    def _actualizar_sensores(self, id_esclavo):
+        if not self.sensores_vivos:
+            return
+        t = time.monotonic()
+        regs = self.registros[id_esclavo]
+        regs[0] = int(512 + 511 * math.sin(t / 5.0))      # analogRead(PIN_POT)
+        regs[1] = int(100 + 80 * math.sin(t / 3.0))       # distancia en cm
+        regs[2] = int(t) % 4 == 0                          # botones (activos en bajo)
+        regs[3] = int(t) % 6 == 0
+
+    # --- Recepción por longitud (como el Arduino: basura -> se resincroniza) ---
+    def _bucle(self):
+        buffer = bytearray()
+        t35 = tiempos_silencio(self.baudios)[1]
+        while not self._detener.is_set():
+            listos, _, _ = select.select([self._fd], [], [], 0.05 if not buffer else max(t35, 0.002))
+            if not listos:
+                buffer.clear() # Silencio t3.5: fin de trama (o basura descartada)
+                continue
+            try:
+                buffer += os.read(self._fd, 256)
+            except OSError:
+                return
+            while len(buffer) >= 8:
+                longitud = _longitud_peticion(buffer)
+                if longitud is None or len(buffer) < longitud:
+                    break
+                trama = bytes(buffer[:longitud])
+                if verificar_crc(trama):
+                    del buffer[:longitud]
+                    self._responder(trama)
+                else:
+                    del buffer[0] # Resincronizar byte a byte
+
+    def _responder(self, trama):
+        id_esclavo = trama[0]
+        if id_esclavo not in self.ids or time.monotonic() < self.silenciado_hasta:
+            return
+        respuesta = self._procesar(id_esclavo, trama)
+        self.atendidas += 1
+        if self.azar.random() < self.prob_descarte:
+            return
+        if self.azar.random() < self.prob_crc:
+            respuesta = respuesta[:-1] + bytes([respuesta[-1] ^ 0xFF])
+
+        # Tiempo de bus de petición + respuesta y tiempo de proceso del esclavo
+        espera = self.retardo + tiempo_trama(self.baudios, len(trama) + len(respuesta))
+        if espera > 0:
+            time.sleep(espera)
+        os.write(self._fd, respuesta)
+
+    def _procesar(self, id_esclavo, trama):
+        funcion = trama[1]
+        regs = self.registros[id_esclavo]
+        inicio, valor = struct.unpack('>HH', trama[2:6])
+
+        if funcion in (0x03, 0x04):
+            if valor == 0 or inicio + valor > CANTIDAD_REGISTROS:
+                return _excepcion(id_esclavo, funcion, EXCEPCION_DIRECCION)
+            self._actualizar_sensores(id_esclavo)
+            datos = struct.pack(f'>{valor}H', *regs[inicio:inicio + valor])
+            return agregar_crc(bytes([id_esclavo, funcion, len(datos)]) + datos)
+
+        if funcion == 0x05:
+            if inicio != COIL_LED:
+                return _excepcion(id_esclavo, funcion, EXCEPCION_DIRECCION)
+            regs[REGISTRO_LED] = 255 if valor == 0xFF00 else 0
+            return trama # Eco
+
+        if funcion == 0x06:
+            if inicio >= CANTIDAD_REGISTROS:
+                return _excepcion(id_esclavo, funcion, EXCEPCION_DIRECCION)
+            regs[inicio] = min(valor, 255) if inicio == REGISTRO_LED else valor
+            return trama # Eco
+
+        if funcion == 0x0F:
+            if inicio + valor > COIL_LED + 1:
+                return _excepcion(id_esclavo, funcion, EXCEPCION_DIRECCION)
+            regs[REGISTRO_LED] = 255 if trama[7] & 0x01 else 0
+            return agregar_crc(trama[:6])
+
+        if funcion == 0x10:
+            if inicio + valor > CANTIDAD_REGISTROS:
+                return _excepcion(id_esclavo, funcion, EXCEPCION_DIRECCION)
+            regs[inicio:inicio + valor] = struct.unpack(f'>{valor}H', trama[7:7 + 2 * valor])
+            return agregar_crc(trama[:6])
+
+        return _excepcion(id_esclavo, funcion, EXCEPCION_FUNCION)
+
+# --- Auxiliares ---
+def _longitud_peticion(buffer):
+    """Longitud (con CRC) de la petición que empieza en buffer[0]."""
+    if buffer[1] in (0x0F, 0x10):
+        return 9 + buffer[6] if len(buffer) > 6 else None
+    return 8
+
+def _excepcion(id_esclavo, funcion, codigo):
+    return agregar_crc(bytes([id_esclavo, funcion | 0x80, codigo]))
+
+# --- Uso como proceso aparte ---
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Esclavo Modbus RTU simulado sobre un pty")
+    parser.add_argument("--ids", type=int, nargs="+", default=[1])
+    parser.add_argument("--baudios", type=int, default=9600)
+    parser.add_argument("--retardo", type=float, default=0.0, help="s de proceso antes de responder")
+    parser.add_argument("--prob-crc", type=float, default=0.0)
+    parser.add_argument("--prob-descarte", type=float, default=0.0)
+    args = parser.parse_args()
+
+    simulador = EsclavoSimulado(args.ids, args.baudios, args.retardo,
+                                args.prob_crc, args.prob_descarte).iniciar()
+    print(f"Esclavo(s) {sorted(simulador.ids)} escuchando en {simulador.puerto} "
+          f"(usar como PUERTO_SERIAL del maestro)")
+    try:
+        while True:
+            time.sleep(1.0)
+    except KeyboardInterrupt:
+        print(f"Cerrando simulador ({simulador.atendidas} peticiones atendidas)")
+        simulador.cerrar()
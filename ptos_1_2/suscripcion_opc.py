@@ -0,0 +1,94 @@
+# ---------- Modo suscripción del bridge OPC UA → MQTT ----------
+#
+# En vez de hacer un get_value() por nodo en cada ciclo, el bridge crea
+# una suscripción OPC UA: el servidor muestrea los nodos y solo nos
+# notifica los cambios, agrupados en un mensaje por intervalo de
+# publicación. Sobre eso aplicamos una banda muerta (absoluta y/o
+# porcentual) por tag antes de publicar en MQTT.
+#
+# ---------------------------------------------------------------------
+
+import threading
+
+from opcua import ua
+
+def supera_banda(anterior, nuevo, absoluta=0.0, porcentual=0.0):
+    """
+    True si `nuevo` debe publicarse. Sin valor anterior, o con valores no
+    numéricos (estados), cualquier cambio se publica. Con números, el
+    cambio tiene que superar las dos bandas configuradas.
+    """
+    if anterior is None:
+        return True
+    numericos = (isinstance(anterior, (int, float)) and isinstance(nuevo, (int, float))
+                 and not isinstance(nuevo, bool))
+    if not numericos:
+        return nuevo != anterior
+    delta = abs(nuevo - anterior)
+    if delta == 0:
+        return False
+    return delta > absoluta and delta > abs(anterior) * porcentual / 100.0
+
+class PublicadorCambios:
+    """
+    Handler de suscripción de python-opcua.
+    publicar(clave, valor, data) se llama solo para los cambios que
+    superan la banda muerta del tag; observar(clave, valor, data), si se
+    pasa, ve todas las notificaciones (p. ej. para agregarlas).
+    """
+
+    def __init__(self, publicar, bandas=None, observar=None):
+        self.publicar = publicar
+        self.bandas = bandas or {}
+        self.observar = observar
+        self.ultimos = {}
+        self._claves = {}  # nodeid -> clave del tag
+        self._lock = threading.Lock()
+
+    def registrar(self, clave, nodo):
+        self._claves[nodo.nodeid] = clave
+
+    def olvidar_valores(self):
+        """Tras reconectar, el primer valor de cada tag se vuelve a publicar."""
+        with self._lock:
+            self.ultimos.clear()
+
+    # --- Callbacks de python-opcua (hilo de la suscripción) ---
+    def datachange_notification(self, node, val, data):
+        clave = self._claves.get(node.nodeid)
+        if clave is None:
+            return
+        if self.observar is not None:
+            self.observar(clave, val, data)
+        absoluta, porcentual = self.bandas.get(clave, (0.0, 0.0))
+        with self._lock:
+            if not supera_banda(self.ultimos.get(clave), val, absoluta, porcentual):
+                return
+            self.ultimos[clave] = val
+        self.publicar(clave, val, data)
+
+    def event_notification(self, event):
+        pass
+
+    def status_change_notification(self, status):
+        print(f"⚠️ Estado de la suscripción OPC: {status}")
+
+def suscribir(client, nodes_opc, handler, periodo_publicacion_ms, muestreo_ms):
+    """
+    Crea la suscripción y monitorea todos los nodos en un único
+    CreateMonitoredItems, con el intervalo de muestreo pedido (python-opcua
+    por defecto lo iguala al de publicación). Devuelve la suscripción.
+    """
+    handler.olvidar_valores()
+    suscripcion = client.create_subscription(periodo_publicacion_ms, handler)
+    peticiones = []
+    for clave, nodo in nodes_opc.items():
+        handler.registrar(clave, nodo)
+        peticion = suscripcion._make_monitored_item_request(nodo, ua.AttributeIds.Value, None, 0)
+        peticion.RequestedParameters.SamplingInterval = muestreo_ms
+        peticiones.append(peticion)
+    resultados = suscripcion.create_monitored_items(peticiones)
+    fallidos = [clave for clave, r in zip(nodes_opc, resultados) if not isinstance(r, int)]
+    if fallidos:
+        print(f"⚠️ No se pudieron monitorear: {fallidos}")
+    return suscripcion
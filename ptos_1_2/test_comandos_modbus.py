@@ -0,0 +1,157 @@
+# ---------- Pruebas de la etapa de comandos ----------
+#
+# Fusión de escrituras contiguas (y no de las que tienen huecos), lotes
+# FC15/FC16 acotados, "último valor gana" y el traspaso de la
+# confirmación (Future) entre el que escribe y el vaciado del bus.
+#
+# Uso: python -m pytest test_comandos_modbus.py
+# ---------------------------------------------------------------------
+
+import unittest
+
+from comandos_modbus import COIL, REGISTRO, EtapaComandos, Escritura, estado_escritura
+from tramas_modbus import (
+    FUNCION_ESCRIBIR_COIL, FUNCION_ESCRIBIR_REGISTRO,
+    FUNCION_ESCRIBIR_COILS, FUNCION_ESCRIBIR_REGISTROS,
+    MAX_COILS_POR_ESCRITURA, MAX_REGISTROS_POR_ESCRITURA,
+)
+
+class PruebaFusion(unittest.TestCase):
+
+    def test_contiguos_en_un_fc16(self):
+        etapa = EtapaComandos()
+        for direccion, valor in ((12, 3), (10, 1), (11, 2)):
+            etapa.escribir_registro(1, direccion, valor)
+        lote, _ = etapa.tomar_lote()
+        self.assertEqual(lote, [Escritura(FUNCION_ESCRIBIR_REGISTROS, 1, 10, (1, 2, 3))])
+
+    def test_hueco_no_se_fusiona(self):
+        etapa = EtapaComandos()
+        for direccion in (0, 1, 3):
+            etapa.escribir_registro(1, direccion, direccion)
+        lote, _ = etapa.tomar_lote()
+        self.assertEqual(lote, [Escritura(FUNCION_ESCRIBIR_REGISTROS, 1, 0, (0, 1)),
+                                Escritura(FUNCION_ESCRIBIR_REGISTRO, 1, 3, (3,))])
+
+    def test_otro_esclavo_u_otro_tipo_no_se_fusiona(self):
+        etapa = EtapaComandos()
+        etapa.escribir_registro(1, 0, 7)
+        etapa.escribir_registro(2, 1, 8)
+        etapa.escribir_coil(1, 1, True)
+        lote, _ = etapa.tomar_lote()
+        self.assertEqual(sorted(lote), sorted([
+            Escritura(FUNCION_ESCRIBIR_REGISTRO, 1, 0, (7,)),
+            Escritura(FUNCION_ESCRIBIR_REGISTRO, 2, 1, (8,)),
+            Escritura(FUNCION_ESCRIBIR_COIL, 1, 1, (True,)),
+        ]))
+
+    def test_coils_contiguas_en_un_fc15(self):
+        etapa = EtapaComandos()
+        for direccion in range(4):
+            etapa.escribir_coil(1, direccion, direccion % 2)
+        lote, _ = etapa.tomar_lote()
+        self.assertEqual(lote, [Escritura(FUNCION_ESCRIBIR_COILS, 1, 0, (False, True, False, True))])
+
+    def test_lote_partido_en_el_maximo(self):
+        etapa = EtapaComandos()
+        for direccion in range(MAX_REGISTROS_POR_ESCRITURA + 1):
+            etapa.escribir_registro(1, direccion, 0)
+        for direccion in range(MAX_COILS_POR_ESCRITURA + 1):
+            etapa.escribir_coil(1, direccion, True)
+        lote, _ = etapa.tomar_lote()
+        self.assertEqual([(e.funcion, e.inicio, len(e.valores)) for e in lote], [
+            (FUNCION_ESCRIBIR_COILS, 0, MAX_COILS_POR_ESCRITURA),
+            (FUNCION_ESCRIBIR_COIL, MAX_COILS_POR_ESCRITURA, 1),
+            (FUNCION_ESCRIBIR_REGISTROS, 0, MAX_REGISTROS_POR_ESCRITURA),
+            (FUNCION_ESCRIBIR_REGISTRO, MAX_REGISTROS_POR_ESCRITURA, 1),
+        ])
+
+    def test_sin_escritura_multiple_solo_fc05_fc06(self):
+        etapa = EtapaComandos(escritura_multiple=False)
+        for direccion in range(3):
+            etapa.escribir_registro(1, direccion, direccion)
+            etapa.escribir_coil(1, direccion, True)
+        lote, _ = etapa.tomar_lote()
+        self.assertEqual(len(lote), 6)
+        self.assertTrue(all(e.funcion in (FUNCION_ESCRIBIR_COIL, FUNCION_ESCRIBIR_REGISTRO) for e in lote))
+
+    def test_registro_fuera_de_rango(self):
+        etapa = EtapaComandos()
+        with self.assertRaises(ValueError):
+            etapa.escribir_registro(1, 0, 0x10000)
+        self.assertEqual(etapa.pendientes(), 0)
+
+class PruebaUltimoValorGana(unittest.TestCase):
+
+    def test_colapsa_al_ultimo_valor(self):
+        etapa = EtapaComandos()
+        for valor in (10, 20, 30):
+            etapa.escribir_registro(1, 4, valor)
+        self.assertEqual(etapa.pendientes(), 1)
+        self.assertEqual(etapa.colapsadas, 2)
+        lote, _ = etapa.tomar_lote()
+        self.assertEqual(lote, [Escritura(FUNCION_ESCRIBIR_REGISTRO, 1, 4, (30,))])
+
+    def test_tomar_lote_vacia_la_etapa(self):
+        etapa = EtapaComandos()
+        etapa.escribir_coil(1, 0, True)
+        etapa.tomar_lote()
+        self.assertEqual(etapa.pendientes(), 0)
+        self.assertEqual(etapa.tomar_lote()[0], [])
+
+class PruebaConfirmacion(unittest.TestCase):
+
+    def test_un_vaciado_por_lote(self):
+        etapa = EtapaComandos()
+        programar, confirmacion = etapa.escribir_registro(1, 0, 1)
+        programar_2, confirmacion_2 = etapa.escribir_coil(1, 0, True)
+        self.assertTrue(programar)
+        self.assertFalse(programar_2) # Se suma al vaciado ya programado
+        self.assertIs(confirmacion_2, confirmacion)
+
+        lote, del_lote = etapa.tomar_lote()
+        self.assertIs(del_lote, confirmacion)
+        resultados = [(escritura, "OK") for escritura in lote]
+        del_lote.set_result(resultados)
+        self.assertEqual(estado_escritura(confirmacion.result(0), 1, REGISTRO, 0), "OK")
+        self.assertEqual(estado_escritura(confirmacion.result(0), 1, COIL, 0), "OK")
+        self.assertIsNone(estado_escritura(confirmacion.result(0), 1, REGISTRO, 5))
+
+    def test_escritura_durante_el_vaciado_va_al_proximo(self):
+        etapa = EtapaComandos()
+        _, primera = etapa.escribir_registro(1, 0, 1)
+        etapa.tomar_lote()
+        programar, segunda = etapa.escribir_registro(1, 0, 2)
+        self.assertTrue(programar)
+        self.assertIsNot(segunda, primera)
+
+    def test_estado_dentro_de_un_fc16(self):
+        etapa = EtapaComandos()
+        for direccion in range(3):
+            _, confirmacion = etapa.escribir_registro(1, direccion, direccion)
+        lote, _ = etapa.tomar_lote()
+        confirmacion.set_result([(lote[0], "ERROR_TIMEOUT")])
+        self.assertEqual(estado_escritura(confirmacion.result(0), 1, REGISTRO, 2), "ERROR_TIMEOUT")
+
+    def test_liberar_vaciado_falla_la_confirmacion(self):
+        etapa = EtapaComandos()
+        _, confirmacion = etapa.escribir_registro(1, 0, 1)
+        etapa.liberar_vaciado(confirmacion)
+        with self.assertRaises(ConnectionError):
+            confirmacion.result(0)
+        self.assertEqual(etapa.pendientes(), 1) # La escritura se conserva
+        programar, nueva = etapa.escribir_registro(1, 1, 1)
+        self.assertTrue(programar)
+        self.assertIsNot(nueva, confirmacion)
+
+    def test_liberar_vaciado_ajeno_no_hace_nada(self):
+        etapa = EtapaComandos()
+        _, vieja = etapa.escribir_registro(1, 0, 1)
+        etapa.tomar_lote()
+        _, actual = etapa.escribir_registro(1, 0, 2)
+        etapa.liberar_vaciado(vieja)
+        self.assertFalse(actual.done())
+        self.assertFalse(etapa.escribir_registro(1, 1, 3)[0])
+
+if __name__ == "__main__":
+    unittest.main()
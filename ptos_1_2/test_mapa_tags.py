@@ -0,0 +1,88 @@
+# ---------- Pruebas del decodificador del mapa de tags ----------
+#
+# Orden de palabras de los tipos de 32 bits, campos de bits, escala y
+# offset, y que los bytes de la respuesta y los registros ya separados
+# (imagen de proceso) decodifiquen igual.
+#
+# Uso: python -m pytest test_mapa_tags.py
+# ---------------------------------------------------------------------
+
+import struct
+import unittest
+
+from mapa_tags import MapaTags, _definicion, struct_registros
+
+def mapa(*entradas):
+    return MapaTags([_definicion({"esclavo": 1, **entrada}) for entrada in entradas])
+
+def registros_de(formato, valor):
+    """Registros big-endian (ABCD) de un valor de 32 bits."""
+    return list(struct.unpack(">HH", struct.pack(formato, valor)))
+
+class PruebaDecodificador(unittest.TestCase):
+
+    def decodificar(self, tags, registros):
+        """Decodifica por los dos caminos y verifica que coincidan."""
+        decodificador = tags.decodificador([(d.nombre, d.direccion) for d in tags], len(registros))
+        desde_registros = list(decodificador.decodificar_registros(registros))
+        desde_bytes = decodificador.decodificar(struct_registros(len(registros)).pack(*registros))
+        self.assertEqual(desde_registros, desde_bytes)
+        return dict(zip(decodificador.nombres, desde_bytes))
+
+    def test_float32_en_cada_orden(self):
+        alto, bajo = registros_de(">f", 3.5)
+        cable = {
+            "ABCD": [alto, bajo],
+            "CDAB": [bajo, alto],
+            "BADC": [int.from_bytes(r.to_bytes(2, "little"), "big") for r in (alto, bajo)],
+            "DCBA": list(struct.unpack(">HH", struct.pack("<f", 3.5))),
+        }
+        for orden, registros in cable.items():
+            with self.subTest(orden=orden):
+                tags = mapa({"nombre": "f", "direccion": 0, "tipo": "float32", "orden": orden})
+                self.assertEqual(self.decodificar(tags, registros), {"f": 3.5})
+
+    def test_int32_cdab_negativo(self):
+        alto, bajo = registros_de(">i", -123456)
+        tags = mapa({"nombre": "i", "direccion": 0, "tipo": "int32", "orden": "CDAB"})
+        self.assertEqual(self.decodificar(tags, [bajo, alto]), {"i": -123456})
+
+    def test_orden_solo_en_su_campo(self):
+        alto, bajo = registros_de(">f", -1.25)
+        tags = mapa({"nombre": "a", "direccion": 0, "tipo": "int16"},
+                    {"nombre": "f", "direccion": 1, "tipo": "float32", "orden": "CDAB"},
+                    {"nombre": "b", "direccion": 3})
+        self.assertEqual(self.decodificar(tags, [0xFFFF, bajo, alto, 42]), {"a": -1, "f": -1.25, "b": 42})
+
+    def test_campos_de_bits_en_un_registro(self):
+        tags = mapa({"nombre": "marcha", "direccion": 0, "bit": 0},
+                    {"nombre": "modo", "direccion": 0, "bit": 3, "bits": 2},
+                    {"nombre": "alarma", "direccion": 0, "bit": 15})
+        self.assertEqual(self.decodificar(tags, [0b1000_0000_0001_0001]),
+                         {"marcha": 1, "modo": 2, "alarma": 1})
+
+    def test_escala_y_offset(self):
+        tags = mapa({"nombre": "t", "direccion": 0, "tipo": "int16", "escala": 0.1, "offset": -5})
+        valores = self.decodificar(tags, [struct.unpack(">H", struct.pack(">h", -250))[0]])
+        self.assertAlmostEqual(valores["t"], -30.0)
+
+    def test_hueco_entre_tags(self):
+        tags = mapa({"nombre": "a", "direccion": 0}, {"nombre": "b", "direccion": 5})
+        self.assertEqual(self.decodificar(tags, [7, 1, 2, 3, 4, 9]), {"a": 7, "b": 9})
+
+class PruebaValidacion(unittest.TestCase):
+
+    def test_solapamiento(self):
+        with self.assertRaises(ValueError):
+            mapa({"nombre": "x", "direccion": 0, "tipo": "int32"}, {"nombre": "y", "direccion": 1})
+
+    def test_bit_fuera_del_registro(self):
+        with self.assertRaises(ValueError):
+            mapa({"nombre": "x", "direccion": 0, "bit": 15, "bits": 2})
+
+    def test_orden_desconocido(self):
+        with self.assertRaises(ValueError):
+            mapa({"nombre": "x", "direccion": 0, "tipo": "float32", "orden": "ACBD"})
+
+if __name__ == "__main__":
+    unittest.main()
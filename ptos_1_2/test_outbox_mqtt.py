@@ -0,0 +1,158 @@
+# ---------- Pruebas del outbox MQTT ----------
+#
+# Con el broker caído los mensajes quedan en disco; al reconectar se
+# reenvían en orden y cada fila se borra recién cuando paho confirma su
+# publicación. Se usa un cliente falso con la misma interfaz que paho
+# (is_connected, publish -> MQTTMessageInfo).
+#
+# Uso: python -m pytest test_outbox_mqtt.py
+# ---------------------------------------------------------------------
+
+import os
+import tempfile
+import unittest
+
+from paho.mqtt.packettypes import PacketTypes
+from paho.mqtt.properties import Properties
+
+from outbox_mqtt import DESCARTAR_NUEVOS, OutboxMQTT
+
+class InfoFalsa:
+    """MQTTMessageInfo: publicado o no según el cliente al publicar."""
+
+    def __init__(self, publicado):
+        self.publicado = publicado
+
+    def wait_for_publish(self, timeout=None):
+        pass
+
+    def is_published(self):
+        return self.publicado
+
+class ClienteFalso:
+
+    def __init__(self):
+        self.conectado = False
+        self.confirmar = True   # paho confirma (PUBACK) lo que se publica
+        self.publicados = []    # (tópico, payload, qos, retain, properties)
+
+    def is_connected(self):
+        return self.conectado
+
+    def publish(self, topico, payload, qos=0, retain=False, properties=None):
+        self.publicados.append((topico, payload, qos, retain, properties))
+        return InfoFalsa(self.confirmar)
+
+class PruebaOutbox(unittest.TestCase):
+
+    def setUp(self):
+        self.directorio = tempfile.TemporaryDirectory()
+        self.ruta = os.path.join(self.directorio.name, "outbox.db")
+        self.cliente = ClienteFalso()
+        self.outbox = OutboxMQTT(self.cliente, self.ruta, tasa_reenvio=0)
+
+    def tearDown(self):
+        self.outbox.cerrar()
+        self.directorio.cleanup()
+
+    def test_directo_con_conexion(self):
+        self.cliente.conectado = True
+        self.outbox.publicar("a/b", "1", qos=1)
+        self.assertEqual(self.cliente.publicados, [("a/b", "1", 1, False, None)])
+        self.assertEqual(self.outbox.pendientes(), 0)
+
+    def test_reenvio_tras_corte(self):
+        for i in range(5):
+            self.outbox.publicar("t", str(i), qos=1, retain=i == 4)
+        self.assertEqual(self.cliente.publicados, [])
+        self.assertEqual(self.outbox.pendientes(), 5)
+
+        self.cliente.conectado = True
+        # Con atrasos, lo nuevo también va al disco para no romper el orden
+        self.outbox.publicar("t", "5", qos=1)
+        self.assertEqual(self.cliente.publicados, [])
+
+        self.assertTrue(self.outbox._reenviar_lote())
+        self.assertEqual([(p[1], p[2], p[3]) for p in self.cliente.publicados],
+                         [(str(i).encode(), 1, i == 4) for i in range(6)])
+        self.assertEqual(self.outbox.pendientes(), 0)
+
+    def test_sin_confirmacion_no_se_borra(self):
+        self.outbox.publicar("t", "x", qos=1)
+        self.cliente.conectado = True
+        self.cliente.confirmar = False
+        self.assertFalse(self.outbox._reenviar_lote())
+        self.assertEqual(self.outbox.pendientes(), 1)
+
+        self.cliente.confirmar = True
+        self.assertTrue(self.outbox._reenviar_lote())
+        self.assertEqual([p[1] for p in self.cliente.publicados], [b"x", b"x"])
+        self.assertEqual(self.outbox.pendientes(), 0)
+
+    def test_confirmacion_parcial_borra_solo_lo_confirmado(self):
+        for i in range(3):
+            self.outbox.publicar("t", str(i), qos=1)
+        self.cliente.conectado = True
+        publicar = self.cliente.publish
+        def publicar_con_corte(topico, payload, **kwargs):
+            self.cliente.confirmar = payload != b"1" # Se corta tras el primero
+            return publicar(topico, payload, **kwargs)
+        self.cliente.publish = publicar_con_corte
+        self.assertFalse(self.outbox._reenviar_lote())
+        self.assertEqual(self.outbox.pendientes(), 2)
+
+        self.cliente.publish = publicar
+        self.cliente.publicados.clear()
+        self.assertTrue(self.outbox._reenviar_lote())
+        self.assertEqual([p[1] for p in self.cliente.publicados], [b"1", b"2"])
+
+    def test_corte_durante_el_reenvio(self):
+        for i in range(3):
+            self.outbox.publicar("t", str(i), qos=1)
+        self.cliente.conectado = True
+        publicar = self.cliente.publish
+        def publicar_y_caer(*args, **kwargs):
+            self.cliente.conectado = False
+            return publicar(*args, **kwargs)
+        self.cliente.publish = publicar_y_caer
+        self.assertFalse(self.outbox._reenviar_lote())
+        self.assertEqual(len(self.cliente.publicados), 1)
+        self.assertEqual(self.outbox.pendientes(), 2)
+
+    def test_pendientes_sobreviven_al_reinicio(self):
+        propiedades = Properties(PacketTypes.PUBLISH)
+        propiedades.UserProperty = [("t_adq", "123")]
+        self.outbox.publicar("t", "x", qos=1, properties=propiedades)
+        self.outbox.cerrar()
+
+        self.outbox = OutboxMQTT(self.cliente, self.ruta, tasa_reenvio=0)
+        self.assertEqual(self.outbox.pendientes(), 1)
+        self.cliente.conectado = True
+        self.assertTrue(self.outbox._reenviar_lote())
+        self.assertEqual(self.cliente.publicados[0][4].UserProperty, [("t_adq", "123")])
+
+    def test_sin_persistir_se_descarta(self):
+        self.outbox.publicar("estado", "vivo", persistir=False)
+        self.assertEqual(self.outbox.pendientes(), 0)
+
+    def test_tope_descarta_nuevos(self):
+        self.outbox.max_mensajes = 2
+        self.outbox.politica = DESCARTAR_NUEVOS
+        for i in range(4):
+            self.outbox.publicar("t", str(i))
+        self.assertEqual((self.outbox.pendientes(), self.outbox.descartados), (2, 2))
+        self.cliente.conectado = True
+        self.outbox._reenviar_lote()
+        self.assertEqual([p[1] for p in self.cliente.publicados], [b"0", b"1"])
+
+    def test_tope_descarta_viejos(self):
+        self.outbox.max_mensajes = 2
+        for i in range(4):
+            self.outbox.publicar("t", str(i))
+        self.assertEqual((self.outbox.pendientes(), self.outbox.descartados), (2, 2))
+        self.cliente.conectado = True
+        self.outbox._reenviar_lote()
+        self.assertEqual([p[1] for p in self.cliente.publicados], [b"2", b"3"])
+
+if __name__ == "__main__":
+    unittest.main()
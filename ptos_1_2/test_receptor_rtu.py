@@ -0,0 +1,71 @@
+# ---------- Pruebas del receptor RTU sobre un pty ----------
+#
+# Una trama truncada tiene que cortarse por el silencio t3.5 entre
+# caracteres, no por el timeout de respuesta del puerto.
+#
+# Uso: python -m pytest test_receptor_rtu.py
+# ---------------------------------------------------------------------
+
+import os
+import threading
+import time
+import unittest
+
+import serial
+
+from crc_modbus import agregar_crc
+from receptor_rtu import configurar_puerto, leer_respuesta, longitud_respuesta, transaccion
+
+BAUDIOS = 9600
+MARGEN = 0.05 # s de holgura para el planificador del sistema
+
+class PruebaTramaTruncada(unittest.TestCase):
+
+    def setUp(self):
+        self.fd_maestro, fd_esclavo = os.openpty()
+        self.ser = serial.Serial(os.ttyname(fd_esclavo), BAUDIOS, timeout=2.0)
+        os.close(fd_esclavo)
+        self.intercaracter = configurar_puerto(self.ser, BAUDIOS)
+
+    def tearDown(self):
+        self.ser.close()
+        os.close(self.fd_maestro)
+
+    def leer(self, datos, cantidad=3):
+        os.write(self.fd_maestro, datos)
+        inicio = time.monotonic()
+        resultado = leer_respuesta(self.ser, 1, 0x03, longitud_respuesta(0x03, cantidad))
+        return resultado, time.monotonic() - inicio
+
+    def test_trama_completa(self):
+        trama = agregar_crc(bytes([1, 0x03, 6, 0, 1, 0, 2, 0, 3]))
+        (estado, respuesta), _ = self.leer(trama)
+        self.assertEqual(estado, "OK")
+        self.assertEqual(respuesta, trama)
+
+    def test_trama_truncada_corta_en_t35(self):
+        trama = agregar_crc(bytes([1, 0x03, 6, 0, 1, 0, 2, 0, 3]))
+        (estado, respuesta), duracion = self.leer(trama[:5])
+        self.assertEqual(estado, "ERROR_TRAMA_INCOMPLETA")
+        self.assertIsNone(respuesta)
+        self.assertLess(duracion, self.intercaracter + MARGEN)
+
+    def test_excepcion_no_espera_la_longitud_normal(self):
+        trama = agregar_crc(bytes([1, 0x83, 0x02]))
+        (estado, respuesta), duracion = self.leer(trama)
+        self.assertEqual(estado, "ERROR_ESCLAVO")
+        self.assertEqual(respuesta, trama)
+        self.assertLess(duracion, MARGEN)
+
+    def test_descarta_respuesta_tardia(self):
+        # Restos de una respuesta anterior en el buffer; la buena llega después de la petición
+        os.write(self.fd_maestro, bytes([7, 7, 7]))
+        trama = agregar_crc(bytes([1, 0x03, 2, 0, 9]))
+        peticion = agregar_crc(bytes([1, 0x03, 0, 0, 0, 1]))
+        threading.Timer(0.05, os.write, (self.fd_maestro, trama)).start()
+        estado, respuesta = transaccion(self.ser, peticion, 1, 0x03, longitud_respuesta(0x03, 1), 1.0, BAUDIOS)
+        self.assertEqual(estado, "OK")
+        self.assertEqual(respuesta, trama)
+
+if __name__ == "__main__":
+    unittest.main()
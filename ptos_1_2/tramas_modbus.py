@@ -0,0 +1,64 @@
+# ---------- Construcción de tramas Modbus RTU ----------
+#
+# Funciones que arman las peticiones (ya con CRC) que envía el maestro y
+# validan las respuestas de escritura.
+#
+# ---------------------------------------------------------------------
+
+import struct
+
+from crc_modbus import agregar_crc
+
+FUNCION_LEER_REGISTROS = 0x03
+FUNCION_LEER_ENTRADAS = 0x04
+FUNCION_ESCRIBIR_COIL = 0x05
+FUNCION_ESCRIBIR_REGISTRO = 0x06
+FUNCION_ESCRIBIR_COILS = 0x0F
+FUNCION_ESCRIBIR_REGISTROS = 0x10
+
+MAX_COILS_POR_ESCRITURA = 1968
+MAX_REGISTROS_POR_ESCRITURA = 123
+
+COIL_ON = 0xFF00
+COIL_OFF = 0x0000
+
+_cabecera_pdu = struct.Struct('>BBHH')
+
+def trama_lectura(id_esclavo, funcion, inicio, cantidad):
+    """Petición FC03/FC04."""
+    return agregar_crc(_cabecera_pdu.pack(id_esclavo, funcion, inicio, cantidad))
+
+def trama_escribir_coil(id_esclavo, direccion, encendido):
+    """Petición FC05 (1 bit)."""
+    valor = COIL_ON if encendido else COIL_OFF
+    return agregar_crc(_cabecera_pdu.pack(id_esclavo, FUNCION_ESCRIBIR_COIL, direccion, valor))
+
+def trama_escribir_registro(id_esclavo, direccion, valor):
+    """Petición FC06 (16 bits)."""
+    return agregar_crc(_cabecera_pdu.pack(id_esclavo, FUNCION_ESCRIBIR_REGISTRO, direccion, valor))
+
+def trama_escribir_coils(id_esclavo, inicio, valores):
+    """Petición FC15 (varios bits contiguos)."""
+    empaquetado = bytearray((len(valores) + 7) // 8)
+    for i, valor in enumerate(valores):
+        if valor:
+            empaquetado[i // 8] |= 1 << (i % 8)
+    cabecera = _cabecera_pdu.pack(id_esclavo, FUNCION_ESCRIBIR_COILS, inicio, len(valores))
+    return agregar_crc(cabecera + bytes([len(empaquetado)]) + empaquetado)
+
+def trama_escribir_registros(id_esclavo, inicio, valores):
+    """Petición FC16 (varios registros contiguos)."""
+    cabecera = _cabecera_pdu.pack(id_esclavo, FUNCION_ESCRIBIR_REGISTROS, inicio, len(valores))
+    datos = struct.pack(f'>B{len(valores)}H', 2 * len(valores), *valores)
+    return agregar_crc(cabecera + datos)
+
+def confirmar_escritura(peticion, respuesta):
+    """
+    FC05/FC06: el esclavo confirma devolviendo la misma trama (eco).
+    FC15/FC16: devuelve esclavo, función, dirección y cantidad (6 bytes + CRC).
+    """
+    if respuesta is None:
+        return False
+    if peticion[1] in (FUNCION_ESCRIBIR_COILS, FUNCION_ESCRIBIR_REGISTROS):
+        return bytes(respuesta[:6]) == bytes(peticion[:6])
+    return bytes(respuesta) == bytes(peticion)
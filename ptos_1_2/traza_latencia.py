@@ -0,0 +1,129 @@
+# ---------- Trazado de latencia extremo a extremo ----------
+#
+# Cada valor de un tag lleva, además del dato, los sellos de tiempo de
+# los saltos por los que pasó (ns desde epoch, time.time_ns()):
+#   t_adq     maestro: llegó la respuesta Modbus (imagen de proceso y
+#             SourceTimestamp del nodo OPC UA)
+#   t_opc     servidor OPC UA: set_value (ServerTimestamp del nodo)
+#   t_bridge  bridge: el valor se leyó / llegó por la suscripción OPC
+#   t_pub     bridge: el mensaje se entregó a paho (o al outbox)
+#   t_rx      analizador: el mensaje llegó del broker
+# En MQTT los sellos viajan como User Properties de MQTT v5 (el payload
+# no cambia, los suscriptores de siempre no se enteran) o, con brokers /
+# clientes v3.1.1, en un sobre JSON opcional: {"v": valor, "traza": {...}}.
+#
+# Midiendo cada salto por separado se ve de dónde sale una demora: el sondeo
+# del servidor (maestro→opc), el periodo del bridge (opc→bridge), el
+# outbox (bridge→mqtt) o el broker / la WAN (mqtt→destino). Los sellos
+# de equipos distintos solo son comparables con los relojes en NTP.
+#
+# ---------------------------------------------------------------------
+
+import json
+import statistics
+from collections import deque
+from datetime import datetime, timedelta
+
+from paho.mqtt.packettypes import PacketTypes
+from paho.mqtt.properties import Properties
+
+SELLOS = ("t_adq", "t_opc", "t_bridge", "t_pub", "t_rx")
+# Salto -> (sello de entrada, sello de salida); solo se mide si están los dos
+SALTOS = {
+    "maestro→opc":   ("t_adq", "t_opc"),
+    "opc→bridge":    ("t_opc", "t_bridge"),
+    "bridge→mqtt":   ("t_bridge", "t_pub"),
+    "mqtt→destino":  ("t_pub", "t_rx"),
+    "total":         ("t_adq", "t_rx"),
+}
+# Modos de transporte de la traza en MQTT
+TRAZA_NO = "no"
+TRAZA_PROPIEDADES = "propiedades" # User Properties (requiere MQTT v5)
+TRAZA_SOBRE = "sobre"             # {"v": valor, "traza": {...}} en el payload
+
+_EPOCH = datetime(1970, 1, 1)
+
+def fecha_desde_ns(t_ns):
+    """ns epoch -> datetime UTC naive (lo que usa python-opcua)."""
+    return _EPOCH + timedelta(microseconds=t_ns // 1000)
+
+def ns_desde_fecha(fecha):
+    """datetime UTC naive de python-opcua -> ns epoch (resolución de µs)."""
+    delta = fecha - _EPOCH
+    return (delta.days * 86400 + delta.seconds) * 1_000_000_000 + delta.microseconds * 1000
+
+def traza_opc(timestamp_origen, timestamp_servidor, t_bridge):
+    """Sellos de un valor leído del servidor OPC UA (SourceTimestamp =
+    adquisición, ServerTimestamp = set_value) más el instante en que lo
+    recibió el bridge."""
+    traza = {"t_bridge": t_bridge}
+    if timestamp_origen is not None:
+        traza["t_adq"] = ns_desde_fecha(timestamp_origen)
+    if timestamp_servidor is not None:
+        traza["t_opc"] = ns_desde_fecha(timestamp_servidor)
+    return traza
+
+# --- Transporte en MQTT ---
+def propiedades_mqtt(traza):
+    """Properties de PUBLISH (MQTT v5) con un User Property por sello."""
+    propiedades = Properties(PacketTypes.PUBLISH)
+    propiedades.UserProperty = [(sello, str(traza[sello])) for sello in SELLOS if sello in traza]
+    return propiedades
+
+def sobre_json(valor, traza):
+    return json.dumps({"v": valor, "traza": traza})
+
+def preparar(valor, traza, modo):
+    """(payload, properties) listos para publish() según el modo de traza."""
+    if modo == TRAZA_PROPIEDADES:
+        return valor, propiedades_mqtt(traza)
+    if modo == TRAZA_SOBRE:
+        return sobre_json(valor, traza), None
+    return valor, None
+
+def leer_traza(mensaje):
+    """Sellos de un mensaje MQTT recibido (User Properties o sobre JSON), o None."""
+    propiedades = getattr(mensaje, "properties", None)
+    pares = getattr(propiedades, "UserProperty", None) if propiedades is not None else None
+    if pares:
+        traza = {sello: int(valor) for sello, valor in pares if sello in SELLOS}
+        if traza:
+            return traza
+    if mensaje.payload[:1] != b"{":
+        return None
+    try:
+        contenido = json.loads(mensaje.payload)
+    except ValueError:
+        return None
+    traza = contenido.get("traza") if isinstance(contenido, dict) else None
+    return {sello: int(traza[sello]) for sello in SELLOS if sello in traza} if traza else None
+
+class AnalizadorLatencia:
+    """Latencias por salto (ventana de las últimas `ventana` muestras)."""
+
+    def __init__(self, ventana=10000):
+        self.muestras = {salto: deque(maxlen=ventana) for salto in SALTOS}
+        self.mensajes = 0
+
+    def registrar(self, traza):
+        self.mensajes += 1
+        for salto, (entrada, salida) in SALTOS.items():
+            if entrada in traza and salida in traza:
+                self.muestras[salto].append((traza[salida] - traza[entrada]) / 1e6)
+
+    def percentiles(self):
+        """{salto: (n, p50, p95, p99, máx)} en ms, de los saltos con muestras."""
+        resultado = {}
+        for salto, muestras in self.muestras.items():
+            if not muestras:
+                continue
+            ordenadas = sorted(muestras)
+            cuantiles = statistics.quantiles(ordenadas, n=100, method="inclusive") if len(ordenadas) >= 2 else ordenadas * 99
+            resultado[salto] = (len(ordenadas), cuantiles[49], cuantiles[94], cuantiles[98], ordenadas[-1])
+        return resultado
+
+    def informe(self):
+        lineas = [f"{'salto':<16}{'n':>8}{'p50 ms':>11}{'p95 ms':>11}{'p99 ms':>11}{'máx ms':>11}"]
+        for salto, (n, p50, p95, p99, maximo) in self.percentiles().items():
+            lineas.append(f"{salto:<16}{n:>8}{p50:>11.2f}{p95:>11.2f}{p99:>11.2f}{maximo:>11.2f}")
+        return "\n".join(lineas)